@@ -10,7 +10,7 @@ source "proxmox-iso" "debian_12_base" {
   insecure_skip_tls_verify = var.insecure_tls # disables https checks during connections
 
   // virtual machine settings
-  vm_id               = 9000
+  vm_id               = var.vm_id
   vm_name             = "debian-12-base"
   template_description = local.build_description
   memory              = 4096
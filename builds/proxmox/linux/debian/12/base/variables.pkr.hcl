@@ -20,6 +20,12 @@ variable "node" {
   description = "The proxmox node on which to build the virtual machine"
 }
 
+variable "vm_id" {
+  type        = number
+  description = "The ID of the template VM (buildManager.py can lease one from a pool)"
+  default     = 9000
+}
+
 variable "pool" {
   type        = string
   description = "The name of the resource pool in which to create the virtual machine"
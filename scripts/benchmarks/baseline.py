@@ -0,0 +1,125 @@
+"""
+JSON baselines for the build manager benchmarks
+
+A baseline records one benchmark's results together with the parameters,
+machine and commit they were measured on. ``compare`` checks fresh results
+against it: metrics ending in ``_seconds`` regress when they grow, rates
+(``_per_second``) and ``utilisation`` values when they shrink, by more than
+a relative threshold.
+"""
+
+import json
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+def add_arguments(parser) -> None:
+    """Add the --save-baseline/--compare/--threshold options to a benchmark"""
+    parser.add_argument("--save-baseline", type=Path, metavar="PATH", help="Write the results to a JSON baseline")
+    parser.add_argument("--compare", type=Path, metavar="PATH", help="Compare the results with a JSON baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=20.0,
+        metavar="PERCENT",
+        help="Relative change that counts as a regression (default: 20)"
+    )
+
+
+def _commit(repo: Path) -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=repo, capture_output=True, text=True, check=False
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def save(path: Path, benchmark: str, params: Dict, results: Dict) -> None:
+    data = {
+        "benchmark": benchmark,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": _commit(Path(__file__).resolve().parent),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, indent=2) + "\n")
+
+
+def _direction(metric: str) -> int:
+    """1 when larger is worse, -1 when smaller is worse, 0 for informational values"""
+    name = metric.rsplit(".", 1)[-1]
+    if name.endswith("_per_second") or name.endswith("utilisation"):
+        return -1
+    if name.endswith("_seconds"):
+        return 1
+    return 0
+
+
+def _flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(path: Path, benchmark: str, params: Dict, results: Dict, threshold: float) -> List[str]:
+    """Print how results differ from a baseline and return the regressed metrics"""
+    baseline = json.loads(path.read_text())
+    if baseline.get("benchmark") != benchmark:
+        raise ValueError(f"{path} is a baseline of '{baseline.get('benchmark')}', not '{benchmark}'")
+    if baseline.get("params") != params:
+        print(f"Warning: baseline parameters differ: {baseline.get('params')}", file=sys.stderr)
+    
+    old = _flatten(baseline.get("results", {}))
+    new = _flatten(results)
+    regressions = []
+    width = max((len(m) for m in new), default=10)
+    print(f"\nCompared with {path} ({baseline.get('commit') or 'unknown commit'}, "
+          f"{baseline.get('created')}, threshold {threshold:g}%)\n")
+    print(f"  {'metric':<{width}}  {'baseline':>12}  {'current':>12}  {'change':>8}")
+    for metric, value in new.items():
+        if metric not in old:
+            continue
+        before = old[metric]
+        change = (value - before) / before * 100 if before else 0.0
+        direction = _direction(metric)
+        flag = ""
+        if direction and change * direction > threshold:
+            regressions.append(metric)
+            flag = "  REGRESSION"
+        elif direction and change * direction < -threshold:
+            flag = "  improved"
+        print(f"  {metric:<{width}}  {before:>12.4g}  {value:>12.4g}  {change:>+7.1f}%{flag}")
+    print()
+    return regressions
+
+
+def finish(args, benchmark: str, params: Dict, results: Dict) -> int:
+    """Save and/or compare a benchmark's results as its options ask; return the exit code"""
+    if args.save_baseline:
+        save(args.save_baseline, benchmark, params, results)
+        print(f"Baseline written to {args.save_baseline}", file=sys.stderr)
+    if args.compare:
+        try:
+            regressions = compare(args.compare, benchmark, params, results, args.threshold)
+        except (OSError, ValueError) as e:
+            print(f"Error: cannot compare with {args.compare}: {e}", file=sys.stderr)
+            return 1
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:g}%: "
+                  f"{', '.join(regressions)}")
+            return 1
+    return 0
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Discovery, HCL parsing and selector benchmark for buildManager.py
+
+Generates a synthetic builds/ tree that mirrors the layout of this repository
+(base proxmox-iso builds plus multi-source proxmox-clone variants, each with
+data/, drivers/ and manifests/ directories) and times how long the build
+manager takes to discover and parse it and to resolve --os/--source
+selectors against it.
+
+Usage:
+    # Default: 10000 build directories in a temporary directory
+    python scripts/benchmarks/bench_discovery.py
+
+    # Smaller tree, keep it around for inspection
+    python scripts/benchmarks/bench_discovery.py --builds 2000 --keep /tmp/bench-tree
+
+    # Record a baseline, then check a change against it
+    python scripts/benchmarks/bench_discovery.py --save-baseline baselines/discovery.json
+    python scripts/benchmarks/bench_discovery.py --compare baselines/discovery.json
+"""
+
+import argparse
+import json
+import re
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import baseline  # noqa: E402
+import buildManager  # noqa: E402
+
+
+BASE_SOURCES = '''// proxmox-iso source
+source "proxmox-iso" "bench_{i}_base" {{
+  proxmox_url = "https://${{var.proxmox_host}}:8006/api2/json"
+  username    = var.token_id
+  token       = var.token_secret
+  node        = var.node
+
+  vm_id       = {vm_id}
+  vm_name     = "bench-{i}-base"
+  memory      = 4096
+  cores       = 2
+  sockets     = 2
+
+  boot_iso {{
+    type     = "scsi"
+    iso_file = "local:iso/bench.iso"
+    unmount  = true
+  }}
+
+  additional_iso_files {{
+    cd_files = [
+      "${{path.cwd}}/drivers",
+      "../../../scripts"
+    ]
+    cd_content = {{
+      "autounattend.xml" = templatefile("${{abspath(path.root)}}/data/autounattend.pkrtpl.hcl", {{
+        username = var.username
+      }})
+    }}
+  }}
+
+  boot_command = [
+    "<esc><wait>",
+    "auto preseed/url=http://{{{{ .HTTPIP }}}}:{{{{ .HTTPPort }}}}/ks.cfg",
+    "<enter><wait>"
+  ]
+}}
+'''
+
+CLONE_SOURCE = '''
+source "proxmox-clone" "bench_{i}_{role}" {{
+  node        = var.node
+  clone_vm_id = var.clone_vm_id
+  vm_id       = {vm_id}
+  vm_name     = "bench-{i}-{role}"
+  memory      = 2048
+  cores       = 2
+}}
+'''
+
+BUILD = '''packer {{
+  required_plugins {{
+    proxmox = {{
+      version = ">= 1.1.3"
+      source  = "github.com/hashicorp/proxmox"
+    }}
+  }}
+}}
+
+locals {{
+  manifest_date = formatdate("YYYY-MM-DD-hh-mm-ss", timestamp())
+}}
+
+build {{
+  name    = "bench_{i}"
+  sources = [{sources}]
+
+  provisioner "ansible-local" {{
+    playbook_file = "${{path.root}}/../../../../ansible/role-${{split("_", source.name)[2]}}.yml"
+  }}
+
+  post-processor "manifest" {{
+    output = "./manifests/${{local.manifest_date}}.json"
+  }}
+}}
+'''
+
+VARIABLES = '''variable "node" {{
+  type    = string
+  default = "pve{node}"
+}}
+
+variable "clone_vm_id" {{
+  type    = number
+  default = {clone}
+}}
+
+variable "additional_packages" {{
+  type = list(string)
+  default = [
+    "curl",
+    "vim"
+  ]
+}}
+'''
+
+ROLES = ["apache", "docker", "mysql", "tomcat"]
+
+
+def generate_tree(root: Path, count: int, manifests: int) -> None:
+    """Write ``count`` synthetic build directories below ``root/builds``"""
+    (root / ".git").mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        group, index = divmod(i, 100)
+        is_base = i % 5 == 0
+        variant = "base" if is_base else f"variant{i % 5}"
+        build_dir = root / "builds" / "proxmox" / "linux" / f"distro{group}" / str(index) / variant
+        build_dir.mkdir(parents=True, exist_ok=True)
+        
+        vm_id = 10000 + i * 10
+        if is_base:
+            sources_text = BASE_SOURCES.format(i=i, vm_id=vm_id)
+            refs = [f'"source.proxmox-iso.bench_{i}_base"']
+        else:
+            sources_text = "".join(
+                CLONE_SOURCE.format(i=i, role=role, vm_id=vm_id + n) for n, role in enumerate(ROLES)
+            )
+            refs = [f'"source.proxmox-clone.bench_{i}_{role}"' for role in ROLES]
+        
+        (build_dir / "sources.pkr.hcl").write_text(sources_text)
+        (build_dir / "build.pkr.hcl").write_text(BUILD.format(i=i, sources=", ".join(refs)))
+        (build_dir / "variables.pkr.hcl").write_text(
+            VARIABLES.format(node=i % 4, clone=10000 + (i - i % 5) * 10)
+        )
+        
+        data_dir = build_dir / "data"
+        data_dir.mkdir(exist_ok=True)
+        (data_dir / "autounattend.pkrtpl.hcl").write_text("<unattend>${username}</unattend>\n")
+        
+        manifests_dir = build_dir / "manifests"
+        manifests_dir.mkdir(exist_ok=True)
+        for m in range(manifests):
+            (manifests_dir / f"2025-01-01-00-00-{m:02d}.json").write_text('{"builds": []}\n')
+
+
+SOURCE_PATTERN = re.compile(r'source\s+"([^"]+)"\s+"([^"]+)"\s*{')
+BUILD_NAME_PATTERN = re.compile(r'build\s*{\s*name\s*=\s*"([^"]+)"')
+
+
+def discover_before_index(root: Path) -> list:
+    """Discovery as it worked before the index: rglob per provider, regex per file
+    
+    Mirrors the original ``_discover_builds`` and ``PackerBuild`` constructor so
+    the cold and warm numbers have a reference to be compared against.
+    """
+    builds = []
+    for provider_dir in (root / "builds").iterdir():
+        if not provider_dir.is_dir() or provider_dir.name.startswith('.'):
+            continue
+        for build_file in provider_dir.rglob("build.pkr.hcl"):
+            build_path = build_file.parent
+            rel_path = build_path.relative_to(provider_dir)
+            os_type = rel_path.parts[0] if rel_path.parts else "unknown"
+            
+            sources = []
+            sources_file = build_path / "sources.pkr.hcl"
+            if sources_file.exists():
+                sources = [f"{m.group(1)}.{m.group(2)}" for m in SOURCE_PATTERN.finditer(sources_file.read_text())]
+            match = BUILD_NAME_PATTERN.search(build_file.read_text())
+            name = match.group(1) if match else build_path.name
+            builds.append((provider_dir.name, os_type, build_path, name, sources))
+    return sorted(builds, key=lambda b: (b[0], b[1], b[2].name))
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def run(root: Path, count: int) -> dict:
+    """Time the discovery and parsing phases against a generated tree"""
+    results = {"builds": count}
+    hcl_files = sorted((root / "builds").rglob("*.pkr.hcl"))
+    contents = [p.read_text() for p in hcl_files]
+    total_bytes = sum(len(c) for c in contents)
+    indexer = buildManager.HclIndexer()
+    
+    elapsed, _ = timed(lambda: [indexer.parse(c) for c in contents])
+    results["parse_files"] = len(contents)
+    results["parse_seconds"] = elapsed
+    results["parse_mb_per_second"] = total_bytes / elapsed / 1e6
+    
+    elapsed, _ = timed(lambda: list((root / "builds").rglob("build.pkr.hcl")))
+    results["rglob_seconds"] = elapsed
+    
+    elapsed, before = timed(lambda: discover_before_index(root))
+    results["pre_index_discovery_seconds"] = elapsed
+    assert len(before) == count, f"expected {count} builds, found {len(before)}"
+    
+    def discover(refresh: bool):
+        manager = buildManager.PackerBuildManager(root, refresh_index=refresh)
+        for build in manager.builds:
+            build.sources
+        manager.save_index()
+        return manager
+    
+    elapsed, manager = timed(lambda: discover(True))
+    results["cold_discovery_seconds"] = elapsed
+    assert len(manager.builds) == count, f"expected {count} builds, found {len(manager.builds)}"
+    
+    elapsed, _ = timed(lambda: discover(False))
+    results["warm_discovery_seconds"] = elapsed
+    
+    elapsed, _ = timed(lambda: buildManager.BuildGraph(manager.builds))
+    results["graph_seconds"] = elapsed
+    
+    results.update(run_selectors(manager, count))
+    return results
+
+
+def best_of(rounds: int, func):
+    """Fastest of several runs, which keeps sub-millisecond timings comparable"""
+    return min(timed(func)[0] for _ in range(rounds))
+
+
+def run_selectors(manager, count: int, lookups: int = 200, rounds: int = 5) -> dict:
+    """Time --os/--source resolution for hits spread over the tree and misses"""
+    step = max(1, count // lookups)
+    indices = range(0, count, step)
+    # Path patterns like "debian/12"; misses scan every build
+    patterns = ["distro{}/{}/".format(*divmod(i, 100)) for i in indices] + ["no-such-build"] * 10
+    sources = [
+        f"proxmox-iso.bench_{i}_base" if i % 5 == 0 else f"proxmox-clone.bench_{i}_docker"
+        for i in indices
+    ] + ["proxmox-iso.no_such_source"] * 10
+    
+    assert all(manager.find_build_by_pattern(p) for p in patterns[:-10]), "a build pattern did not match"
+    assert all(manager.find_build_by_source(s) for s in sources[:-10]), "a source did not match"
+    globs = [f"*bench_{i}_*" for i in list(indices)[:20]]
+    return {
+        "selector_lookups": len(patterns) + len(sources) + len(globs),
+        "find_pattern_seconds": best_of(rounds, lambda: [manager.find_build_by_pattern(p) for p in patterns])
+                                / len(patterns),
+        "find_source_seconds": best_of(rounds, lambda: [manager.find_build_by_source(s) for s in sources])
+                               / len(sources),
+        "find_glob_seconds": best_of(rounds, lambda: [manager.find_builds(g) for g in globs]) / len(globs),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark build discovery and HCL parsing",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument("--builds", type=int, default=10000, help="Number of build directories (default: 10000)")
+    parser.add_argument("--manifests", type=int, default=20, help="Manifest files per build (default: 20)")
+    parser.add_argument("--keep", type=Path, help="Generate the tree here and keep it")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+    params = {"builds": args.builds, "manifests": args.manifests}
+    
+    root = args.keep or Path(tempfile.mkdtemp(prefix="bm-bench-"))
+    try:
+        if not (root / "builds").exists():
+            print(f"Generating {args.builds} builds in {root}...", file=sys.stderr)
+            generate_tree(root, args.builds, args.manifests)
+        results = run(root, args.builds)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return baseline.finish(args, "discovery", params, results)
+    
+    print(f"\nDiscovery benchmark ({results['builds']} builds)\n")
+    print(f"  HCL parse:        {results['parse_files']} files in {results['parse_seconds']:.3f}s "
+          f"({results['parse_mb_per_second']:.1f} MB/s)")
+    print(f"  rglob reference:  {results['rglob_seconds']:.3f}s")
+    print(f"  Pre-index:        {results['pre_index_discovery_seconds']:.3f}s (rglob + regex parse)")
+    print(f"  Cold discovery:   {results['cold_discovery_seconds']:.3f}s")
+    print(f"  Warm discovery:   {results['warm_discovery_seconds']:.3f}s "
+          f"({results['pre_index_discovery_seconds'] / results['warm_discovery_seconds']:.1f}x pre-index)")
+    print(f"  Dependency graph: {results['graph_seconds']:.3f}s")
+    print(f"  --os lookup:      {results['find_pattern_seconds'] * 1000:.3f} ms")
+    print(f"  --source lookup:  {results['find_source_seconds'] * 1000:.3f} ms")
+    print(f"  Glob selector:    {results['find_glob_seconds'] * 1000:.3f} ms\n")
+    return baseline.finish(args, "discovery", params, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
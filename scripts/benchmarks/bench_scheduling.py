@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+End-to-end scheduling benchmark for buildManager.py
+
+Generates a synthetic builds/ tree (see bench_discovery.py), puts
+fake_packer.py on PATH as ``packer`` and runs real build manager command
+lines against it: independent builds on a worker pool, clones waiting for
+their base templates, flaky builds with retries and tree-wide validation.
+The stub's per-invocation log shows how well the scheduler kept its
+workers busy.
+
+Usage:
+    # Default: 100 build directories, 8 workers, 50 ms per build step
+    python scripts/benchmarks/bench_scheduling.py
+
+    # Only some scenarios, slower steps, with failures
+    python scripts/benchmarks/bench_scheduling.py --scenario independent --scenario with-deps \\
+        --step-seconds 0.2 --fail-rate 0.05
+
+    # Record a baseline, then check a change against it
+    python scripts/benchmarks/bench_scheduling.py --save-baseline baselines/scheduling.json
+    python scripts/benchmarks/bench_scheduling.py --compare baselines/scheduling.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import stat
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import baseline  # noqa: E402
+import buildManager  # noqa: E402
+from bench_discovery import generate_tree  # noqa: E402
+
+FAKE_PACKER = Path(__file__).resolve().parent / "fake_packer.py"
+
+
+def install_fake_packer(bin_dir: Path) -> None:
+    """Make ``packer`` on PATH run fake_packer.py"""
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    if os.name == "nt":
+        (bin_dir / "packer.cmd").write_text(f'@"{sys.executable}" "{FAKE_PACKER}" %*\r\n')
+        return
+    wrapper = bin_dir / "packer"
+    wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_PACKER}" "$@"\n')
+    wrapper.chmod(wrapper.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def selector(i: int) -> str:
+    """--os pattern of the i-th generated build directory"""
+    group, index = divmod(i, 100)
+    variant = "base" if i % 5 == 0 else f"variant{i % 5}"
+    return f"/distro{group}/{index}/{variant}"
+
+
+def scenarios(count: int, workers: int) -> dict:
+    """Command lines of every scenario, keyed by name"""
+    bases = [i for i in range(count) if i % 5 == 0]
+    clones = [i for i in range(count) if i % 5][:max(1, count // 5)]
+    common = ["--parallel", str(workers), "--progress", "0", "--no-vm-leases", "--force"]
+    return {
+        # Single-source base templates, nothing to wait for
+        "independent": [a for i in bases for a in ("--os", selector(i))] + common,
+        # Four-source clones whose base templates are pulled in and built first
+        "with-deps": [a for i in clones for a in ("--os", selector(i))] + ["--with-deps"] + common,
+        # Base templates on a flaky cluster, retried once
+        "flaky": [a for i in bases for a in ("--os", selector(i))]
+                 + common + ["--retries", "1", "--retry-backoff", "0"],
+        # packer validate of every directory
+        "validate": ["--validate-all", "--parallel", str(workers)],
+    }
+
+
+def packer_stats(path: Path, started: float, wall: float, workers: int) -> dict:
+    """Summarize the stub's invocation log of one scenario"""
+    runs = []
+    if path.exists():
+        runs = [json.loads(line) for line in path.read_text().splitlines() if line]
+    busy = sum(r["end"] - r["start"] for r in runs)
+    # Highest number of packer processes alive at once
+    events = sorted([(r["start"], 1) for r in runs] + [(r["end"], -1) for r in runs])
+    alive = peak = 0
+    for _, delta in events:
+        alive += delta
+        peak = max(peak, alive)
+    first = min((r["start"] for r in runs), default=started)
+    return {
+        "packer_runs": len(runs),
+        "packer_failures": sum(1 for r in runs if r["returncode"] != 0),
+        "packer_busy_seconds": busy,
+        "peak_concurrency": peak,
+        "startup_seconds": first - started,
+        # Share of the worker pool's time spent inside packer
+        "utilisation": busy / (wall * workers) if wall > 0 else 0.0,
+    }
+
+
+def run_scenario(root: Path, name: str, argv: list, workers: int) -> dict:
+    """Run one command line in-process and time it"""
+    stats = root / f"packer-{name}.jsonl"
+    stats.unlink(missing_ok=True)
+    # Let transient failures strike again
+    for marker in (root / "builds").rglob(".fake-packer-*"):
+        marker.unlink()
+    os.environ["FAKE_PACKER_STATS"] = str(stats)
+    
+    parser = buildManager.build_parser()
+    args = parser.parse_args(argv + ["--repo-root", str(root)])
+    buildManager.check_args(parser, args)
+    
+    started = time.time()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        manager = buildManager.PackerBuildManager(root)
+        return_code = buildManager.configure_run(manager, args)
+        if return_code == 0:
+            try:
+                return_code = buildManager.run_cli(manager, args)
+            finally:
+                manager.save_index()
+    wall = time.time() - started
+    
+    results = {"wall_seconds": wall, "returncode": return_code}
+    results.update(packer_stats(stats, started, wall, workers))
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark build scheduling end to end against a stub packer",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument("--builds", type=int, default=100, help="Number of build directories (default: 100)")
+    parser.add_argument("--workers", type=int, default=8, help="--parallel of every scenario (default: 8)")
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=["independent", "with-deps", "flaky", "validate"],
+        help="Scenario to run (repeatable, default: all)"
+    )
+    parser.add_argument("--step-seconds", type=float, default=0.05, help="Duration of one build step (default: 0.05)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Random +/- fraction of each step (default: 0.2)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of sources that fail (default: 0)")
+    parser.add_argument(
+        "--transient-rate",
+        type=float,
+        default=0.2,
+        help="Share of sources that fail once with a retryable error in the flaky scenario (default: 0.2)"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each scenario, reported as the median (default: 3)")
+    parser.add_argument("--seed", default="bench", help="Seed that picks the failing sources (default: bench)")
+    parser.add_argument("--keep", type=Path, help="Generate the tree here and keep it")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+    
+    names = args.scenario or ["independent", "with-deps", "flaky", "validate"]
+    params = {
+        "builds": args.builds, "workers": args.workers, "scenarios": names,
+        "step_seconds": args.step_seconds, "jitter": args.jitter, "fail_rate": args.fail_rate,
+        "transient_rate": args.transient_rate, "seed": args.seed, "repeat": args.repeat,
+    }
+    
+    root = args.keep or Path(tempfile.mkdtemp(prefix="bm-sched-"))
+    saved_env = dict(os.environ)
+    results = {}
+    try:
+        if not (root / "builds").exists():
+            print(f"Generating {args.builds} builds in {root}...", file=sys.stderr)
+            generate_tree(root, args.builds, 0)
+        install_fake_packer(root / "bin")
+        os.environ["PATH"] = f"{root / 'bin'}{os.pathsep}{os.environ.get('PATH', '')}"
+        os.environ.update({
+            "FAKE_PACKER_STEP_SECONDS": str(args.step_seconds),
+            "FAKE_PACKER_JITTER": str(args.jitter),
+            "FAKE_PACKER_FAIL_RATE": str(args.fail_rate),
+            "FAKE_PACKER_SEED": args.seed,
+            "FAKE_PACKER_INIT_SECONDS": str(args.step_seconds),
+            "FAKE_PACKER_VALIDATE_SECONDS": str(args.step_seconds),
+        })
+        for name, argv in scenarios(args.builds, args.workers).items():
+            if name not in names:
+                continue
+            os.environ["FAKE_PACKER_TRANSIENT_RATE"] = str(args.transient_rate if name == "flaky" else 0)
+            runs = []
+            for n in range(args.repeat):
+                print(f"Running {name} ({n + 1}/{args.repeat})...", file=sys.stderr)
+                runs.append(run_scenario(root, name, argv, args.workers))
+            # Median of every metric, which keeps baselines comparable on a busy machine
+            results[name] = {
+                key: max(r[key] for r in runs) if key == "returncode" else statistics.median(r[key] for r in runs)
+                for key in runs[0]
+            }
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_env)
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return baseline.finish(args, "scheduling", params, results)
+    
+    print(f"\nScheduling benchmark ({args.builds} builds, {args.workers} workers, "
+          f"{args.step_seconds:g}s steps)\n")
+    print(f"  {'scenario':<12}  {'wall':>8}  {'packer':>8}  {'runs':>5}  {'failed':>6}  "
+          f"{'peak':>4}  {'startup':>8}  {'utilisation':>11}  exit")
+    for name, r in results.items():
+        print(f"  {name:<12}  {r['wall_seconds']:>7.2f}s  {r['packer_busy_seconds']:>7.2f}s  "
+              f"{r['packer_runs']:>5}  {r['packer_failures']:>6}  {r['peak_concurrency']:>4}  "
+              f"{r['startup_seconds']:>7.2f}s  {r['utilisation']:>10.0%}  {r['returncode']:>4}")
+    print()
+    return baseline.finish(args, "scheduling", params, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Stub ``packer`` executable for benchmarking buildManager.py
+
+Answers ``init``, ``validate``, ``build`` and ``version`` the way packer
+does, without touching a hypervisor. ``build`` walks every selected source
+through the steps of a Proxmox build (create/clone, boot, communicator,
+provisioning, shutdown, template), prints them as normal or
+``-machine-readable`` UI output with artifact records, honours ``-only``
+and ``-parallel-builds`` and writes a manifest like the ``manifest``
+post-processor. SIGINT stops the build after a short cleanup.
+
+Behaviour is configured through the environment:
+
+    FAKE_PACKER_STEP_SECONDS    Duration of one build step (default: 0.05)
+    FAKE_PACKER_JITTER          Random +/- fraction of every delay (default: 0.2)
+    FAKE_PACKER_FAIL_RATE       Probability that a source errors (default: 0)
+    FAKE_PACKER_TRANSIENT_RATE  Probability that a source errors once with a
+                                retryable Proxmox timeout (default: 0)
+    FAKE_PACKER_SEED            Makes the failing sources reproducible
+    FAKE_PACKER_INIT_SECONDS    Duration of ``packer init`` (default: 0.2)
+    FAKE_PACKER_VALIDATE_SECONDS  Duration of ``packer validate`` (default: 0.05)
+    FAKE_PACKER_STATS           JSON-lines file that every invocation appends its
+                                command, arguments, directory, start, end and exit
+                                code to
+
+bench_scheduling.py installs it as ``packer`` on PATH; it can also be used by
+hand, e.g. ``ln -s $PWD/scripts/benchmarks/fake_packer.py ~/bin/packer``.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent builds of one directory may interleave manifests
+    fcntl = None
+
+STEPS = {
+    "proxmox-iso": [
+        "Creating VM",
+        "Starting VM",
+        "Mounting ISO local:iso/bench.iso",
+        "Typing the boot command",
+        "Waiting for SSH to become available...",
+        "Connected to SSH!",
+        "Provisioning with shell script: scripts/setup.sh",
+        "Stopping VM",
+        "Converting VM to template",
+    ],
+    "proxmox-clone": [
+        "Cloning VM",
+        "Starting VM",
+        "Waiting for SSH to become available...",
+        "Connected to SSH!",
+        "Provisioning with Ansible...",
+        "Stopping VM",
+        "Converting VM to template",
+    ],
+}
+DEFAULT_STEPS = [
+    "Prevalidating",
+    "Creating temporary resources",
+    "Waiting for SSH to become available...",
+    "Provisioning with shell script: scripts/setup.sh",
+    "Stopping instance",
+    "Saving image",
+]
+TRANSIENT_ERROR = "error creating VM: 500 got timeout waiting for task"
+FAILURE = "Script exited with non-zero exit status: 1. Allowed exit codes are: [0]"
+
+lock = threading.Lock()
+stopping = threading.Event()
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def pause(seconds: float) -> None:
+    jitter = env_float("FAKE_PACKER_JITTER", 0.2)
+    if stopping.wait(max(0.0, seconds * (1 + random.uniform(-jitter, jitter)))):
+        raise KeyboardInterrupt
+
+
+class Output:
+    """Packer's normal or machine-readable UI"""
+    
+    def __init__(self, machine_readable: bool):
+        self.machine_readable = machine_readable
+    
+    def record(self, target: str, kind: str, *data: str) -> None:
+        fields = ",".join(d.replace(",", "%!(PACKER_COMMA)").replace("\n", "\\n") for d in data)
+        with lock:
+            print(f"{int(time.time())},{target},{kind},{fields}", flush=True)
+    
+    def say(self, message: str, target: str = "") -> None:
+        if self.machine_readable:
+            self.record(target, "ui", "say", message)
+        else:
+            with lock:
+                print(message, flush=True)
+    
+    def message(self, message: str, target: str = "") -> None:
+        if self.machine_readable:
+            self.record(target, "ui", "message", message)
+        else:
+            with lock:
+                print(message, flush=True)
+    
+    def error(self, message: str, target: str = "") -> None:
+        if self.machine_readable:
+            self.record(target, "ui", "error", message)
+        else:
+            with lock:
+                print(message, file=sys.stderr, flush=True)
+
+
+def config_sources() -> list:
+    sources = []
+    for path in sorted(glob.glob("*.pkr.hcl")):
+        with open(path) as f:
+            sources += [f"{t}.{n}" for t, n in re.findall(r'source\s+"([^"]+)"\s+"([^"]+)"', f.read())]
+    return sources
+
+
+def option(args: list, name: str):
+    for i, arg in enumerate(args):
+        if arg == f"-{name}" and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith(f"-{name}="):
+            return arg.split("=", 1)[1]
+    return None
+
+
+def outcome(source: str) -> str:
+    """``ok``, ``transient`` or ``failed``, reproducible with FAKE_PACKER_SEED"""
+    seed = os.environ.get("FAKE_PACKER_SEED")
+    # Keyed by the end of the build path, so that regenerated trees fail alike
+    where = "/".join(os.getcwd().replace(os.sep, "/").split("/")[-3:])
+    rng = random.Random(hashlib.sha256(f"{seed}:{where}:{source}".encode()).digest()) if seed else random
+    roll = rng.random()
+    fail_rate = env_float("FAKE_PACKER_FAIL_RATE", 0)
+    if roll < fail_rate:
+        return "failed"
+    if roll < fail_rate + env_float("FAKE_PACKER_TRANSIENT_RATE", 0):
+        # Transient errors only hit the first attempt
+        marker = os.path.join("manifests", f".fake-packer-{source}")
+        if not os.path.exists(marker):
+            os.makedirs("manifests", exist_ok=True)
+            open(marker, "w").close()
+            return "transient"
+    return "ok"
+
+
+def build_source(out: Output, source: str, vm_id: int, results: dict) -> None:
+    builder, _, name = source.partition(".")
+    started = time.monotonic()
+    step_seconds = env_float("FAKE_PACKER_STEP_SECONDS", 0.05)
+    result = outcome(source)
+    steps = STEPS.get(builder, DEFAULT_STEPS)
+    # Failures happen during provisioning, transient errors while creating the VM
+    fail_at = 0 if result == "transient" else len(steps) - 3 if result == "failed" else None
+    try:
+        for n, step in enumerate(steps):
+            out.say(f"==> {source}: {step}", source)
+            if step.startswith("Provisioning"):
+                out.message(f"    {source}: + apt-get install -y curl vim", source)
+            pause(step_seconds)
+            if n == fail_at:
+                message = TRANSIENT_ERROR if result == "transient" else FAILURE
+                out.error(f"==> {source}: {message}", source)
+                raise RuntimeError(message)
+    except KeyboardInterrupt:
+        out.say(f"==> {source}: Stopping VM", source)
+        out.say(f"==> {source}: Deleting VM", source)
+        out.error(f"Build '{source}' errored after {time.monotonic() - started:.3f} seconds: "
+                  f"build was cancelled", source)
+        results[source] = None
+        return
+    except RuntimeError as e:
+        out.say(f"==> {source}: Deleting VM", source)
+        out.error(f"Build '{source}' errored after {time.monotonic() - started:.3f} seconds: {e}", source)
+        results[source] = None
+        return
+    
+    out.say(f"Build '{source}' finished after {time.monotonic() - started:.3f} seconds.", source)
+    if out.machine_readable:
+        out.record(source, "artifact-count", "1")
+        out.record(source, "artifact", "0", "builder-id", f"proxmox.{builder}")
+        out.record(source, "artifact", "0", "id", str(vm_id))
+        out.record(source, "artifact", "0", "string", f"A template was created: {vm_id}")
+        out.record(source, "artifact", "0", "files-count", "0")
+        out.record(source, "artifact", "0", "end")
+    results[source] = vm_id
+
+
+def write_manifest(results: dict, run_uuid: str) -> None:
+    """Append the successful builds to a manifest, like the manifest post-processor"""
+    builds = [
+        {
+            "name": source.partition(".")[2],
+            "builder_type": source.partition(".")[0],
+            "build_time": int(time.time()),
+            "files": None,
+            "artifact_id": str(vm_id),
+            "packer_run_uuid": run_uuid,
+            "custom_data": {"build_date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
+        }
+        for source, vm_id in results.items() if vm_id is not None
+    ]
+    if not builds:
+        return
+    os.makedirs("manifests", exist_ok=True)
+    path = os.path.join("manifests", time.strftime("%Y-%m-%d-%H-%M-%S", time.gmtime()) + ".json")
+    with open(path, "a+") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        try:
+            data = json.loads(f.read() or "{}")
+        except ValueError:
+            data = {}
+        data.setdefault("builds", []).extend(builds)
+        data["last_run_uuid"] = run_uuid
+        f.seek(0)
+        f.truncate()
+        json.dump(data, f, indent=2)
+
+
+def build(out: Output, args: list) -> int:
+    only = option(args, "only")
+    sources = only.split(",") if only else config_sources()
+    lanes = int(option(args, "parallel-builds") or 0) or len(sources) or 1
+    limit = threading.Semaphore(lanes)
+    results: dict = {}
+    base_id = 100 + int(hashlib.sha256(os.getcwd().encode()).hexdigest()[:6], 16) % 100000
+    
+    def lane(n: int, source: str) -> None:
+        with limit:
+            if stopping.is_set():
+                results[source] = None
+                return
+            build_source(out, source, base_id + n, results)
+    
+    threads = [threading.Thread(target=lane, args=(n, s)) for n, s in enumerate(sources)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(0.1)
+    
+    write_manifest(results, str(uuid.uuid4()))
+    failed = [s for s in sources if results.get(s) is None]
+    if stopping.is_set():
+        out.error("Cleanly cancelled builds after being interrupted.")
+        return 1
+    if failed:
+        out.error("\n==> Some builds didn't complete successfully and had errors:")
+        for source in failed:
+            out.error(f"--> {source}: build failed")
+    out.say("\n==> Builds finished. The artifacts of successful builds are:")
+    for source, vm_id in results.items():
+        if vm_id is not None:
+            out.say(f"--> {source}: A template was created: {vm_id}", source)
+    return 1 if failed else 0
+
+
+def init() -> int:
+    plugin_path = os.environ.get("PACKER_PLUGIN_PATH")
+    for path in sorted(glob.glob("*.pkr.hcl")):
+        with open(path) as f:
+            for plugin in re.findall(r'source\s*=\s*"(github\.com/[^"]+)"', f.read()):
+                print(f"Installed plugin {plugin} v1.2.1 in \"{plugin_path}/{plugin}\"", flush=True)
+                if plugin_path:
+                    directory = os.path.join(plugin_path, plugin)
+                    os.makedirs(directory, exist_ok=True)
+                    name = f"packer-plugin-{plugin.rsplit('/', 1)[1]}_v1.2.1_x5.0_linux_amd64"
+                    with open(os.path.join(directory, name), "wb") as f:
+                        f.write(b"\0" * 64 * 1024)
+    pause(env_float("FAKE_PACKER_INIT_SECONDS", 0.2))
+    return 0
+
+
+def main() -> int:
+    args = sys.argv[1:]
+    machine_readable = "-machine-readable" in args
+    if machine_readable:
+        args.remove("-machine-readable")
+    command = args[0] if args else ""
+    out = Output(machine_readable)
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    
+    started = time.time()
+    try:
+        if command == "version":
+            print("Packer v1.11.2 (fake)")
+            return_code = 0
+        elif command == "init":
+            return_code = init()
+        elif command == "validate":
+            pause(env_float("FAKE_PACKER_VALIDATE_SECONDS", 0.05))
+            print("The configuration is valid.", flush=True)
+            return_code = 0
+        elif command == "build":
+            return_code = build(out, args[1:])
+        else:
+            print(f"fake packer: unsupported command '{command}'", file=sys.stderr)
+            return_code = 1
+    except KeyboardInterrupt:
+        return_code = 1
+    
+    stats = os.environ.get("FAKE_PACKER_STATS")
+    if stats:
+        record = {"command": command, "args": args[1:], "cwd": os.getcwd(), "start": started,
+                  "end": time.time(), "returncode": return_code}
+        with open(stats, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    return return_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
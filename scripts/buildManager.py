@@ -18,24 +18,79 @@ Usage:
     # Build specific source
     python buildManager.py --source proxmox-iso.debian_12_base
     
+    # Build several templates concurrently (at most 2 on Proxmox at once)
+    python buildManager.py --os debian-13 --os windows-11 --parallel 4 --provider-limit proxmox=2
+    
     # List all available builds
     python buildManager.py --list
     
     # Validate only (no build)
     python buildManager.py --os debian-12 --validate-only
     
+    # Validate every template concurrently and write a JUnit report
+    python buildManager.py --validate-all --report validate.xml
+    
     # Force init even if already initialized
     python buildManager.py --os debian-12 --force-init
+    
+    # Query the build history (latest artifacts, duration trends, builds of a commit)
+    python buildManager.py history latest
+    python buildManager.py history trend windows_11
+    python buildManager.py history commit 214f3cd
+    
+    # Keep a daemon with a warm index and submit builds to its job queue
+    python buildManager.py serve --slots 4
+    python buildManager.py --server unix:.buildmanager/serve.sock --os debian-12
+    python buildManager.py jobs tail last --follow
 """
 
 import argparse
+import asyncio
+import calendar
+import contextlib
+import fnmatch
+import gzip
+import hashlib
+import http.client
+import io
 import json
 import os
 import re
+import signal
+import socket
+import sqlite3
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for --log-compression zstd
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: leases are only serialized within one process
+    fcntl = None
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11: use a YAML inventory instead
+    tomllib = None
+
+try:
+    import yaml
+except ImportError:  # optional, only needed for YAML node inventories
+    yaml = None
 
 
 class Colors:
@@ -51,63 +106,774 @@ class Colors:
     UNDERLINE = '\033[4m'
 
 
+# A whole HCL expression that is just a variable, e.g. ``var.vm_id``
+_VAR_REFERENCE = re.compile(r"var\.([A-Za-z_][\w-]*)")
+
+
 class PackerBuild:
     """Represents a single Packer build configuration"""
     
-    def __init__(self, path: Path, cloud_provider: str, os_type: str):
+    def __init__(
+        self,
+        path: Path,
+        cloud_provider: str,
+        os_type: str,
+        index: Optional["DiscoveryIndex"] = None
+    ):
         self.path = path
         self.cloud_provider = cloud_provider
         self.os_type = os_type
-        self.sources = self._discover_sources()
-        self.build_name = self._get_build_name()
         self.variables_file = path / "variables.auto.pkrvars.hcl"
+        self._index = index
+        self._metadata: Optional[Dict] = None
+        self._metadata_lock = threading.Lock()
     
-    def _discover_sources(self) -> List[str]:
-        """Discover all sources defined in sources.pkr.hcl"""
-        sources_file = self.path / "sources.pkr.hcl"
-        if not sources_file.exists():
-            return []
-        
-        sources = []
-        content = sources_file.read_text()
-        
-        # Match: source "type" "name" {
-        pattern = r'source\s+"([^"]+)"\s+"([^"]+)"\s*{'
-        for match in re.finditer(pattern, content):
-            source_type = match.group(1)
-            source_name = match.group(2)
-            sources.append(f"{source_type}.{source_name}")
-        
-        return sources
+    def metadata(self) -> Dict:
+        """Parsed build metadata, loaded from the discovery index or the HCL files on first use"""
+        if self._metadata is None:
+            with self._metadata_lock:
+                if self._metadata is None:
+                    self._metadata = self._load_metadata()
+        return self._metadata
     
-    def _get_build_name(self) -> str:
-        """Extract build name from build.pkr.hcl"""
-        build_file = self.path / "build.pkr.hcl"
-        if not build_file.exists():
-            return self.path.name
+    def _load_metadata(self) -> Dict:
+        stamps = DiscoveryIndex.stamps(self.path) if self._index else None
+        if stamps is not None:
+            metadata = self._index.lookup(self.path, stamps)
+            if metadata is not None:
+                return metadata
         
-        content = build_file.read_text()
+        metadata = HclIndexer().index_directory(self.path)
+        if stamps is not None:
+            self._index.store(self.path, stamps, metadata)
+        return metadata
+    
+    @property
+    def sources(self) -> List[str]:
+        return self.metadata()["sources"]
+    
+    @property
+    def build_name(self) -> str:
+        return self.metadata()["build_name"]
+    
+    @property
+    def source_settings(self) -> Dict[str, Dict[str, str]]:
+        return self.metadata()["source_settings"]
+    
+    @property
+    def variable_defaults(self) -> Dict[str, str]:
+        return self.metadata()["variable_defaults"]
+    
+    @property
+    def required_plugins(self) -> Dict[str, Dict[str, str]]:
+        return self.metadata()["required_plugins"]
+    
+    @property
+    def file_refs(self) -> List[str]:
+        return self.metadata()["file_refs"]
+    
+    @property
+    def build_blocks(self) -> List[Dict]:
+        return self.metadata()["builds"]
+    
+    @property
+    def source_refs(self) -> Dict[str, List[str]]:
+        return self.metadata()["source_refs"]
+    
+    def resolve_setting(self, source: str, name: str) -> Optional[str]:
+        """Resolve a source attribute, following var.* references to their defaults"""
+        value = self.source_settings.get(source, {}).get(name)
+        if value is None:
+            return None
         
-        # Match: build { name = "name"
-        match = re.search(r'build\s*{\s*name\s*=\s*"([^"]+)"', content)
+        match = _VAR_REFERENCE.fullmatch(value)
         if match:
-            return match.group(1)
+            value = self.variable_defaults.get(match.group(1))
+            if value is None:
+                return None
         
-        return self.path.name
+        return value.strip('"')
+    
+    def resolve_int(self, source: str, name: str) -> Optional[int]:
+        """Resolve a source attribute that should be an integer"""
+        value = self.resolve_setting(source, name)
+        if value is None or not value.isdigit():
+            return None
+        return int(value)
     
     def __repr__(self):
         return f"PackerBuild({self.cloud_provider}/{self.os_type}/{self.path.name})"
 
 
+_STRING_SPECIAL = re.compile(r'["\\{}]|\$\{')
+
+
+def _string_end(content: str, start: int) -> int:
+    """Return the index just past the string literal that opens at ``start``"""
+    depth = 0
+    pos = start + 1
+    search = _STRING_SPECIAL.search
+    while True:
+        match = search(content, pos)
+        if match is None:
+            return len(content)
+        token = match.group()
+        pos = match.end()
+        if token == "\\":
+            pos += 1
+        elif depth == 0:
+            if token == '"':
+                return pos
+            if token == "${":
+                depth = 1
+        elif token == '"':
+            # Nested string inside an interpolation, e.g. ${split("_", x)}
+            pos = _string_end(content, match.start())
+        elif token in ("{", "${"):
+            depth += 1
+        elif token == "}":
+            depth -= 1
+
+
+
+class HclBlock:
+    """A parsed HCL block: its type, labels, attributes and nested blocks"""
+    
+    __slots__ = ("type", "labels", "attributes", "blocks")
+    
+    def __init__(self, block_type: str, labels: List[str]):
+        self.type = block_type
+        self.labels = labels
+        self.attributes: Dict[str, str] = {}
+        self.blocks: List["HclBlock"] = []
+    
+    def __repr__(self):
+        return f"HclBlock({self.type} {' '.join(self.labels)})"
+
+
+class HclIndexer:
+    """Single-pass tokenizer and parser for the subset of HCL2 used by Packer templates
+    
+    Every ``*.pkr.hcl`` file of a build directory is tokenized once and folded
+    into a JSON-serializable index of sources, build blocks, variables, plugin
+    requirements and file references. Attribute values are kept as their raw
+    expression text, e.g. ``9000``, ``var.node`` or ``"local:iso/x.iso"``.
+    """
+    
+    _TOKEN = re.compile(r'''
+        [ \t\r]*(?:
+            (?P<skip>\#[^\n]*|//[^\n]*|/\*.*?\*/)
+          | (?P<newline>\n)
+          | (?P<string>"(?:[^"\\$\n]|\\.|\$(?!\{))*")
+          | (?P<template>")
+          | (?P<heredoc><<-?(?P<marker>[A-Za-z_]\w*)[ \t]*\n)
+          | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+          | (?P<ident>[A-Za-z_][\w-]*)
+          | (?P<punct>==|!=|<=|>=|&&|\|\||=>|\.\.\.|[{}\[\]()=,.:?!<>+\-*/%])
+          | (?P<other>\S)
+        )
+    ''', re.VERBOSE | re.DOTALL)
+    
+    # Path-like strings that may point at files feeding a build
+    _PATH_PREFIXES = ("${path.root}", "${abspath(path.root)}", "${path.cwd}", "./", "../")
+    
+    def tokenize(self, content: str) -> List[Tuple[str, str, int, int]]:
+        """Split HCL text into (kind, value, start, end) tokens
+        
+        String values are returned without their quotes; interpolations such as
+        ``${split("_", source.name)}`` are kept verbatim inside the string.
+        """
+        tokens = []
+        append = tokens.append
+        pos = 0
+        length = len(content)
+        finditer = self._TOKEN.finditer
+        while pos < length:
+            restart = None
+            for m in finditer(content, pos):
+                kind = m.lastgroup
+                if kind == "skip":
+                    continue
+                if kind == "string":
+                    start, end = m.span(kind)
+                    append(("string", content[start + 1:end - 1], start, end))
+                elif kind == "template":
+                    # Strings with ${...} interpolations may nest quotes
+                    start = m.start(kind)
+                    restart = _string_end(content, start)
+                    append(("string", content[start + 1:restart - 1], start, restart))
+                    break
+                elif kind in ("heredoc", "marker"):
+                    start = m.start("heredoc")
+                    terminator = re.compile(
+                        r'^[ \t]*' + re.escape(m.group("marker")) + r'[ \t]*$', re.MULTILINE
+                    ).search(content, m.end())
+                    restart = terminator.end() if terminator else length
+                    body_end = terminator.start() if terminator else length
+                    append(("heredoc", content[m.end():body_end], start, restart))
+                    break
+                else:
+                    start, end = m.span(kind)
+                    append(("punct" if kind == "other" else kind, m.group(kind), start, end))
+            if restart is None:
+                break
+            pos = restart
+        return tokens
+    
+    def parse(self, content: str, tokens: Optional[List[Tuple[str, str, int, int]]] = None) -> HclBlock:
+        """Parse HCL text into a tree of blocks rooted at a synthetic ``file`` block"""
+        if tokens is None:
+            tokens = self.tokenize(content)
+        root = HclBlock("file", [])
+        self._parse_body(content, tokens, 0, root)
+        return root
+    
+    def _parse_body(self, content: str, tokens: List[Tuple[str, str, int, int]], i: int, block: HclBlock) -> int:
+        count = len(tokens)
+        while i < count:
+            kind, value = tokens[i][0], tokens[i][1]
+            if kind == "newline" or value == ",":
+                i += 1
+                continue
+            if kind == "punct" and value == "}":
+                return i + 1
+            if kind not in ("ident", "string"):
+                i += 1
+                continue
+            
+            # Attribute: name = expression
+            if kind == "ident" and i + 1 < count and tokens[i + 1][1] == "=" and tokens[i + 1][0] == "punct":
+                i, raw = self._parse_expression(content, tokens, i + 2)
+                block.attributes[value] = raw
+                continue
+            
+            # Block: type "label" ... {
+            labels = []
+            j = i + 1
+            while j < count and tokens[j][0] in ("string", "ident"):
+                labels.append(tokens[j][1])
+                j += 1
+            if j < count and tokens[j][1] == "{":
+                child = HclBlock(value, labels)
+                block.blocks.append(child)
+                i = self._parse_body(content, tokens, j + 1, child)
+            else:
+                i = j
+        return i
+    
+    def _parse_expression(self, content: str, tokens: List[Tuple[str, str, int, int]], i: int) -> Tuple[int, str]:
+        """Consume an expression up to the end of its line and return its raw text"""
+        count = len(tokens)
+        start = i
+        depth = 0
+        while i < count:
+            kind, value = tokens[i][0], tokens[i][1]
+            if kind == "punct":
+                if value in "([{":
+                    depth += 1
+                elif value in ")]}":
+                    if depth == 0:
+                        break
+                    depth -= 1
+                elif value == "," and depth == 0:
+                    break
+            elif kind == "newline" and depth == 0:
+                break
+            i += 1
+        if i == start:
+            return i, ""
+        return i, content[tokens[start][2]:tokens[i - 1][3]]
+    
+    def index_directory(self, path: Path) -> Dict:
+        """Parse every *.pkr.hcl file of a build directory into one index"""
+        index = {
+            "sources": [],
+            "source_settings": {},
+            "builds": [],
+            "build_name": path.name,
+            "variable_defaults": {},
+            "locals": {},
+            "required_plugins": {},
+            "file_refs": [],
+            "source_refs": {},
+        }
+        
+        build_names = []
+        file_refs = set()
+        # build.pkr.hcl first so its build block names the directory
+        files = sorted(path.glob("*.pkr.hcl"), key=lambda p: (p.name != "build.pkr.hcl", p.name))
+        for hcl_file in files:
+            try:
+                content = hcl_file.read_text()
+            except (OSError, UnicodeDecodeError):
+                continue
+            
+            tokens = self.tokenize(content)
+            for kind, value, _, _ in tokens:
+                if kind == "string" and value.startswith(self._PATH_PREFIXES):
+                    file_refs.add(value)
+            
+            for block in self.parse(content, tokens).blocks:
+                self._index_block(block, hcl_file.name, index, build_names)
+        
+        if build_names:
+            index["build_name"] = build_names[0]
+        index["file_refs"] = sorted(file_refs)
+        return index
+    
+    def _block_refs(self, block: HclBlock) -> List[str]:
+        """Path-like strings used anywhere inside a block"""
+        refs = set()
+        for raw in block.attributes.values():
+            for kind, value, _, _ in self.tokenize(raw):
+                if kind == "string" and value.startswith(self._PATH_PREFIXES):
+                    refs.add(value)
+        for child in block.blocks:
+            refs.update(self._block_refs(child))
+        return sorted(refs)
+    
+    def _index_block(self, block: HclBlock, filename: str, index: Dict, build_names: List[str]) -> None:
+        if block.type == "source" and len(block.labels) == 2:
+            source = f"{block.labels[0]}.{block.labels[1]}"
+            if source not in index["source_settings"]:
+                index["sources"].append(source)
+            index["source_settings"][source] = block.attributes
+            index["source_refs"][source] = self._block_refs(block)
+        
+        elif block.type == "build":
+            name = block.attributes.get("name", "").strip('"')
+            refs = re.findall(r'"source\.([^"]+)"', block.attributes.get("sources", ""))
+            # Nested source "source.type.name" { ... } blocks also select sources
+            refs.extend(
+                b.labels[0][len("source."):] for b in block.blocks
+                if b.type == "source" and b.labels and b.labels[0].startswith("source.")
+            )
+            index["builds"].append({
+                "name": name, "file": filename, "sources": refs, "file_refs": self._block_refs(block)
+            })
+            if name:
+                build_names.append(name)
+        
+        elif block.type == "variable" and block.labels:
+            if "default" in block.attributes:
+                index["variable_defaults"][block.labels[0]] = block.attributes["default"]
+        
+        elif block.type == "locals":
+            index["locals"].update(block.attributes)
+        
+        elif block.type == "packer":
+            for child in block.blocks:
+                if child.type != "required_plugins":
+                    continue
+                for plugin, raw in child.attributes.items():
+                    version = re.search(r'version\s*=\s*"([^"]*)"', raw)
+                    source = re.search(r'source\s*=\s*"([^"]*)"', raw)
+                    index["required_plugins"][plugin] = {
+                        "source": source.group(1) if source else "",
+                        "version": version.group(1) if version else "",
+                    }
+
+
+class DiscoveryIndex:
+    """On-disk cache of the build tree walk and of parsed build metadata"""
+    
+    VERSION = 3
+    
+    def __init__(self, path: Path, root: Path):
+        self.path = path
+        self.root = root
+        self._root = os.fspath(root)
+        self._prefix = os.path.join(self._root, "")
+        self.data = self._load()
+        self.dirty = False
+        self._lock = threading.Lock()
+    
+    def _load(self) -> Dict:
+        try:
+            data = json.loads(self.path.read_text())
+            if data.get("version") == self.VERSION:
+                return data
+        except (OSError, ValueError):
+            pass
+        return {"version": self.VERSION, "dirs": {}, "builds": {}}
+    
+    def _key(self, path) -> str:
+        path = os.fspath(path)
+        if path == self._root:
+            return "."
+        return path[len(self._prefix):].replace(os.sep, "/")
+    
+    def walk(self, directory: Path) -> List[Path]:
+        """Return every directory below ``directory`` that holds a build.pkr.hcl
+        
+        A directory whose mtime is unchanged reuses its cached listing, so large
+        leaf directories such as manifests/ or drivers/ are never re-read. The
+        walk works on plain strings; Path objects are only built for the hits.
+        """
+        found = []
+        dirs = self.data["dirs"]
+        stack = [os.fspath(directory)]
+        while stack:
+            current = stack.pop()
+            try:
+                mtime = os.stat(current).st_mtime_ns
+            except OSError:
+                continue
+            
+            key = self._key(current)
+            entry = dirs.get(key)
+            if not entry or entry["mtime_ns"] != mtime:
+                subdirs = []
+                has_build = False
+                with os.scandir(current) as entries:
+                    for item in entries:
+                        if item.name.startswith("."):
+                            continue
+                        if item.is_dir():
+                            subdirs.append(item.name)
+                        elif item.name == "build.pkr.hcl":
+                            has_build = True
+                entry = {"mtime_ns": mtime, "subdirs": sorted(subdirs), "has_build": has_build}
+                with self._lock:
+                    dirs[key] = entry
+                    self.dirty = True
+            
+            if entry["has_build"]:
+                found.append(Path(current))
+            stack.extend(os.path.join(current, name) for name in reversed(entry["subdirs"]))
+        return found
+    
+    @staticmethod
+    def stamps(build_path: Path) -> Dict[str, List[int]]:
+        """mtime/size of the directory and of every *.pkr.hcl file in it"""
+        stamps = {".": [build_path.stat().st_mtime_ns, 0]}
+        with os.scandir(build_path) as entries:
+            for item in entries:
+                if item.name.endswith(".pkr.hcl") and item.is_file():
+                    stat = item.stat()
+                    stamps[item.name] = [stat.st_mtime_ns, stat.st_size]
+        return stamps
+    
+    def lookup(self, build_path: Path, stamps: Dict[str, List[int]]) -> Optional[Dict]:
+        """Return cached metadata if none of the build's files changed"""
+        with self._lock:
+            entry = self.data["builds"].get(self._key(build_path))
+        if entry and entry.get("stamps") == stamps:
+            return entry["metadata"]
+        return None
+    
+    def store(self, build_path: Path, stamps: Dict[str, List[int]], metadata: Dict) -> None:
+        with self._lock:
+            self.data["builds"][self._key(build_path)] = {"stamps": stamps, "metadata": metadata}
+            self.dirty = True
+    
+    def prune(self, build_paths: List[Path]) -> None:
+        """Forget builds that no longer exist"""
+        keep = {self._key(p) for p in build_paths}
+        with self._lock:
+            for key in list(self.data["builds"]):
+                if key not in keep:
+                    del self.data["builds"][key]
+                    self.dirty = True
+    
+    def save(self) -> None:
+        """Write the index atomically if anything changed"""
+        with self._lock:
+            if not self.dirty:
+                return
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(self.data, separators=(",", ":")))
+                os.replace(tmp, self.path)
+                self.dirty = False
+            except OSError as e:
+                print(f"{Colors.WARNING}Warning: could not write discovery index: {e}{Colors.ENDC}")
+
+
+class BuildLog:
+    """Compressed log file that rolls over into numbered parts
+    
+    Lines are written through the compressor as they arrive, so memory use
+    does not grow with the length of a build.
+    """
+    
+    SUFFIXES = {"gzip": ".log.gz", "zstd": ".log.zst", "none": ".log"}
+    
+    def __init__(self, base: Path, compression: str = "gzip", max_bytes: int = 64 * 1024 * 1024):
+        self.base = base
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.paths: List[Path] = []
+        self._part = 0
+        self._written = 0
+        self._file = None
+    
+    def _open(self):
+        part = f".{self._part}" if self._part else ""
+        path = self.base.with_name(self.base.name + part + self.SUFFIXES[self.compression])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.paths.append(path)
+        if self.compression == "gzip":
+            return gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+        if self.compression == "zstd":
+            raw = zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb"))
+            return io.TextIOWrapper(raw, encoding="utf-8")
+        return open(path, "w", encoding="utf-8")
+    
+    def write(self, line: str) -> None:
+        if self._file is None:
+            self._file = self._open()
+        self._file.write(line + "\n")
+        self._written += len(line) + 1
+        if self._written >= self.max_bytes:
+            self._file.close()
+            self._file = None
+            self._part += 1
+            self._written = 0
+    
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class StreamingRunner:
+    """Run packer processes on a background asyncio loop and stream their output
+    
+    stdout and stderr are read line by line as they are produced and handed
+    to a callback together with the seconds elapsed since the process
+    started. One loop serves every concurrent build, so worker threads only
+    wait for the result.
+    """
+    
+    # Longest line read in one piece; longer lines are passed on in chunks
+    LINE_LIMIT = 1024 * 1024
+    # PACKER_LOG debug lines on stderr start with a wall clock timestamp
+    DEBUG_LINE = re.compile(r"^\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2} ")
+    
+    def __init__(
+        self,
+        log_dir: Path,
+        compression: str = "gzip",
+        keep: int = 20,
+        max_bytes: int = 64 * 1024 * 1024,
+        verbose: bool = False
+    ):
+        self.log_dir = log_dir
+        self.compression = compression
+        self.keep = keep
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+    
+    def configured(self, compression: str, keep: int, verbose: bool) -> "StreamingRunner":
+        """A runner with other log settings that shares this runner's loop"""
+        runner = StreamingRunner(self.log_dir, compression, keep, self.max_bytes, verbose)
+        runner._loop = self._ensure_loop()
+        return runner
+    
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="packer-output", daemon=True
+                ).start()
+            return self._loop
+    
+    def visible(self, stream: str, line: str) -> bool:
+        """Whether a line belongs on the console rather than only in the log"""
+        return self.verbose or stream == "stdout" or not self.DEBUG_LINE.match(line)
+    
+    def open_log(self, build: PackerBuild, name: str) -> BuildLog:
+        """Create the log for one packer run and prune old logs of the build"""
+        directory = self.log_dir / build.build_name
+        stamp = time.strftime("%Y%m%d-%H%M%S") + f"-{int(time.time() * 1000) % 1000:03d}"
+        safe_name = re.sub(r"[^\w.,-]+", "_", name)[:120]
+        if directory.is_dir() and self.keep > 0:
+            old = sorted(p for p in directory.iterdir() if p.is_file())
+            for path in old[:max(0, len(old) - self.keep + 1)]:
+                path.unlink(missing_ok=True)
+        return BuildLog(directory / f"{stamp}-{safe_name}", self.compression, self.max_bytes)
+    
+    def submit(
+        self,
+        cmd: List[str],
+        cwd: Path,
+        env: Dict[str, str],
+        on_line: Callable[[str, str, float], None],
+        on_start: Optional[Callable] = None,
+        new_session: bool = True
+    ):
+        """Start a process on the loop and return a future for its exit code"""
+        return asyncio.run_coroutine_threadsafe(
+            self._run(cmd, cwd, env, on_line, on_start, new_session), self._ensure_loop()
+        )
+    
+    async def _run(self, cmd, cwd, env, on_line, on_start, new_session) -> int:
+        kwargs = {}
+        if new_session:
+            if os.name == "nt":
+                kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+            else:
+                kwargs["start_new_session"] = True
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=cwd,
+            env=env,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=self.LINE_LIMIT,
+            **kwargs
+        )
+        if on_start:
+            on_start(proc)
+        started = time.monotonic()
+        await asyncio.gather(
+            self._pump(proc.stdout, "stdout", on_line, started),
+            self._pump(proc.stderr, "stderr", on_line, started),
+        )
+        return await proc.wait()
+    
+    async def _pump(self, reader: asyncio.StreamReader, stream: str, on_line, started: float) -> None:
+        while True:
+            try:
+                raw = await reader.readuntil(b"\n")
+            except asyncio.IncompleteReadError as e:
+                raw = e.partial
+            except asyncio.LimitOverrunError as e:
+                raw = await reader.read(max(e.consumed, 1))
+            if not raw:
+                return
+            on_line(stream, raw.decode("utf-8", errors="replace").rstrip("\r\n"),
+                    time.monotonic() - started)
+
+
+class PluginCache:
+    """Shared PACKER_PLUGIN_PATH that is initialized once per distinct plugin set
+    
+    Every build directory that declares the same ``required_plugins`` needs
+    the same plugin binaries, so ``packer init`` runs in one directory per
+    set. A set whose versions are unchanged since its last successful init,
+    and whose plugins are still installed, is skipped entirely.
+    """
+    
+    FILENAME = "plugins.json"
+    
+    def __init__(self, state_dir: Path, path: Optional[Path] = None):
+        env_path = os.environ.get("PACKER_PLUGIN_PATH")
+        self.path = path or (Path(env_path) if env_path else state_dir / "plugins")
+        self.state_file = state_dir / self.FILENAME
+        self.data = {"sets": {}}
+        # Held while plugin sets are initialized; daemon jobs share the cache
+        self.lock = threading.Lock()
+        if self.state_file.exists():
+            try:
+                self.data = json.loads(self.state_file.read_text())
+            except (OSError, ValueError):
+                pass
+    
+    @staticmethod
+    def plugin_set(build: PackerBuild) -> List[Tuple[str, str, str]]:
+        """Return the sorted (name, source, version) triples a build requires"""
+        return sorted(
+            (name, spec.get("source", ""), spec.get("version", ""))
+            for name, spec in build.required_plugins.items()
+        )
+    
+    @staticmethod
+    def key(plugin_set: List[Tuple[str, str, str]]) -> str:
+        return hashlib.sha256(json.dumps(plugin_set).encode()).hexdigest()[:16]
+    
+    def _plugin_files(self, plugin_set: List[Tuple[str, str, str]]) -> List[Path]:
+        files = []
+        for _, source, _ in plugin_set:
+            directory = self.path / source
+            if directory.is_dir():
+                files.extend(p for p in directory.rglob("packer-plugin-*") if p.is_file())
+        return files
+    
+    def installed(self, plugin_set: List[Tuple[str, str, str]]) -> bool:
+        """Check that every plugin of a set has a binary in the cache"""
+        for _, source, _ in plugin_set:
+            directory = self.path / source
+            if not directory.is_dir() or not any(p.is_file() for p in directory.rglob("packer-plugin-*")):
+                return False
+        return True
+    
+    def is_current(self, plugin_set: List[Tuple[str, str, str]]) -> bool:
+        """Check whether a set was initialized with the same versions and is intact"""
+        return self.key(plugin_set) in self.data["sets"] and self.installed(plugin_set)
+    
+    def record(self, plugin_set: List[Tuple[str, str, str]], duration: float) -> Dict:
+        """Remember a successful init of a plugin set"""
+        entry = {
+            "plugins": [list(p) for p in plugin_set],
+            "duration": round(duration, 3),
+            "bytes": sum(p.stat().st_size for p in self._plugin_files(plugin_set)),
+            "initialized": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        self.data["sets"][self.key(plugin_set)] = entry
+        return entry
+    
+    def entry(self, plugin_set: List[Tuple[str, str, str]]) -> Dict:
+        return self.data["sets"].get(self.key(plugin_set), {})
+    
+    def save(self) -> None:
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.data, indent=2))
+        os.replace(tmp, self.state_file)
+
+
 class PackerBuildManager:
-    """Main build manager class"""
+    """Main build manager class
+    
+    A ``serve`` daemon creates one manager per job, passing in the discovery
+    index and plugin cache of its own manager and the job as ``output``.
+    """
     
-    def __init__(self, repo_root: Optional[Path] = None):
+    # Step timings of every manager in the process go to the same textfile
+    _metrics_lock = threading.Lock()
+    
+    def __init__(
+        self,
+        repo_root: Optional[Path] = None,
+        refresh_index: bool = False,
+        index: Optional[DiscoveryIndex] = None,
+        plugins: Optional[PluginCache] = None,
+        output=None
+    ):
         self.repo_root = repo_root or self._find_repo_root()
         self.builds_dir = self.repo_root / "builds"
+        self.state_dir = self.repo_root / ".buildmanager"
+        self.index = index or DiscoveryIndex(self.state_dir / "index.json", self.repo_root)
+        self.plugins = plugins or PluginCache(self.state_dir)
+        self.runner = StreamingRunner(self.state_dir / "logs")
+        # Console output; None writes to sys.stdout
+        self.output = output
+        # Prometheus node_exporter textfile that step timings are exported to
+        self.metrics_textfile: Optional[Path] = None
+        # Watchdog limits in seconds by build selector ("" is the default)
+        # or, for idle limits, by step category
+        self.timeouts: Dict[str, float] = {}
+        self.idle_timeouts: Dict[str, float] = {}
+        # Set by ``serve``: the ``WorkerSlots`` shared by every job of the
+        # daemon and the event that cancels the job this manager runs
+        self.slots = None
+        self.stop: Optional[threading.Event] = None
+        if refresh_index:
+            self.index.data = {"version": DiscoveryIndex.VERSION, "dirs": {}, "builds": {}}
         self.builds = self._discover_builds()
     
-    def _find_repo_root(self) -> Path:
+    def echo(self, *values, **kwargs) -> None:
+        """print() to this manager's output"""
+        print(*values, file=self.output or sys.stdout, **kwargs)
+    
+    @staticmethod
+    def _find_repo_root() -> Path:
         """Find repository root by looking for .git directory"""
         current = Path.cwd()
         while current != current.parent:
@@ -125,26 +891,27 @@ class PackerBuildManager:
             return builds
         
         # Walk through builds/{provider}/{os_type}/{distro}/{version}/
-        for provider_dir in self.builds_dir.iterdir():
-            if not provider_dir.is_dir() or provider_dir.name.startswith('.'):
+        for build_path in self.index.walk(self.builds_dir):
+            rel_path = build_path.relative_to(self.builds_dir)
+            if not rel_path.parts:
                 continue
             
-            provider = provider_dir.name
+            # Determine provider and OS type based on path
+            provider = rel_path.parts[0]
+            os_type = rel_path.parts[1] if len(rel_path.parts) > 1 else "unknown"
             
-            for os_dir in provider_dir.rglob("build.pkr.hcl"):
-                build_path = os_dir.parent
-                
-                # Determine OS type based on path
-                rel_path = build_path.relative_to(provider_dir)
-                os_type = rel_path.parts[0] if rel_path.parts else "unknown"
-                
-                builds.append(PackerBuild(build_path, provider, os_type))
+            builds.append(PackerBuild(build_path, provider, os_type, self.index))
         
+        self.index.prune([b.path for b in builds])
         return sorted(builds, key=lambda b: (b.cloud_provider, b.os_type, b.path.name))
     
+    def save_index(self) -> None:
+        """Persist the discovery index, including metadata parsed during this run"""
+        self.index.save()
+    
     def list_builds(self) -> None:
         """List all discovered builds"""
-        print(f"\n{Colors.BOLD}{Colors.HEADER}Available Packer Builds:{Colors.ENDC}\n")
+        self.echo(f"\n{Colors.BOLD}{Colors.HEADER}Available Packer Builds:{Colors.ENDC}\n")
         
         current_provider = None
         current_os = None
@@ -152,22 +919,37 @@ class PackerBuildManager:
         for i, build in enumerate(self.builds, 1):
             if build.cloud_provider != current_provider:
                 current_provider = build.cloud_provider
-                print(f"\n{Colors.BOLD}{Colors.OKCYAN}📦 {current_provider.upper()}{Colors.ENDC}")
+                self.echo(f"\n{Colors.BOLD}{Colors.OKCYAN}📦 {current_provider.upper()}{Colors.ENDC}")
                 current_os = None
             
             if build.os_type != current_os:
                 current_os = build.os_type
-                print(f"  {Colors.OKBLUE}└─ {current_os}{Colors.ENDC}")
+                self.echo(f"  {Colors.OKBLUE}└─ {current_os}{Colors.ENDC}")
             
             rel_path = build.path.relative_to(self.builds_dir)
-            print(f"     {i:2d}. {Colors.OKGREEN}{build.build_name}{Colors.ENDC}")
-            print(f"         Path: {rel_path}")
-            print(f"         Sources: {', '.join(build.sources) if build.sources else 'None found'}")
+            self.echo(f"     {i:2d}. {Colors.OKGREEN}{build.build_name}{Colors.ENDC}")
+            self.echo(f"         Path: {rel_path}")
+            self.echo(f"         Sources: {', '.join(build.sources) if build.sources else 'None found'}")
             
             if build.variables_file.exists():
-                print(f"         {Colors.WARNING}✓ Has variables.auto.pkrvars.hcl{Colors.ENDC}")
+                self.echo(f"         {Colors.WARNING}✓ Has variables.auto.pkrvars.hcl{Colors.ENDC}")
         
-        print()
+        self.echo()
+    
+    def list_builds_json(self) -> None:
+        """Print all discovered builds as JSON straight from the discovery index"""
+        result = []
+        for build in self.builds:
+            metadata = build.metadata()
+            result.append({
+                "name": metadata["build_name"],
+                "provider": build.cloud_provider,
+                "os_type": build.os_type,
+                "path": build.path.relative_to(self.builds_dir).as_posix(),
+                "sources": metadata["sources"],
+                "has_variables_file": build.variables_file.exists(),
+            })
+        self.echo(json.dumps(result, indent=2))
     
     def find_build_by_pattern(self, pattern: str) -> Optional[PackerBuild]:
         """Find a build by name pattern or path pattern"""
@@ -202,28 +984,120 @@ class PackerBuildManager:
         
         return None
     
-    def run_packer_command(
+    def find_builds(self, selector: str) -> List[PackerBuild]:
+        """Find every build whose name, relative path or sources match a selector
+        
+        Selectors containing ``*``, ``?`` or ``[`` are glob patterns; anything
+        else is a case-insensitive substring match.
+        """
+        selector_lower = selector.lower()
+        if any(c in selector for c in "*?["):
+            def match(text: str) -> bool:
+                return fnmatch.fnmatch(text.lower(), selector_lower)
+        else:
+            def match(text: str) -> bool:
+                return selector_lower in text.lower()
+        
+        result = []
+        for build in self.builds:
+            rel_path = build.path.relative_to(self.builds_dir).as_posix()
+            if any(match(text) for text in (build.build_name, rel_path, *build.sources)):
+                result.append(build)
+        return result
+    
+    @staticmethod
+    def wants_timings(command: str, extra_args: Optional[List[str]]) -> bool:
+        """Whether a packer run should emit machine-readable output for step timings
+        
+        ``-on-error=ask`` needs an interactive prompt, so it keeps the normal UI.
+        """
+        return command == "build" and not any("on-error=ask" in a for a in extra_args or [])
+    
+    @staticmethod
+    def with_on_error(command: str, extra_args: List[str], on_error: Optional[str]) -> List[str]:
+        """Add packer's ``-on-error`` policy to a build, unless the packer arguments set one"""
+        if command == "build" and on_error and not any(a.lstrip("-").startswith("on-error") for a in extra_args):
+            return list(extra_args) + [f"-on-error={on_error}"]
+        return list(extra_args)
+    
+    def save_timings(self, timer: "StepTimer", variant: Optional[str] = None) -> Optional[Path]:
+        """Write step spans next to the build's manifests and export metrics"""
+        data = timer.to_dict()
+        if not data["sources"]:
+            return None
+        directory = timer.build.path / "manifests" / "timings"
+        # UTC like the manifest names, so history can pair them up
+        stamp = time.strftime("%Y-%m-%d-%H-%M-%S", time.gmtime(timer.started))
+        if variant:
+            data["variant"] = variant
+            stamp += "-" + re.sub(r"[^\w.-]+", "_", variant)
+        path = directory / f"{stamp}.json"
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(data, indent=2) + "\n")
+        except OSError as e:
+            self.echo(f"{Colors.WARNING}Warning: could not write step timings: {e}{Colors.ENDC}")
+            return None
+        
+        if self.metrics_textfile:
+            samples = {}
+            for source, entry in data["sources"].items():
+                labels = f'build="{timer.build.build_name}",source="{source}"'
+                if variant:
+                    labels += f',variant="{variant}"'
+                samples[f"packer_build_duration_seconds{{{labels}}}"] = entry["duration"]
+                samples[f"packer_build_success{{{labels}}}"] = 1 if entry["status"] == "succeeded" else 0
+                for category, seconds in entry["categories"].items():
+                    samples[f'packer_build_step_seconds{{{labels},step="{category}"}}'] = seconds
+                samples[f"packer_build_last_run_timestamp_seconds{{{labels}}}"] = int(timer.started)
+            try:
+                with self._metrics_lock:
+                    write_metrics_textfile(self.metrics_textfile, samples)
+            except OSError as e:
+                self.echo(f"{Colors.WARNING}Warning: could not write {self.metrics_textfile}: {e}{Colors.ENDC}")
+        return path
+    
+    def packer_env(self) -> Dict[str, str]:
+        """Environment for packer processes, sharing one plugin directory"""
+        return {
+            **os.environ,
+            "PACKER_LOG": "1",
+            "PACKER_PLUGIN_PATH": str(self.plugins.path),
+        }
+    
+    def build_packer_command(
         self,
         build: PackerBuild,
         command: str,
         source: Optional[str] = None,
         variables_file: Optional[Path] = None,
         extra_args: Optional[List[str]] = None,
-        dry_run: bool = False
-    ) -> int:
-        """Execute a packer command"""
+        parallel_builds: Optional[int] = None,
+        machine_readable: bool = False
+    ) -> List[str]:
+        """Assemble the packer command line for a build
         
+        ``source`` may be a comma-separated list, in which case all of those
+        sources are built by this single packer process.
+        """
         cmd = ["packer", command]
+        if machine_readable:
+            cmd.insert(1, "-machine-readable")
         
         # Add source filter if specified
         if source and command in ["build", "validate"]:
             cmd.extend(["-only", source])
         
+        # Bound how many sources one packer process builds at once
+        if command == "build" and not any(
+            a.lstrip("-").startswith("parallel-builds") for a in extra_args or []
+        ):
+            count = len(source.split(",")) if source else 0
+            if parallel_builds or count > 1:
+                cmd.append(f"-parallel-builds={parallel_builds or count}")
+        
         # Add variables file
         if variables_file:
-            if not variables_file.exists():
-                print(f"{Colors.FAIL}Error: Variables file not found: {variables_file}{Colors.ENDC}")
-                return 1
             cmd.extend(["-var-file", str(variables_file)])
         elif build.variables_file.exists():
             cmd.extend(["-var-file", str(build.variables_file)])
@@ -234,33 +1108,89 @@ class PackerBuildManager:
         
         # Add build directory
         cmd.append(".")
+        return cmd
+    
+    def run_packer_command(
+        self,
+        build: PackerBuild,
+        command: str,
+        source: Optional[str] = None,
+        variables_file: Optional[Path] = None,
+        extra_args: Optional[List[str]] = None,
+        dry_run: bool = False,
+        source_status: Optional[Dict[str, str]] = None,
+        on_error: Optional[str] = None
+    ) -> int:
+        """Execute a packer command
+        
+        ``source_status``, if given, receives the outcome of every source the
+        run built, for the run state that ``--resume`` reads. ``on_error`` is
+        packer's ``-on-error`` policy for a build.
+        """
+        
+        if variables_file and not variables_file.exists():
+            self.echo(f"{Colors.FAIL}Error: Variables file not found: {variables_file}{Colors.ENDC}")
+            return 1
         
-        print(f"\n{Colors.BOLD}{Colors.HEADER}Executing Packer Command:{Colors.ENDC}")
-        print(f"{Colors.OKCYAN}  Working Directory: {build.path}{Colors.ENDC}")
-        print(f"{Colors.OKCYAN}  Command: {' '.join(cmd)}{Colors.ENDC}\n")
+        extra_args = self.with_on_error(command, extra_args or [], on_error)
+        timings = self.wants_timings(command, extra_args)
+        cmd = self.build_packer_command(
+            build, command, source, variables_file, extra_args, machine_readable=timings
+        )
+        
+        self.echo(f"\n{Colors.BOLD}{Colors.HEADER}Executing Packer Command:{Colors.ENDC}")
+        self.echo(f"{Colors.OKCYAN}  Working Directory: {build.path}{Colors.ENDC}")
+        self.echo(f"{Colors.OKCYAN}  Command: {' '.join(cmd)}{Colors.ENDC}\n")
         
         if dry_run:
-            print(f"{Colors.WARNING}[DRY RUN] Command not executed{Colors.ENDC}")
+            self.echo(f"{Colors.WARNING}[DRY RUN] Command not executed{Colors.ENDC}")
             return 0
         
+        prefix = f"{Colors.OKBLUE}[{build.build_name}]{Colors.ENDC}"
+        run = PackerRun(
+            self, build, command, cmd, source.split(",") if source else build.sources,
+            build.build_name, build.build_name, command + (f"-{source}" if source else ""),
+            lambda _, text, styled: self.echo(f"{prefix} {styled}", flush=True), timings
+        )
+        
+        # Without a watchdog packer stays in this session, so Ctrl-C in the
+        # terminal reaches it directly. A watchdog has to stop packer's whole
+        # process group, plugins included, so packer gets its own and Ctrl-C
+        # is forwarded to it.
+        future = run.start(new_session=run.watchdog is not None)
+        returncode = 1
         try:
-            result = subprocess.run(
-                cmd,
-                cwd=build.path,
-                env={**os.environ, "PACKER_LOG": "1"},
-                check=False
-            )
-            return result.returncode
+            returncode = run.wait(future)
+            if run.watchdog and run.watchdog.reason:
+                self.echo(f"{Colors.FAIL}Build timed out: {run.watchdog.reason}{Colors.ENDC}")
+            return returncode
         except KeyboardInterrupt:
-            print(f"\n{Colors.WARNING}Build interrupted by user{Colors.ENDC}")
+            returncode = 130
+            self.echo(f"\n{Colors.WARNING}Build interrupted by user, waiting for packer "
+                      f"to clean up (press Ctrl-C again to {'kill' if run.watchdog else 'abandon'} it){Colors.ENDC}")
+            if run.watchdog:
+                run.send(signal.SIGINT)
+            try:
+                future.result(timeout=Watchdog.GRACE if run.watchdog else None)
+            except (KeyboardInterrupt, FutureTimeout):
+                if run.watchdog:
+                    run.send(signal.SIGKILL if os.name != "nt" else signal.SIGTERM)
             return 130
         except Exception as e:
-            print(f"{Colors.FAIL}Error executing packer: {e}{Colors.ENDC}")
+            self.echo(f"{Colors.FAIL}Error executing packer: {e}{Colors.ENDC}")
             return 1
+        finally:
+            results = run.finish(returncode, returncode == 130)
+            if run.log.paths:
+                self.echo(f"{Colors.OKCYAN}  Log: {run.log.paths[0]}{Colors.ENDC}")
+            if run.timings_path:
+                self.echo(f"{Colors.OKCYAN}  Step timings: {run.timings_path}{Colors.ENDC}")
+            if source_status is not None:
+                source_status.update(results)
     
     def init_build(self, build: PackerBuild, force: bool = False) -> int:
         """Initialize packer build (download plugins)"""
-        print(f"\n{Colors.BOLD}Initializing Packer build...{Colors.ENDC}")
+        self.echo(f"\n{Colors.BOLD}Initializing Packer build...{Colors.ENDC}")
         
         cmd = ["packer", "init"]
         if force:
@@ -268,29 +1198,88 @@ class PackerBuildManager:
         cmd.append(".")
         
         try:
-            result = subprocess.run(cmd, cwd=build.path, check=False)
+            self.plugins.path.mkdir(parents=True, exist_ok=True)
+            # Output that is not the console is captured so that it reaches it
+            captured = self.output is not None
+            result = subprocess.run(
+                cmd,
+                cwd=build.path,
+                env={**os.environ, "PACKER_PLUGIN_PATH": str(self.plugins.path)},
+                stdout=subprocess.PIPE if captured else None,
+                stderr=subprocess.STDOUT if captured else None,
+                text=True,
+                check=False
+            )
+            if captured:
+                self.echo(result.stdout, end="")
             if result.returncode == 0:
-                print(f"{Colors.OKGREEN}✓ Initialization successful{Colors.ENDC}")
+                self.echo(f"{Colors.OKGREEN}✓ Initialization successful{Colors.ENDC}")
             return result.returncode
         except Exception as e:
-            print(f"{Colors.FAIL}Error initializing packer: {e}{Colors.ENDC}")
+            self.echo(f"{Colors.FAIL}Error initializing packer: {e}{Colors.ENDC}")
             return 1
     
+    def init_builds(self, builds: List[PackerBuild], force: bool = False) -> int:
+        """Install the plugins of several builds into the shared plugin cache
+        
+        ``packer init`` runs once per distinct ``required_plugins`` set and
+        not at all for sets that are unchanged since their last init, unless
+        ``force`` asks for an upgrade.
+        """
+        groups: Dict[str, List[PackerBuild]] = {}
+        for build in {b.path: b for b in builds}.values():
+            plugin_set = PluginCache.plugin_set(build)
+            if plugin_set:
+                groups.setdefault(PluginCache.key(plugin_set), []).append(build)
+        if not groups:
+            return 0
+        
+        inits = 0
+        saved_seconds = 0.0
+        saved_bytes = 0
+        # Jobs of a ``serve`` daemon share the plugin cache, so one of them
+        # inits a plugin set while the others wait and then find it current
+        with self.plugins.lock:
+            try:
+                for members in groups.values():
+                    plugin_set = PluginCache.plugin_set(members[0])
+                    if not force and self.plugins.is_current(plugin_set):
+                        # Every directory of this set would otherwise have run init
+                        skipped = len(members)
+                    else:
+                        started = time.monotonic()
+                        return_code = self.init_build(members[0], force=force)
+                        if return_code != 0:
+                            return return_code
+                        self.plugins.record(plugin_set, time.monotonic() - started)
+                        inits += 1
+                        skipped = len(members) - 1
+                    entry = self.plugins.entry(plugin_set)
+                    saved_seconds += skipped * entry.get("duration", 0.0)
+                    saved_bytes += skipped * entry.get("bytes", 0)
+            finally:
+                self.plugins.save()
+        
+        self.echo(f"{Colors.OKGREEN}✓ Plugin cache {self.plugins.path}: {inits} init(s) for "
+                  f"{len(groups)} plugin set(s) across {sum(map(len, groups.values()))} build(s), "
+                  f"saved ~{saved_seconds:.1f}s and {format_size(saved_bytes)}{Colors.ENDC}")
+        return 0
+    
     def interactive_mode(self) -> None:
         """Interactive build selection"""
-        print(f"\n{Colors.BOLD}{Colors.HEADER}╔═══════════════════════════════════════╗{Colors.ENDC}")
-        print(f"{Colors.BOLD}{Colors.HEADER}║   Packer Build Manager (Interactive)  ║{Colors.ENDC}")
-        print(f"{Colors.BOLD}{Colors.HEADER}╚═══════════════════════════════════════╝{Colors.ENDC}\n")
+        self.echo(f"\n{Colors.BOLD}{Colors.HEADER}╔═══════════════════════════════════════╗{Colors.ENDC}")
+        self.echo(f"{Colors.BOLD}{Colors.HEADER}║   Packer Build Manager (Interactive)  ║{Colors.ENDC}")
+        self.echo(f"{Colors.BOLD}{Colors.HEADER}╚═══════════════════════════════════════╝{Colors.ENDC}\n")
         
         if not self.builds:
-            print(f"{Colors.FAIL}No builds found in {self.builds_dir}{Colors.ENDC}")
+            self.echo(f"{Colors.FAIL}No builds found in {self.builds_dir}{Colors.ENDC}")
             return
         
         # Display builds
-        print(f"{Colors.BOLD}Available builds:{Colors.ENDC}\n")
+        self.echo(f"{Colors.BOLD}Available builds:{Colors.ENDC}\n")
         for i, build in enumerate(self.builds, 1):
             rel_path = build.path.relative_to(self.builds_dir)
-            print(f"  {i:2d}. {Colors.OKGREEN}{build.build_name}{Colors.ENDC} ({rel_path})")
+            self.echo(f"  {i:2d}. {Colors.OKGREEN}{build.build_name}{Colors.ENDC} ({rel_path})")
         
         # Get user selection
         while True:
@@ -302,47 +1291,48 @@ class PackerBuildManager:
                 idx = int(selection) - 1
                 if 0 <= idx < len(self.builds):
                     break
-                print(f"{Colors.FAIL}Invalid selection. Please choose 1-{len(self.builds)}{Colors.ENDC}")
+                self.echo(f"{Colors.FAIL}Invalid selection. Please choose 1-{len(self.builds)}{Colors.ENDC}")
             except ValueError:
-                print(f"{Colors.FAIL}Invalid input. Please enter a number{Colors.ENDC}")
+                self.echo(f"{Colors.FAIL}Invalid input. Please enter a number{Colors.ENDC}")
         
         build = self.builds[idx]
         
         # Select source if multiple
         source = None
         if len(build.sources) > 1:
-            print(f"\n{Colors.BOLD}Available sources:{Colors.ENDC}")
-            print(f"  0. All sources")
+            self.echo(f"\n{Colors.BOLD}Available sources:{Colors.ENDC}")
+            self.echo(f"  0. All sources")
             for i, src in enumerate(build.sources, 1):
-                print(f"  {i}. {src}")
+                self.echo(f"  {i}. {src}")
             
             while True:
                 try:
-                    src_sel = input(f"\n{Colors.BOLD}Select source (0 for all): {Colors.ENDC}")
-                    src_idx = int(src_sel)
-                    if src_idx == 0:
+                    src_sel = input(f"\n{Colors.BOLD}Select source(s), comma-separated (0 for all): {Colors.ENDC}")
+                    src_idx = [int(part) for part in src_sel.split(",") if part.strip()]
+                    if src_idx == [0]:
                         break
-                    if 1 <= src_idx <= len(build.sources):
-                        source = build.sources[src_idx - 1]
+                    if src_idx and all(1 <= i <= len(build.sources) for i in src_idx):
+                        # Several sources run in one packer process
+                        source = ",".join(dict.fromkeys(build.sources[i - 1] for i in src_idx))
                         break
-                    print(f"{Colors.FAIL}Invalid selection{Colors.ENDC}")
+                    self.echo(f"{Colors.FAIL}Invalid selection{Colors.ENDC}")
                 except ValueError:
-                    print(f"{Colors.FAIL}Invalid input{Colors.ENDC}")
+                    self.echo(f"{Colors.FAIL}Invalid input{Colors.ENDC}")
         elif len(build.sources) == 1:
             source = build.sources[0]
         
         # Select action
-        print(f"\n{Colors.BOLD}Actions:{Colors.ENDC}")
-        print(f"  1. Initialize (packer init)")
-        print(f"  2. Validate")
-        print(f"  3. Build")
-        print(f"  4. Validate + Build")
+        self.echo(f"\n{Colors.BOLD}Actions:{Colors.ENDC}")
+        self.echo(f"  1. Initialize (packer init)")
+        self.echo(f"  2. Validate")
+        self.echo(f"  3. Build")
+        self.echo(f"  4. Validate + Build")
         
         while True:
             action = input(f"\n{Colors.BOLD}Select action: {Colors.ENDC}")
             if action in ['1', '2', '3', '4']:
                 break
-            print(f"{Colors.FAIL}Invalid action{Colors.ENDC}")
+            self.echo(f"{Colors.FAIL}Invalid action{Colors.ENDC}")
         
         # Execute
         if action == '1':
@@ -356,123 +1346,3446 @@ class PackerBuildManager:
                 self.run_packer_command(build, "build", source)
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="Packer Build Manager - Manage and execute Packer builds",
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog=__doc__
-    )
+class BuildTask:
+    """A single validate/build unit scheduled by the parallel executor"""
     
-    parser.add_argument(
-        "--list", "-l",
-        action="store_true",
-        help="List all available builds"
-    )
+    def __init__(
+        self,
+        build: PackerBuild,
+        sources: Optional[List[str]] = None,
+        variables_file: Optional[Path] = None,
+        extra_args: Optional[List[str]] = None,
+        validate: bool = True,
+        run_build: bool = True
+    ):
+        self.build = build
+        # None selects every source of the build directory
+        self.sources = list(sources) if sources else None
+        self.variables_file = variables_file
+        self.extra_args = list(extra_args or [])
+        self.validate = validate
+        self.run_build = run_build
+        self.dependencies: List["BuildTask"] = []
+        self.cached = False
+        self.source_status: Dict[str, str] = {}
+        # VM ID each source builds, and -var overrides that apply leased IDs
+        self.vm_ids: Dict[str, int] = {}
+        self.var_overrides: List[str] = []
+        # Node, (vCPUs, MiB) reserved there, and when the task became runnable
+        self.node: Optional[str] = None
+        self.demand: Tuple[int, int] = (0, 0)
+        self.ready_at: Optional[float] = None
+        # Sources ("*" for unattributed lines) whose output showed a transient error
+        self.transient: set = set()
+        self.timed_out: Optional[str] = None
+        # Matrix variant: its name, variables file and extra -var arguments
+        self.variant: Optional[str] = None
+        self.variant_file: Optional[Path] = None
+        self.variant_args: List[str] = []
+        # Last lines of packer output, kept for reports
+        self.output: deque = deque(maxlen=200)
+        self.status = "pending"
+        self.returncode: Optional[int] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
     
-    parser.add_argument(
-        "--os",
-        help="Build specific OS (e.g., 'debian-12', 'windows-server-2019')"
-    )
+    @property
+    def provider(self) -> str:
+        return self.build.cloud_provider
     
-    parser.add_argument(
-        "--source", "-s",
-        help="Build specific source (e.g., 'proxmox-iso.debian_12_base')"
-    )
+    @property
+    def only(self) -> Optional[str]:
+        """Comma-separated value for packer's -only flag"""
+        return ",".join(self.sources) if self.sources else None
     
-    parser.add_argument(
-        "--vars", "-v",
-        type=Path,
-        help="Path to custom variables.auto.pkrvars.hcl file"
-    )
+    @property
+    def selected_sources(self) -> List[str]:
+        return self.sources if self.sources else self.build.sources
     
-    parser.add_argument(
-        "--validate-only",
-        action="store_true",
-        help="Only validate, don't build"
-    )
+    @property
+    def name(self) -> str:
+        """Build name, qualified with the matrix variant if any"""
+        return f"{self.build.build_name}@{self.variant}" if self.variant else self.build.build_name
     
-    parser.add_argument(
-        "--init-only",
-        action="store_true",
-        help="Only initialize (packer init)"
-    )
+    @property
+    def label(self) -> str:
+        if not self.sources:
+            return self.name
+        if len(self.sources) == 1:
+            return f"{self.name}:{self.sources[0]}"
+        return f"{self.name} ({len(self.sources)} sources)"
     
-    parser.add_argument(
-        "--force-init",
-        action="store_true",
-        help="Force re-initialization (packer init -upgrade)"
-    )
+    def with_variant(self, name: str, variables_file: Optional[Path], var_args: List[str]) -> "BuildTask":
+        """Copy of this task for one matrix variant"""
+        task = BuildTask(self.build, self.sources, validate=self.validate, run_build=self.run_build)
+        task.variant = name
+        task.variant_file = variables_file
+        task.variant_args = list(var_args)
+        return task
     
-    parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        help="Show commands without executing"
-    )
+    def add_sources(self, sources: Optional[List[str]]) -> None:
+        """Merge another selection of the same build directory into this task"""
+        if not sources:
+            self.sources = None
+        elif self.sources is not None:
+            self.sources.extend(s for s in sources if s not in self.sources)
     
-    parser.add_argument(
-        "--repo-root",
-        type=Path,
-        help="Repository root path (auto-detected if not specified)"
-    )
+    @property
+    def duration(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
     
-    parser.add_argument(
-        "packer_args",
-        nargs="*",
-        help="Additional arguments to pass to packer"
-    )
+    @property
+    def queue_wait(self) -> float:
+        if self.ready_at is None or self.started is None:
+            return 0.0
+        return self.started - self.ready_at
     
-    args = parser.parse_args()
+    def __repr__(self):
+        return f"BuildTask({self.label}, {self.status})"
+
+
+class BuildGraph:
+    """Dependency graph inferred from clone_vm_id -> vm_id relationships"""
     
-    try:
+    def __init__(self, builds: List[PackerBuild]):
+        self.builds = builds
+        # vm_id -> [(build, source)] for every source that produces a template
+        self.producers: Dict[int, List[Tuple[PackerBuild, str]]] = {}
+        for build in builds:
+            for source in build.sources:
+                vm_id = build.resolve_int(source, "vm_id")
+                if vm_id is not None:
+                    self.producers.setdefault(vm_id, []).append((build, source))
+    
+    def producer_of(self, build: PackerBuild, source: str) -> Optional[Tuple[PackerBuild, str]]:
+        """Find the build/source that produces the template a source clones"""
+        clone_id = build.resolve_int(source, "clone_vm_id")
+        if clone_id is None:
+            return None
+        
+        candidates = [
+            (b, s) for b, s in self.producers.get(clone_id, [])
+            if b.cloud_provider == build.cloud_provider and b is not build
+        ]
+        if not candidates:
+            return None
+        
+        # The same vm_id can be reused by unrelated templates, so prefer the
+        # producer that lives closest to the consumer in the directory tree
+        def shared_parts(candidate: Tuple[PackerBuild, str]) -> int:
+            count = 0
+            for a, b in zip(candidate[0].path.parts, build.path.parts):
+                if a != b:
+                    break
+                count += 1
+            return count
+        
+        return max(candidates, key=shared_parts)
+    
+    def unresolved(self, build: PackerBuild, sources: Optional[List[str]] = None) -> List[Tuple[str, int]]:
+        """Return (source, clone_vm_id) for sources that clone a template no build produces
+        
+        Such a template must already exist on the node; it is e.g. defined in
+        a directory without a ``build.pkr.hcl`` that discovery skips.
+        """
+        result = []
+        for src in (sources or build.sources):
+            clone_id = build.resolve_int(src, "clone_vm_id")
+            if clone_id is not None and self.producer_of(build, src) is None:
+                result.append((src, clone_id))
+        return result
+    
+    def upstream(self, build: PackerBuild, sources: Optional[List[str]] = None) -> List[Tuple[PackerBuild, str]]:
+        """Return the producers the given build (or some of its sources) clones from"""
+        result = []
+        for src in (sources or build.sources):
+            producer = self.producer_of(build, src)
+            if producer and producer not in result:
+                result.append(producer)
+        return result
+    
+    def expand(self, tasks: List[BuildTask]) -> List[BuildTask]:
+        """Add the upstream producers that were not selected explicitly"""
+        by_path = {t.build.path: t for t in tasks}
+        result = list(tasks)
+        queue = list(tasks)
+        while queue:
+            task = queue.pop(0)
+            for build, source in self.upstream(task.build, task.sources):
+                existing = by_path.get(build.path)
+                if existing is None:
+                    added = BuildTask(build, [source])
+                    by_path[build.path] = added
+                    result.insert(0, added)
+                    queue.append(added)
+                elif existing.sources is not None and source not in existing.sources:
+                    existing.add_sources([source])
+                    queue.append(existing)
+        return result
+    
+    def link(self, tasks: List[BuildTask]) -> List[BuildTask]:
+        """Wire task dependencies and return the tasks in topological order"""
+        for task in tasks:
+            task.dependencies = []
+            for build, source in self.upstream(task.build, task.sources):
+                for other in tasks:
+                    if other is task or other.build is not build or other.variant != task.variant:
+                        continue
+                    if (other.sources is None or source in other.sources) and other not in task.dependencies:
+                        task.dependencies.append(other)
+        
+        ordered: List[BuildTask] = []
+        state: Dict[int, str] = {}
+        
+        def visit(task: BuildTask, chain: List[BuildTask]) -> None:
+            mark = state.get(id(task))
+            if mark == "done":
+                return
+            if mark == "visiting":
+                cycle = " -> ".join(t.label for t in chain + [task])
+                raise ValueError(f"Dependency cycle detected: {cycle}")
+            state[id(task)] = "visiting"
+            for dep in task.dependencies:
+                visit(dep, chain + [task])
+            state[id(task)] = "done"
+            ordered.append(task)
+        
+        for task in tasks:
+            visit(task, [])
+        return ordered
+    
+    def print_graph(self, tasks: List[BuildTask], builds_dir: Path, echo: Callable[..., None] = print) -> None:
+        """Print each task with the tasks it waits for"""
+        echo(f"\n{Colors.BOLD}{Colors.HEADER}Build Dependency Graph:{Colors.ENDC}\n")
+        for task in tasks:
+            rel_path = task.build.path.relative_to(builds_dir)
+            echo(f"  {Colors.OKGREEN}{task.label}{Colors.ENDC} ({rel_path})")
+            for dep in task.dependencies:
+                echo(f"     {Colors.OKBLUE}└─ after {dep.label}{Colors.ENDC}")
+            for source, clone_id in self.unresolved(task.build, task.sources):
+                echo(f"     {Colors.WARNING}└─ {source} clones VM {clone_id}, "
+                     f"which no build produces{Colors.ENDC}")
+        echo()
+
+
+def _repo_path(repo_root: Path, path: Path) -> str:
+    """``path`` relative to the repository in POSIX form, or as-is outside it"""
+    try:
+        return path.relative_to(repo_root).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+class BuildCache:
+    """Content-hash fingerprints that let unchanged builds be skipped"""
+    
+    FILENAME = ".fingerprints.json"
+    
+    def __init__(self, repo_root: Path, graph: Optional[BuildGraph] = None):
+        self.repo_root = repo_root
+        self.graph = graph
+        self._file_hashes: Dict[Tuple[str, int, int], str] = {}
+        self._digests: Dict[Path, str] = {}
+        self._lock = threading.Lock()
+    
+    def input_files(self, build: PackerBuild) -> List[Path]:
+        """Collect every file that feeds a build"""
+        files = set(build.path.glob("*.pkr.hcl"))
+        for name in ("data", "drivers"):
+            files.update(self._walk(build.path / name))
+        
+        manifests_dir = build.path / "manifests"
+        for value in build.file_refs:
+            for path in self._resolve_reference(build, value):
+                if path == manifests_dir or manifests_dir in path.parents:
+                    continue
+                # The git datasource points at the repository root
+                if path == build.path or path in build.path.parents:
+                    continue
+                files.update(self._walk(path))
+        
+        return sorted(files)
+    
+    @staticmethod
+    def reference_pattern(build: PackerBuild, value: str) -> Optional[Path]:
+        """Absolute path of a path-like HCL string, with ``*`` for interpolations"""
+        for token in ("${abspath(path.root)}", "${path.root}", "${path.cwd}"):
+            if value.startswith(token):
+                value = "." + value[len(token):]
+                break
+        if not value.startswith(("./", "../")):
+            return None
+        
+        # Any remaining interpolation (e.g. a per-source playbook name) becomes a wildcard
+        pattern = re.sub(r'\$\{.*?\}+', "*", value).rstrip("/")
+        return Path(os.path.normpath(build.path / pattern))
+    
+    def _resolve_reference(self, build: PackerBuild, value: str) -> List[Path]:
+        """Turn a path-like HCL string into the existing paths it refers to"""
+        pattern = self.reference_pattern(build, value)
+        if pattern is None:
+            return []
+        if "*" not in pattern.as_posix():
+            return [pattern] if pattern.exists() else []
+        
+        if not pattern.parent.is_dir() or "*" in pattern.parent.as_posix():
+            return []
+        return sorted(pattern.parent.glob(pattern.name))
+    
+    def _walk(self, path: Path) -> List[Path]:
+        if path.is_file():
+            return [path]
+        if not path.is_dir():
+            return []
+        return [
+            p for p in path.rglob("*")
+            if p.is_file() and not any(part.startswith(".") for part in p.relative_to(path).parts)
+        ]
+    
+    def _hash_file(self, path: Path) -> str:
+        stat = path.stat()
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        digest = self._file_hashes.get(key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            self._file_hashes[key] = digest
+        return digest
+    
+    def input_digest(self, build: PackerBuild) -> str:
+        """Hash the inputs of a build directory"""
+        with self._lock:
+            digest = self._digests.get(build.path)
+        if digest is not None:
+            return digest
+        
+        sha = hashlib.sha256()
+        for path in self.input_files(build):
+            sha.update(f"{_repo_path(self.repo_root, path)}\0{self._hash_file(path)}\n".encode())
+        digest = sha.hexdigest()
+        with self._lock:
+            self._digests[build.path] = digest
+        return digest
+    
+    def fingerprint(
+        self,
+        build: PackerBuild,
+        source: str,
+        variables_file: Optional[Path] = None,
+        extra_args: Optional[List[str]] = None
+    ) -> str:
+        """Fingerprint a source together with its variables and upstream bases"""
+        sha = hashlib.sha256()
+        sha.update(self.input_digest(build).encode())
+        sha.update(f"\0source={source}".encode())
+        
+        variables_file = variables_file or build.variables_file
+        if variables_file.exists():
+            sha.update(f"\0vars={self._hash_file(variables_file)}".encode())
+        sha.update(f"\0args={json.dumps(extra_args or [])}".encode())
+        
+        # A changed base template invalidates every clone built from it
+        if self.graph:
+            seen = set()
+            queue = self.graph.upstream(build, [source])
+            while queue:
+                upstream_build, upstream_source = queue.pop(0)
+                if upstream_build.path in seen:
+                    continue
+                seen.add(upstream_build.path)
+                sha.update(f"\0upstream={self.input_digest(upstream_build)}".encode())
+                queue.extend(self.graph.upstream(upstream_build, [upstream_source]))
+        
+        return sha.hexdigest()
+    
+    def _load(self, build: PackerBuild) -> Dict[str, Dict[str, str]]:
+        cache_file = build.path / "manifests" / self.FILENAME
+        try:
+            return json.loads(cache_file.read_text())
+        except (OSError, ValueError):
+            return {}
+    
+    def _manifest_has_source(self, manifest: Path, source: str) -> Optional[str]:
+        """Return the packer run UUID if the manifest records a build of the source"""
+        try:
+            data = json.loads(manifest.read_text())
+        except (OSError, ValueError):
+            return None
+        source_type, _, source_name = source.partition(".")
+        for entry in data.get("builds", []):
+            if entry.get("name") == source_name and entry.get("builder_type") == source_type:
+                return entry.get("packer_run_uuid") or ""
+        return None
+    
+    @staticmethod
+    def _entry_key(source: str, variant: Optional[str]) -> str:
+        # Matrix variants of a source are separate artifacts
+        return f"{source}@{variant}" if variant else source
+    
+    def lookup(
+        self,
+        build: PackerBuild,
+        source: str,
+        fingerprint: str,
+        variant: Optional[str] = None
+    ) -> Optional[str]:
+        """Return the manifest of a previous successful build with the same inputs"""
+        entry = self._load(build).get(self._entry_key(source, variant))
+        if not entry or entry.get("fingerprint") != fingerprint:
+            return None
+        manifest = build.path / "manifests" / entry.get("manifest", "")
+        if not manifest.is_file() or self._manifest_has_source(manifest, source) is None:
+            return None
+        return manifest.name
+    
+    def partition(
+        self,
+        build: PackerBuild,
+        sources: List[str],
+        variables_file: Optional[Path] = None,
+        extra_args: Optional[List[str]] = None,
+        variant: Optional[str] = None
+    ) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """Fingerprint sources and return (fingerprints, manifests of the up-to-date ones)"""
+        fingerprints = {}
+        cached = {}
+        for source in sources:
+            fingerprints[source] = self.fingerprint(build, source, variables_file, extra_args)
+            manifest = self.lookup(build, source, fingerprints[source], variant)
+            if manifest:
+                cached[source] = manifest
+        return fingerprints, cached
+    
+    def record(
+        self,
+        build: PackerBuild,
+        fingerprints: Dict[str, str],
+        since: float,
+        variant: Optional[str] = None
+    ) -> List[str]:
+        """Remember the fingerprint of sources whose manifest was written after ``since``"""
+        manifests_dir = build.path / "manifests"
+        if not manifests_dir.is_dir():
+            return []
+        
+        recent = sorted(
+            (p for p in manifests_dir.glob("*.json") if p.stat().st_mtime >= since),
+            key=lambda p: p.stat().st_mtime,
+            reverse=True
+        )
+        recorded = []
+        with self._lock:
+            entries = self._load(build)
+            for src, fingerprint in fingerprints.items():
+                for manifest in recent:
+                    run_uuid = self._manifest_has_source(manifest, src)
+                    if run_uuid is not None:
+                        entries[self._entry_key(src, variant)] = {
+                            "fingerprint": fingerprint,
+                            "manifest": manifest.name,
+                            "packer_run_uuid": run_uuid,
+                        }
+                        recorded.append(src)
+                        break
+            if recorded:
+                cache_file = manifests_dir / self.FILENAME
+                tmp = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(entries, indent=2, sort_keys=True) + "\n")
+                os.replace(tmp, cache_file)
+        return recorded
+
+
+class ChangeImpact:
+    """Map files changed since a git ref to the build sources that consume them
+    
+    A file affects a build when it lives in the build directory (except
+    manifests/) or matches a path the HCL references, e.g. ansible playbooks,
+    cd_files scripts or data/ templates. References inside a source or
+    ``build`` block only affect the sources of that block, and a per-source
+    reference such as ``hardened-${split("_", source.name)[3]}.yml`` only
+    the source whose name contains the matched part. Clones of affected
+    templates are affected in turn.
+    """
+    
+    def __init__(self, repo_root: Path, builds: List[PackerBuild], graph: BuildGraph):
+        self.repo_root = repo_root
+        self.builds = builds
+        self.graph = graph
+    
+    def changed_files(self, ref: str) -> List[Path]:
+        """Files changed between ``ref`` and the working tree, plus untracked ones"""
+        def git(*args: str) -> str:
+            result = subprocess.run(
+                ["git", *args], cwd=self.repo_root, capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.strip() or f"git {args[0]} failed")
+            return result.stdout
+        
+        top = Path(git("rev-parse", "--show-toplevel").strip())
+        names = git("diff", "--name-only", "--no-renames", "-z", ref, "--").split("\0")
+        names += git("ls-files", "--others", "--exclude-standard", "-z", "--full-name").split("\0")
+        return sorted({top / name for name in names if name})
+    
+    def _scopes(self, build: PackerBuild) -> List[Tuple[List[str], str]]:
+        """(sources, reference) pairs; an empty source list means every source"""
+        scopes = []
+        scoped = set()
+        for source, refs in build.source_refs.items():
+            scopes.extend(([source], ref) for ref in refs)
+            scoped.update(refs)
+        for block in build.build_blocks:
+            sources = [s for s in block.get("sources", []) if s in build.sources]
+            scopes.extend((sources, ref) for ref in block.get("file_refs", []))
+            scoped.update(block.get("file_refs", []))
+        scopes.extend(([], ref) for ref in build.file_refs if ref not in scoped)
+        return scopes
+    
+    def _consumers(self, build: PackerBuild, path: Path) -> List[str]:
+        """Sources of a build that consume a changed file"""
+        manifests_dir = build.path / "manifests"
+        if path == manifests_dir or manifests_dir in path.parents:
+            return []
+        if build.path in path.parents:
+            return list(build.sources)
+        
+        result = []
+        for sources, ref in self._scopes(build):
+            pattern = BuildCache.reference_pattern(build, ref)
+            # The git datasource points at the repository root
+            if pattern is None or pattern == build.path or pattern in build.path.parents:
+                continue
+            regex = "/".join(
+                "([^/]*)".join(re.escape(piece) for piece in part.split("*"))
+                for part in pattern.as_posix().split("/")
+            )
+            match = re.fullmatch(regex + "(?:/.*)?", path.as_posix())
+            if not match:
+                continue
+            sources = sources or list(build.sources)
+            if "source.name" in ref:
+                captured = {c for c in match.groups() if c}
+                narrowed = [
+                    s for s in sources
+                    if captured & set(s.split(".", 1)[-1].split("_"))
+                ]
+                sources = narrowed or sources
+            result.extend(s for s in sources if s not in result)
+        return result
+    
+    def affected(
+        self,
+        changed: List[Path],
+        variables_file: Optional[Path] = None
+    ) -> Dict[PackerBuild, Dict[str, str]]:
+        """Affected sources of every build, each with the reason it is affected"""
+        affected: Dict[PackerBuild, Dict[str, str]] = {}
+        shared_vars = variables_file.resolve() if variables_file else None
+        for path in changed:
+            reason = _repo_path(self.repo_root, path)
+            for build in self.builds:
+                sources = list(build.sources) if path == shared_vars else self._consumers(build, path)
+                for source in sources:
+                    affected.setdefault(build, {}).setdefault(source, reason)
+        
+        # Templates cloned from an affected template are rebuilt after it
+        changed_any = True
+        while changed_any:
+            changed_any = False
+            for build in self.builds:
+                for source in build.sources:
+                    if source in affected.get(build, {}):
+                        continue
+                    producer = self.graph.producer_of(build, source)
+                    if producer and producer[1] in affected.get(producer[0], {}):
+                        affected.setdefault(build, {})[source] = (
+                            f"clones {producer[0].build_name}:{producer[1]}"
+                        )
+                        changed_any = True
+        return affected
+
+
+class BuildHistory:
+    """SQLite index over every ``manifests/*.json`` file in the repository
+    
+    Manifests are ingested once; later refreshes only read files whose
+    size or mtime changed and drop rows of files that disappeared, so
+    queries never re-parse the JSON. A ``manifests/`` directory whose mtime
+    is unchanged gained or lost no files, so it is not listed again; only
+    its newest manifest is checked, which packer rewrites in place as each
+    source of a run finishes.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS builds (
+            manifest TEXT NOT NULL,
+            build_dir TEXT NOT NULL,
+            build_name TEXT NOT NULL,
+            source TEXT NOT NULL,
+            artifact_id TEXT,
+            run_uuid TEXT,
+            started REAL,
+            build_date TEXT,
+            build_version TEXT,
+            author TEXT,
+            duration REAL,
+            duration_source TEXT,
+            custom_data TEXT
+        );
+        CREATE INDEX IF NOT EXISTS builds_source ON builds (source, started);
+        CREATE INDEX IF NOT EXISTS builds_version ON builds (build_version);
+        CREATE INDEX IF NOT EXISTS builds_manifest ON builds (manifest);
+    """
+    # Manifest names carry the UTC start time of the packer run
+    STAMP = re.compile(r"(\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})")
+    # A manifest mtime further than this from the start is a checkout, not a build
+    MAX_MTIME_DURATION = 24 * 3600
+    # A directory changed this recently may change again within the same mtime
+    # tick, so it is listed again next time
+    SETTLE_NS = 2 * 10**9
+    
+    def __init__(self, path: Path, repo_root: Path):
+        self.path = path
+        self.repo_root = repo_root
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(self.SCHEMA)
+    
+    def close(self) -> None:
+        self.db.close()
+    
+    @classmethod
+    def _started(cls, path: Path) -> Optional[float]:
+        match = cls.STAMP.search(path.name)
+        if not match:
+            return None
+        return float(calendar.timegm(time.strptime(match.group(1), "%Y-%m-%d-%H-%M-%S")))
+    
+    @staticmethod
+    def _timings(manifest: Path, started: Optional[float]) -> Dict[str, float]:
+        """Durations per source from the step timings of the same run, if any"""
+        directory = manifest.parent / "timings"
+        if started is None or not directory.is_dir():
+            return {}
+        # Both names are taken when the run starts, a few seconds apart at most
+        candidates = []
+        for path in directory.glob("*.json"):
+            other = BuildHistory._started(path)
+            if other is not None and abs(other - started) <= 60:
+                candidates.append((abs(other - started), path))
+        if not candidates:
+            return {}
+        try:
+            data = json.loads(min(candidates)[1].read_text())
+        except (OSError, ValueError):
+            return {}
+        return {
+            source: entry.get("duration")
+            for source, entry in data.get("sources", {}).items()
+            if entry.get("duration") is not None
+        }
+    
+    def _ingest(self, manifest: Path, build: PackerBuild, stat: os.stat_result) -> int:
+        try:
+            data = json.loads(manifest.read_text())
+        except (OSError, ValueError):
+            return 0
+        started = self._started(manifest)
+        timings = self._timings(manifest, started)
+        rel_manifest = manifest.relative_to(self.repo_root).as_posix()
+        rel_dir = build.path.relative_to(self.repo_root).as_posix()
+        rows = []
+        for entry in data.get("builds", []):
+            source = f"{entry.get('builder_type', '')}.{entry.get('name', '')}"
+            custom = entry.get("custom_data") or {}
+            duration, duration_source = timings.get(source), "timings"
+            if duration is None and started is not None:
+                elapsed = stat.st_mtime - started
+                if 0 < elapsed <= self.MAX_MTIME_DURATION:
+                    duration, duration_source = elapsed, "mtime"
+            if duration is None:
+                duration_source = None
+            rows.append((
+                rel_manifest, rel_dir, build.build_name, source,
+                entry.get("artifact_id"), entry.get("packer_run_uuid"), started,
+                custom.get("build_date"), custom.get("build_version"), custom.get("author"),
+                duration, duration_source, json.dumps(custom, sort_keys=True),
+            ))
+        self.db.executemany(
+            "INSERT INTO builds VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        return len(rows)
+    
+    def refresh(self, builds: List[PackerBuild]) -> Tuple[int, int]:
+        """Ingest new or changed manifests; return (files read, files dropped)"""
+        known = {
+            row["path"]: (row["mtime_ns"], row["size"])
+            for row in self.db.execute("SELECT path, mtime_ns, size FROM files")
+        }
+        known_dirs = {row["path"]: row["mtime_ns"] for row in self.db.execute("SELECT path, mtime_ns FROM dirs")}
+        by_dir: Dict[str, List[str]] = {}
+        for path in known:
+            by_dir.setdefault(path.rpartition("/")[0], []).append(path)
+        settled = time.time_ns() - self.SETTLE_NS
+        seen = set()
+        seen_dirs = set()
+        read = 0
+        with self.db:
+            for build in builds:
+                directory = build.path / "manifests"
+                try:
+                    dir_mtime = directory.stat().st_mtime_ns
+                except OSError:
+                    continue
+                rel_dir = directory.relative_to(self.repo_root).as_posix()
+                seen_dirs.add(rel_dir)
+                if known_dirs.get(rel_dir) == dir_mtime:
+                    files = by_dir.get(rel_dir, [])
+                    seen.update(files)
+                    newest = max(files, key=lambda path: known[path][0], default=None)
+                    manifests = [self.repo_root / newest] if newest else []
+                else:
+                    manifests = [m for m in directory.glob("*.json") if not m.name.startswith(".")]
+                    if dir_mtime < settled:
+                        self.db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (rel_dir, dir_mtime))
+                    else:
+                        self.db.execute("DELETE FROM dirs WHERE path = ?", (rel_dir,))
+                
+                for manifest in manifests:
+                    rel = manifest.relative_to(self.repo_root).as_posix()
+                    try:
+                        stat = manifest.stat()
+                    except OSError:
+                        continue
+                    seen.add(rel)
+                    if known.get(rel) == (stat.st_mtime_ns, stat.st_size):
+                        continue
+                    self.db.execute("DELETE FROM builds WHERE manifest = ?", (rel,))
+                    self._ingest(manifest, build, stat)
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                        (rel, stat.st_mtime_ns, stat.st_size)
+                    )
+                    read += 1
+            
+            gone = [path for path in known if path not in seen]
+            for path in gone:
+                self.db.execute("DELETE FROM builds WHERE manifest = ?", (path,))
+                self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+            for path in known_dirs:
+                if path not in seen_dirs:
+                    self.db.execute("DELETE FROM dirs WHERE path = ?", (path,))
+        return read, len(gone)
+    
+    def latest(self, pattern: str = "%") -> List[sqlite3.Row]:
+        """Newest artifact of every source matching a LIKE pattern"""
+        return self.db.execute("""
+            SELECT b.* FROM builds b
+            JOIN (SELECT source, MAX(started) AS started FROM builds
+                  WHERE source LIKE ? OR build_name LIKE ? GROUP BY source) l
+              ON b.source = l.source AND b.started = l.started
+            ORDER BY b.build_dir, b.source
+        """, (pattern, pattern)).fetchall()
+    
+    def runs(self, pattern: str = "%", limit: int = 50) -> List[sqlite3.Row]:
+        """Most recent builds of sources matching a LIKE pattern"""
+        return self.db.execute("""
+            SELECT * FROM builds WHERE source LIKE ? OR build_name LIKE ?
+            ORDER BY started DESC LIMIT ?
+        """, (pattern, pattern, limit)).fetchall()
+    
+    def trend(self, pattern: str, limit: int = 20) -> List[sqlite3.Row]:
+        """Durations of the most recent timed builds of matching sources"""
+        return self.db.execute("""
+            SELECT * FROM builds
+            WHERE (source LIKE ? OR build_name LIKE ?) AND duration IS NOT NULL
+            ORDER BY started DESC LIMIT ?
+        """, (pattern, pattern, limit)).fetchall()
+    
+    def commit(self, sha: str) -> List[sqlite3.Row]:
+        """Builds produced from a commit (full or abbreviated hash)"""
+        return self.db.execute("""
+            SELECT * FROM builds WHERE build_version LIKE ? ORDER BY started DESC
+        """, (sha.lower() + "%",)).fetchall()
+
+
+class DurationEstimator:
+    """Predict how long builds take from the durations in the history index
+    
+    A source's estimate is the median of its last ``SAMPLES`` timed builds.
+    A task runs its sources in one packer process, so its estimate is the
+    makespan of those sources on ``-parallel-builds`` lanes; sources that
+    never built borrow the mean of their siblings.
+    """
+    
+    SAMPLES = 5
+    
+    def __init__(self, history: Optional[BuildHistory] = None, repo_root: Optional[Path] = None):
+        self.repo_root = repo_root
+        self.per_source: Dict[Tuple[str, str], float] = {}
+        self.estimates: Dict[BuildTask, Optional[float]] = {}
+        self.critical: Dict[BuildTask, float] = {}
+        self.default = 0.0
+        if history is None:
+            return
+        samples: Dict[Tuple[str, str], List[float]] = {}
+        for row in history.db.execute(
+            "SELECT build_dir, source, duration FROM builds "
+            "WHERE duration IS NOT NULL ORDER BY started DESC"
+        ):
+            values = samples.setdefault((row["build_dir"], row["source"]), [])
+            if len(values) < self.SAMPLES:
+                values.append(row["duration"])
+        for key, values in samples.items():
+            values.sort()
+            middle = len(values) // 2
+            self.per_source[key] = (
+                values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+            )
+    
+    def _estimate(self, task: BuildTask, parallel: Optional[int]) -> Optional[float]:
+        build_dir = task.build.path.relative_to(self.repo_root).as_posix() if self.repo_root else ""
+        known = {
+            source: self.per_source[(build_dir, source)]
+            for source in task.selected_sources
+            if (build_dir, source) in self.per_source
+        }
+        if not known:
+            return None
+        fill = sum(known.values()) / len(known)
+        durations = sorted((known.get(s, fill) for s in task.selected_sources), reverse=True)
+        # Longest-processing-time packing of sources onto packer's lanes
+        lanes = [0.0] * min(parallel or len(durations), len(durations))
+        for duration in durations:
+            lanes[lanes.index(min(lanes))] += duration
+        return max(lanes)
+    
+    def plan(self, tasks: List[BuildTask], parallel: Optional[int] = None) -> None:
+        """Estimate every task and the longest chain of work each one starts"""
+        self.estimates = {task: self._estimate(task, parallel) for task in tasks}
+        known = [e for e in self.estimates.values() if e is not None]
+        # Builds without history count as an average one when ordering
+        self.default = sum(known) / len(known) if known else 0.0
+        
+        dependents: Dict[BuildTask, List[BuildTask]] = {task: [] for task in tasks}
+        for task in tasks:
+            for dep in task.dependencies:
+                if dep in dependents:
+                    dependents[dep].append(task)
+        
+        self.critical = {}
+        def chain(task: BuildTask) -> float:
+            if task not in self.critical:
+                self.critical[task] = self.expected(task) + max(
+                    (chain(t) for t in dependents[task]), default=0.0
+                )
+            return self.critical[task]
+        for task in tasks:
+            chain(task)
+    
+    def estimate(self, task: BuildTask) -> Optional[float]:
+        return self.estimates.get(task)
+    
+    def expected(self, task: BuildTask) -> float:
+        estimate = self.estimates.get(task)
+        return self.default if estimate is None else estimate
+    
+    def remaining(self, task: BuildTask) -> float:
+        return max(self.expected(task) - task.duration, 0.0)
+    
+    def batch_remaining(self, running: List[BuildTask], pending: List[BuildTask], workers: int) -> float:
+        """Simulate the rest of the run on ``workers`` slots, in queue order"""
+        finish = {task: self.remaining(task) for task in running}
+        slots = sorted(finish.values()) + [0.0] * max(workers - len(running), 0)
+        queue = list(pending)
+        while queue:
+            for task in queue:
+                if not any(d in queue for d in task.dependencies):
+                    break
+            else:
+                break
+            queue.remove(task)
+            slots.sort()
+            ready = max([slots[0]] + [finish.get(d, 0.0) for d in task.dependencies])
+            slots[0] = finish[task] = ready + self.expected(task)
+        return max(finish.values(), default=0.0)
+
+
+# Orderings of runnable builds: sort keys over (task, estimator)
+ORDER_POLICIES: Dict[str, Callable[[BuildTask, DurationEstimator], float]] = {
+    # Command-line order
+    "fifo": lambda task, estimator: 0.0,
+    # Minimizes the makespan of independent builds
+    "longest": lambda task, estimator: -estimator.expected(task),
+    # Fastest feedback: most builds finish early
+    "shortest": lambda task, estimator: estimator.expected(task),
+    # Starts the longest chain of dependent builds first
+    "critical-path": lambda task, estimator: -estimator.critical.get(task, 0.0),
+}
+
+
+class VmInventory:
+    """VM IDs that already exist, so the pool never hands them out
+    
+    ``source`` is either a Proxmox API URL (``https://pve:8006``, token from
+    ``PROXMOX_TOKEN`` as ``user@realm!id=secret``, certificate checks off
+    with ``PROXMOX_INSECURE_TLS=1``) or a JSON file listing IDs, which
+    stands in for a cluster in tests and dry environments.
+    """
+    
+    CACHE_SECONDS = 30
+    
+    def __init__(self, source: str):
+        self.source = source
+        self._cached: Optional[Tuple[float, set]] = None
+    
+    def _fetch(self) -> set:
+        if self.source.startswith(("http://", "https://")):
+            import ssl
+            import urllib.request
+            request = urllib.request.Request(
+                self.source.rstrip("/") + "/api2/json/cluster/resources?type=vm",
+                headers={"Authorization": f"PVEAPIToken={os.environ.get('PROXMOX_TOKEN', '')}"}
+            )
+            context = ssl.create_default_context()
+            # Opt-in for clusters that still serve Proxmox's self-signed certificate
+            if os.environ.get("PROXMOX_INSECURE_TLS"):
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            with urllib.request.urlopen(request, timeout=15, context=context) as response:
+                data = json.load(response).get("data", [])
+            return {int(item["vmid"]) for item in data if "vmid" in item}
+        path = Path(self.source)
+        if not path.exists():
+            return set()
+        return {int(v) for v in json.loads(path.read_text())}
+    
+    def occupied(self) -> set:
+        now = time.monotonic()
+        if self._cached is None or now - self._cached[0] > self.CACHE_SECONDS:
+            self._cached = (now, self._fetch())
+        return self._cached[1]
+
+
+class VmIdAllocator:
+    """Host-wide leases on Proxmox VM IDs so concurrent builds never share one
+    
+    Each lease is a JSON file named after the VM ID in a directory shared by
+    every checkout on the host. Leases carry an expiry that a heartbeat
+    keeps extending while the build runs, so a crashed run frees its IDs
+    once the TTL passes (or at once, if its process is gone).
+    
+    Sources whose ``vm_id`` is a ``var.*`` reference get a free ID from the
+    pool injected through ``-var``; literal IDs are leased as-is, which makes
+    a second run of the same template wait instead of failing on Proxmox.
+    """
+    
+    POLL_INTERVAL = 5
+    
+    def __init__(
+        self,
+        directory: Path,
+        pool: Optional[range] = None,
+        ttl: int = 4 * 3600,
+        inventory: Optional[VmInventory] = None
+    ):
+        self.directory = directory
+        self.pool = pool
+        self.ttl = ttl
+        self.inventory = inventory
+        self.host = socket.gethostname()
+        self.held: Dict[int, Dict] = {}
+        self._lock = threading.Lock()
+        self._heartbeat: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+    
+    @staticmethod
+    def parse_pool(value: str) -> range:
+        """Parse a ``FIRST-LAST`` VM ID range"""
+        first, sep, last = value.partition("-")
+        if not sep or not first.strip().isdigit() or not last.strip().isdigit() or int(first) > int(last):
+            raise ValueError(f"Invalid VM ID pool '{value}' (expected FIRST-LAST)")
+        return range(int(first), int(last) + 1)
+    
+    @contextlib.contextmanager
+    def _locked(self):
+        """Serialize lease changes across threads and processes on this host"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.directory / ".lock", "a+") as handle:
+            if fcntl:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+    
+    def _path(self, vm_id: int) -> Path:
+        return self.directory / f"{vm_id}.json"
+    
+    def _holder(self, vm_id: int) -> Optional[Dict]:
+        """Return the live lease on an ID, removing it if expired or orphaned"""
+        path = self._path(vm_id)
+        try:
+            lease = json.loads(path.read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            lease = {}
+        
+        stale = lease.get("expires", 0) < time.time()
+        if not stale and lease.get("host") == self.host and os.name != "nt":
+            try:
+                os.kill(lease.get("pid", 0), 0)
+            except ProcessLookupError:
+                stale = True
+            except PermissionError:
+                pass
+        if stale:
+            path.unlink(missing_ok=True)
+            return None
+        return lease
+    
+    def _write(self, lease: Dict) -> None:
+        path = self._path(lease["vm_id"])
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(lease))
+        os.replace(tmp, path)
+    
+    def try_acquire(self, vm_id: int, label: str) -> Optional[Dict]:
+        """Lease an ID if nobody holds it"""
+        with self._locked():
+            if self._holder(vm_id) is not None:
+                return None
+            lease = {
+                "vm_id": vm_id,
+                "host": self.host,
+                "pid": os.getpid(),
+                "label": label,
+                "acquired": time.time(),
+                "expires": time.time() + self.ttl,
+            }
+            self._write(lease)
+            self.held[vm_id] = lease
+        self._start_heartbeat()
+        return lease
+    
+    def acquire(
+        self,
+        vm_id: Optional[int],
+        label: str,
+        stop: Optional[threading.Event] = None,
+        log: Callable[[str], None] = print
+    ) -> Optional[Dict]:
+        """Lease a specific ID (or any pool ID when ``vm_id`` is None), waiting if needed
+        
+        Returns None if ``stop`` is set while waiting.
+        """
+        announced = False
+        while True:
+            if vm_id is not None:
+                candidates = [vm_id]
+            else:
+                occupied = self.inventory.occupied() if self.inventory else set()
+                candidates = [c for c in self.pool or [] if c not in occupied]
+            for candidate in candidates:
+                lease = self.try_acquire(candidate, label)
+                if lease:
+                    return lease
+            if not announced:
+                if vm_id is not None:
+                    holder = self._holder(vm_id) or {}
+                    log(f"waiting for VM ID {vm_id} (leased by {holder.get('label', '?')} "
+                        f"on {holder.get('host', '?')}, pid {holder.get('pid', '?')})")
+                else:
+                    log(f"waiting for a free VM ID in {self.pool.start}-{self.pool.stop - 1}")
+                announced = True
+            if stop is not None:
+                if stop.wait(self.POLL_INTERVAL):
+                    return None
+            else:
+                time.sleep(self.POLL_INTERVAL)
+    
+    def release(self, lease: Dict) -> None:
+        """Give an ID back, unless the lease expired and someone else took it"""
+        with self._locked():
+            self.held.pop(lease["vm_id"], None)
+            current = self._holder(lease["vm_id"])
+            if current and current.get("pid") == lease["pid"] and current.get("host") == lease["host"] \
+                    and current.get("acquired") == lease["acquired"]:
+                self._path(lease["vm_id"]).unlink(missing_ok=True)
+    
+    def _start_heartbeat(self) -> None:
+        with self._lock:
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._renew_loop, name="vm-id-leases", daemon=True)
+                self._heartbeat.start()
+    
+    def _renew_loop(self) -> None:
+        while not self._closed.wait(max(1, self.ttl // 3)):
+            with self._locked():
+                for lease in list(self.held.values()):
+                    lease["expires"] = time.time() + self.ttl
+                    self._write(lease)
+    
+    def lease_build(
+        self,
+        build: PackerBuild,
+        sources: List[str],
+        label: str,
+        clone_ids: Optional[Dict[str, int]] = None,
+        stop: Optional[threading.Event] = None,
+        log: Callable[[str], None] = print
+    ) -> Optional[Tuple[List[Dict], List[str], Dict[str, int]]]:
+        """Lease the VM IDs one packer run creates
+        
+        Returns the leases, the ``-var`` arguments that apply pooled IDs
+        and clone IDs from ``clone_ids`` (source -> template ID to clone),
+        and the VM ID of every source. Returns None if stopped while waiting.
+        """
+        leases: List[Dict] = []
+        args: List[str] = []
+        vm_ids: Dict[str, int] = {}
+        assigned: Dict[str, int] = {}
+        # A fixed order keeps two runs from each holding half of the other's IDs
+        for source in sorted(sources, key=lambda s: build.resolve_int(s, "vm_id") or 0):
+            expression = build.source_settings.get(source, {}).get("vm_id", "")
+            variable = _VAR_REFERENCE.fullmatch(expression)
+            if variable and self.pool:
+                name = variable.group(1)
+                if name not in assigned:
+                    lease = self.acquire(None, label, stop, log)
+                    if lease is None:
+                        break
+                    leases.append(lease)
+                    assigned[name] = lease["vm_id"]
+                    args.extend(["-var", f"{name}={lease['vm_id']}"])
+                vm_ids[source] = assigned[name]
+                continue
+            
+            vm_id = build.resolve_int(source, "vm_id")
+            if vm_id is None:
+                continue
+            if all(lease["vm_id"] != vm_id for lease in leases):
+                lease = self.acquire(vm_id, label, stop, log)
+                if lease is None:
+                    break
+                leases.append(lease)
+            vm_ids[source] = vm_id
+        else:
+            for source, clone_id in (clone_ids or {}).items():
+                expression = build.source_settings.get(source, {}).get("clone_vm_id", "")
+                variable = _VAR_REFERENCE.fullmatch(expression)
+                if variable and f"{variable.group(1)}={clone_id}" not in args:
+                    args.extend(["-var", f"{variable.group(1)}={clone_id}"])
+            return leases, args, vm_ids
+        
+        for lease in leases:
+            self.release(lease)
+        return None
+
+
+class NodeInventory:
+    """Proxmox node capacities used to admit builds without overcommitting
+    
+    The inventory is a TOML or YAML file::
+    
+        default_node = "pve1"
+        
+        [nodes.pve1]
+        cores = 32        # vCPUs available to builds
+        memory = 131072   # MiB available to builds
+    
+    A build's demand is the ``cores * sockets`` and ``memory`` of the
+    sources its packer process runs at once (Proxmox defaults: 1 core,
+    512 MiB); it runs on the node its ``node`` setting resolves to through
+    the variables file.
+    """
+    
+    def __init__(self, nodes: Dict[str, Dict[str, int]], default_node: Optional[str] = None):
+        self.nodes = nodes
+        self.default_node = default_node or (next(iter(nodes)) if len(nodes) == 1 else None)
+        self.used = {name: [0, 0] for name in nodes}
+        self.peak = {name: [0, 0] for name in nodes}
+        # Integral of used cores/memory over time, for average utilisation
+        self.area = {name: [0.0, 0.0] for name in nodes}
+        self._last = time.monotonic()
+        self._var_files: Dict[Path, Dict[str, str]] = {}
+    
+    @classmethod
+    def load(cls, path: Path) -> "NodeInventory":
+        text = path.read_text()
+        if path.suffix.lower() in (".yaml", ".yml"):
+            if yaml is None:
+                raise RuntimeError("PyYAML is required for YAML inventories (pip install pyyaml)")
+            data = yaml.safe_load(text) or {}
+        else:
+            if tomllib is None:
+                raise RuntimeError("TOML inventories need Python 3.11+; use YAML instead")
+            data = tomllib.loads(text)
+        
+        nodes = {}
+        for name, spec in (data.get("nodes") or {}).items():
+            try:
+                nodes[str(name)] = {"cores": int(spec["cores"]), "memory": int(spec["memory"])}
+            except (KeyError, TypeError, ValueError):
+                raise RuntimeError(f"Node '{name}' in {path} needs integer cores and memory")
+        if not nodes:
+            raise RuntimeError(f"No nodes defined in {path}")
+        return cls(nodes, data.get("default_node"))
+    
+    def _variables(self, path: Path) -> Dict[str, str]:
+        if path not in self._var_files:
+            values = {}
+            if path.is_file():
+                try:
+                    values = HclIndexer().parse(path.read_text()).attributes
+                except (OSError, ValueError):
+                    pass
+            self._var_files[path] = values
+        return self._var_files[path]
+    
+    def node_for(
+        self,
+        build: PackerBuild,
+        sources: List[str],
+        variables_file: Optional[Path],
+        extra_args: Optional[List[str]] = None
+    ) -> Optional[str]:
+        """Resolve the node a build runs on, falling back to the default node"""
+        # -var NAME=VALUE arguments win over every variables file
+        overrides = {}
+        args = list(extra_args or [])
+        for i, arg in enumerate(args):
+            if arg == "-var" and i + 1 < len(args):
+                name, _, value = args[i + 1].partition("=")
+                overrides[name] = value
+            elif arg.startswith("-var="):
+                name, _, value = arg[len("-var="):].partition("=")
+                overrides[name] = value
+        for source in sources:
+            value = build.source_settings.get(source, {}).get("node")
+            if value is None:
+                continue
+            match = _VAR_REFERENCE.fullmatch(value)
+            if match:
+                value = overrides.get(match.group(1))
+                for path in (variables_file, build.variables_file):
+                    if value is not None:
+                        break
+                    if path is not None and match.group(1) in self._variables(path):
+                        value = self._variables(path)[match.group(1)]
+                        break
+                if value is None:
+                    value = build.variable_defaults.get(match.group(1))
+            if value is not None and value.strip('"') in self.nodes:
+                return value.strip('"')
+        return self.default_node
+    
+    @staticmethod
+    def demand(build: PackerBuild, sources: List[str], parallel: Optional[int] = None) -> Tuple[int, int]:
+        """vCPUs and MiB of memory the sources of one packer run hold at once"""
+        per_source = []
+        for source in sources:
+            cores = (build.resolve_int(source, "cores") or 1) * (build.resolve_int(source, "sockets") or 1)
+            per_source.append((cores, build.resolve_int(source, "memory") or 512))
+        if parallel:
+            per_source = sorted(per_source, reverse=True)[:parallel]
+        return sum(c for c, _ in per_source), sum(m for _, m in per_source)
+    
+    def _tick(self) -> None:
+        now = time.monotonic()
+        for name, (cores, memory) in self.used.items():
+            self.area[name][0] += cores * (now - self._last)
+            self.area[name][1] += memory * (now - self._last)
+        self._last = now
+    
+    def fits(self, node: str, demand: Tuple[int, int]) -> bool:
+        """Whether a demand fits next to what already runs on a node
+        
+        A build larger than the whole node is admitted once the node is idle.
+        """
+        used, capacity = self.used[node], self.nodes[node]
+        if used == [0, 0]:
+            return True
+        return used[0] + demand[0] <= capacity["cores"] and used[1] + demand[1] <= capacity["memory"]
+    
+    def reserve(self, node: str, demand: Tuple[int, int]) -> None:
+        self._tick()
+        used = self.used[node]
+        used[0] += demand[0]
+        used[1] += demand[1]
+        self.peak[node] = [max(self.peak[node][0], used[0]), max(self.peak[node][1], used[1])]
+    
+    def release(self, node: str, demand: Tuple[int, int]) -> None:
+        self._tick()
+        self.used[node][0] -= demand[0]
+        self.used[node][1] -= demand[1]
+    
+    def print_report(self, wall: float, echo: Callable[..., None] = print) -> None:
+        self._tick()
+        echo(f"{Colors.BOLD}Node utilisation:{Colors.ENDC}")
+        for name, capacity in self.nodes.items():
+            avg_cores = self.area[name][0] / wall / capacity["cores"] * 100 if wall else 0
+            avg_memory = self.area[name][1] / wall / capacity["memory"] * 100 if wall else 0
+            echo(f"  {name:<12} cores avg {avg_cores:5.1f}% peak {self.peak[name][0]}/{capacity['cores']}"
+                 f"   memory avg {avg_memory:5.1f}% peak {self.peak[name][1]}/{capacity['memory']} MiB")
+
+
+class RunState:
+    """Per-source outcome of a run, kept in ``.buildmanager/runs/<run-id>.json``
+    
+    The file is rewritten whenever a build finishes, so it survives a crash
+    or Ctrl+C. ``--resume <run-id>`` rebuilds the sources that did not
+    succeed and keeps updating the same file.
+    """
+    
+    # Source states that a resume does not need to run again
+    DONE = ("succeeded", "cached")
+    KEEP = 50
+    
+    def __init__(self, path: Path, data: Dict):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+    
+    @property
+    def run_id(self) -> str:
+        return self.data["run_id"]
+    
+    @classmethod
+    def create(cls, directory: Path, variables_file: Optional[Path], packer_args: List[str]) -> "RunState":
+        run_id = time.strftime("%Y%m%d-%H%M%S", time.gmtime()) + "-" + os.urandom(2).hex()
+        directory.mkdir(parents=True, exist_ok=True)
+        for old in sorted(directory.glob("*.json"))[:-(cls.KEEP - 1)]:
+            old.unlink(missing_ok=True)
+        return cls(directory / f"{run_id}.json", {
+            "run_id": run_id,
+            "created": time.time(),
+            "variables_file": str(variables_file) if variables_file else None,
+            "packer_args": list(packer_args),
+            "builds": {},
+        })
+    
+    @classmethod
+    def load(cls, directory: Path, run_id: str) -> "RunState":
+        """Load a run by ID, or the most recent one for ``last``"""
+        if run_id == "last":
+            runs = sorted(directory.glob("*.json"))
+            if not runs:
+                raise RuntimeError(f"No recorded runs in {directory}")
+            path = runs[-1]
+        else:
+            path = directory / f"{run_id}.json"
+        try:
+            return cls(path, json.loads(path.read_text()))
+        except FileNotFoundError:
+            raise RuntimeError(f"Unknown run '{run_id}' (see {directory})")
+        except ValueError as e:
+            raise RuntimeError(f"Corrupt run state {path}: {e}")
+    
+    def update(self, task: BuildTask, repo_root: Path) -> None:
+        """Record the state of every source of a task and save the file"""
+        fallback = {"running": "pending", "skipped": "skipped", "cancelled": "pending"}.get(
+            task.status, task.status
+        )
+        key = task.build.path.relative_to(repo_root).as_posix()
+        with self._lock:
+            if task.variant:
+                key += f"@{task.variant}"
+                self.data.setdefault("variants", {})[task.variant] = {
+                    "variables_file": str(task.variant_file) if task.variant_file else None,
+                    "var_args": task.variant_args,
+                }
+            sources = self.data["builds"].setdefault(key, {})
+            for source in task.selected_sources:
+                sources[source] = task.source_status.get(source, fallback)
+            self.data["updated"] = time.time()
+            tmp = self.path.with_name(f".{self.path.name}.tmp")
+            tmp.write_text(json.dumps(self.data, indent=2))
+            os.replace(tmp, self.path)
+    
+    def unfinished(self) -> Dict[str, List[str]]:
+        """Sources of each build directory (``path@variant`` for matrix runs) that failed or never ran"""
+        result = {}
+        for key, sources in self.data["builds"].items():
+            left = [s for s, status in sources.items() if status not in self.DONE]
+            if left:
+                result[key] = left
+        return result
+
+
+class SourceOutputSplitter:
+    """Attribute the interleaved output of a multi-source packer run to its sources
+    
+    Packer prefixes UI lines with the full build name (``build.type.name``
+    or ``type.name``) and announces the end of every build with
+    ``Build '<name>' finished`` or ``Build '<name>' errored``; those are
+    used to route lines and to derive a result per source.
+    """
+    
+    _RESULT = re.compile(r"Build '(?P<name>[^']+)' (?P<result>finished|errored)")
+    
+    def __init__(self, sources: List[str]):
+        self.sources = list(sources)
+        self.status: Dict[str, str] = {}
+        names = "|".join(re.escape(s) for s in sorted(self.sources, key=len, reverse=True))
+        self._prefix = re.compile(
+            r"(?:^|[\s>])(?:[\w-]+\.)?(" + names + r")(?=[:\s']|$)"
+        ) if self.sources else None
+    
+    def _source_of(self, name: str) -> Optional[str]:
+        for source in self.sources:
+            if name == source or name.endswith("." + source):
+                return source
+        return None
+    
+    def feed(self, line: str) -> Optional[str]:
+        """Return the source a line belongs to, recording build results"""
+        match = self._RESULT.search(line)
+        if match:
+            source = self._source_of(match.group("name"))
+            if source:
+                self.status[source] = "succeeded" if match.group("result") == "finished" else "failed"
+                return source
+        if self._prefix:
+            match = self._prefix.search(line)
+            if match:
+                return match.group(1)
+        return None
+    
+    def results(self, returncode: int, interrupted: bool = False) -> Dict[str, str]:
+        """Final status per source, falling back to the process exit code"""
+        fallback = "succeeded" if returncode == 0 else "interrupted" if interrupted else "failed"
+        return {s: self.status.get(s, fallback) for s in self.sources}
+
+
+class StepTimer:
+    """Turn packer ``-machine-readable`` output into per-source step spans
+    
+    Every ``==> source: message`` UI line starts a step of its source that
+    lasts until the next one (or until the build finishes). Steps are
+    grouped into coarse categories so regressions in, say, waiting for
+    WinRM stand out across builds.
+    """
+    
+    RECORD = re.compile(r"^(\d+),([^,]*),([\w-]+),(.*)$")
+    # How packer's normal UI shows each kind of UI message
+    STREAMS = {"error": "stderr"}
+    STYLES = {"say": Colors.BOLD, "error": Colors.FAIL}
+    STEP = re.compile(r"^==> (?P<target>[^:\s]+): (?P<message>.*)$")
+    RESULT = re.compile(r"Build '(?P<name>[^']+)' (?P<result>finished|errored)")
+    CATEGORIES = [
+        ("iso", re.compile(r"\bISO\b|\.iso\b|CD disk|cd_files", re.I)),
+        ("boot_wait", re.compile(r"for boot|boot command", re.I)),
+        ("communicator", re.compile(r"Waiting for (SSH|WinRM)|Using (SSH|WinRM)|Connected to (SSH|WinRM)|"
+                                    r"WinRM connected|communicator", re.I)),
+        ("provision", re.compile(r"Provisioning|Running local shell|Uploading .* =>|Restarting Machine|"
+                                 r"Waiting for machine to restart|Ansible|PowerShell", re.I)),
+        ("shutdown", re.compile(r"Stopping|shutdown|Shutting down|Gracefully", re.I)),
+        ("template", re.compile(r"template|post-processor|Saving|manifest", re.I)),
+        ("create_vm", re.compile(r"Creating VM|Cloning|Starting VM|Creating temporary|Prevalidating", re.I)),
+    ]
+    
+    def __init__(self, build: PackerBuild, sources: List[str]):
+        self.build = build
+        self.sources = list(sources)
+        self.started = time.time()
+        self.spans: Dict[str, List[Dict]] = {}
+        self.results: Dict[str, str] = {}
+        self._open: Dict[str, Dict] = {}
+        self._last = 0.0
+    
+    def _source_of(self, target: str) -> str:
+        for source in self.sources:
+            if target == source or target.endswith("." + source):
+                return source
+        return target
+    
+    @classmethod
+    def category(cls, message: str) -> str:
+        for name, pattern in cls.CATEGORIES:
+            if pattern.search(message):
+                return name
+        return "other"
+    
+    def _close(self, source: str, elapsed: float) -> None:
+        span = self._open.pop(source, None)
+        if span:
+            span["end"] = round(elapsed, 3)
+            span["duration"] = round(elapsed - span["start"], 3)
+    
+    def feed(self, line: str, elapsed: float) -> List[Tuple[str, str]]:
+        """Record one output line and return the human-readable lines it contains
+        
+        Each line comes with the kind of UI message it was (``say``, ``message``
+        or ``error``), which ``stream`` and ``style`` turn back into what
+        packer's normal UI would have shown. Machine-readable records other
+        than UI messages (artifacts, counts) return nothing; lines that are not
+        records are returned unchanged with an empty kind.
+        """
+        self._last = elapsed
+        match = self.RECORD.match(line)
+        if not match:
+            return [("", line)]
+        _, target, kind, data = match.groups()
+        if kind != "ui":
+            return []
+        ui_kind, _, message = data.partition(",")
+        text = message.replace("%!(PACKER_COMMA)", ",").replace("\\n", "\n").replace("\\r", "")
+        
+        for part in text.splitlines() or [""]:
+            step = self.STEP.match(part)
+            if step:
+                source = self._source_of(step.group("target"))
+                self._close(source, elapsed)
+                span = {
+                    "step": step.group("message").strip(),
+                    "category": self.category(step.group("message")),
+                    "start": round(elapsed, 3),
+                }
+                self.spans.setdefault(source, []).append(span)
+                self._open[source] = span
+                continue
+            result = self.RESULT.search(part)
+            if result:
+                source = self._source_of(result.group("name"))
+                self._close(source, elapsed)
+                self.results[source] = "succeeded" if result.group("result") == "finished" else "failed"
+        return [(ui_kind, part) for part in text.splitlines()]
+    
+    @classmethod
+    def stream(cls, kind: str, default: str = "stdout") -> str:
+        """Stream packer's normal UI writes a kind of UI message to"""
+        return cls.STREAMS.get(kind, default)
+    
+    @classmethod
+    def style(cls, kind: str, text: str) -> str:
+        """Console rendering of a UI message, colored like packer's normal UI"""
+        color = cls.STYLES.get(kind)
+        return f"{color}{text}{Colors.ENDC}" if color and text else text
+    
+    def finish(self) -> None:
+        """Close the steps still open when the process exited"""
+        for source in list(self._open):
+            self._close(source, self._last)
+    
+    def to_dict(self) -> Dict:
+        sources = {}
+        for source, spans in self.spans.items():
+            categories: Dict[str, float] = {}
+            for span in spans:
+                categories[span["category"]] = round(
+                    categories.get(span["category"], 0.0) + span.get("duration", 0.0), 3
+                )
+            sources[source] = {
+                "status": self.results.get(source),
+                "duration": round(spans[-1].get("end", spans[-1]["start"]) - spans[0]["start"], 3),
+                "categories": categories,
+                "spans": spans,
+            }
+        return {
+            "build": self.build.build_name,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+            "sources": sources,
+        }
+
+
+class Watchdog:
+    """Stop a packer run that exceeds its timeout or stops producing output
+    
+    The idle limit can depend on the step a build is in, keyed by the
+    ``StepTimer`` categories: a Windows build may sit silently in
+    ``communicator`` while setup runs, but should never go quiet that long
+    while provisioning. With several sources in one run, the most lenient
+    limit of their current steps applies.
+    """
+    
+    POLL = 1.0
+    # Seconds between SIGINT (packer destroys the VM) and SIGKILL
+    GRACE = 120
+    
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        idle_timeout: Optional[float] = None,
+        step_idle: Optional[Dict[str, float]] = None
+    ):
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.step_idle = step_idle or {}
+        self.started = self.last_output = time.monotonic()
+        self.steps: Dict[str, str] = {}
+        self.reason: Optional[str] = None
+    
+    @classmethod
+    def categories(cls) -> List[str]:
+        return [name for name, _ in StepTimer.CATEGORIES] + ["other"]
+    
+    @classmethod
+    def for_build(
+        cls,
+        build: PackerBuild,
+        timeouts: Dict[str, float],
+        idle_timeouts: Dict[str, float]
+    ) -> Optional["Watchdog"]:
+        """Watchdog with the limits that apply to a build, or None without limits"""
+        categories = cls.categories()
+        
+        def pick(table: Dict[str, float]) -> Optional[float]:
+            value = table.get("")
+            for selector, seconds in table.items():
+                if not selector or selector in categories:
+                    continue
+                selector = selector.lower()
+                texts = [build.build_name, build.path.as_posix(), *build.sources]
+                if any(c in selector for c in "*?["):
+                    matched = any(fnmatch.fnmatch(t.lower(), selector) for t in texts)
+                else:
+                    matched = any(selector in t.lower() for t in texts)
+                if matched:
+                    value = seconds
+            # An explicit 0 turns the limit off
+            return value or None
+        
+        step_idle = {k: v for k, v in idle_timeouts.items() if k in categories and v}
+        timeout, idle_timeout = pick(timeouts), pick(idle_timeouts)
+        if not timeout and not idle_timeout and not step_idle:
+            return None
+        return cls(timeout, idle_timeout, step_idle)
+    
+    def feed(self, line: str) -> None:
+        """Note output progress and the step each source is in"""
+        self.last_output = time.monotonic()
+        step = StepTimer.STEP.match(line)
+        if step:
+            self.steps[step.group("target")] = StepTimer.category(step.group("message"))
+            return
+        result = StepTimer.RESULT.search(line)
+        if result:
+            self.steps = {t: c for t, c in self.steps.items() if not result.group("name").endswith(t)}
+    
+    def idle_limit(self) -> Optional[float]:
+        limits = [self.step_idle[c] for c in self.steps.values() if c in self.step_idle]
+        return max(limits) if limits else self.idle_timeout
+    
+    def check(self) -> Optional[str]:
+        """Reason the run has to be stopped, if any"""
+        now = time.monotonic()
+        if self.timeout and now - self.started > self.timeout:
+            return f"exceeded timeout of {format_duration(self.timeout)}"
+        idle = self.idle_limit()
+        if idle and now - self.last_output > idle:
+            steps = ", ".join(sorted(set(self.steps.values())))
+            return f"no output for {format_duration(idle)}" + (f" (in {steps})" if steps else "")
+        return None
+    
+    def wait(self, future: Future, send: Callable[[int], None]) -> int:
+        """Wait for a run's exit code, interrupting and then killing it on a timeout"""
+        interrupted_at = None
+        while True:
+            try:
+                return future.result(timeout=self.POLL)
+            except FutureTimeout:
+                pass
+            if self.reason is None:
+                self.reason = self.check()
+                if self.reason:
+                    send(signal.SIGINT)
+                    interrupted_at = time.monotonic()
+            elif interrupted_at and time.monotonic() - interrupted_at > self.GRACE:
+                send(signal.SIGKILL if os.name != "nt" else signal.SIGTERM)
+                interrupted_at = None
+
+
+class PackerRun:
+    """One packer process, run the same way for a single build and by the executor
+    
+    Every line of output is rendered back from ``-machine-readable`` into
+    packer's UI, fed to the step timer, the watchdog and the source
+    splitter, and written to the build log under the label of its source.
+    ``show(source, text, styled)`` gets the lines meant for the console and
+    ``on_text(source, text)``, if given, every line.
+    """
+    
+    def __init__(
+        self,
+        manager: "PackerBuildManager",
+        build: PackerBuild,
+        command: str,
+        cmd: List[str],
+        sources: List[str],
+        name: str,
+        label: str,
+        log_name: str,
+        show: Callable[[Optional[str], str, str], None],
+        timings: bool = False,
+        variant: Optional[str] = None,
+        on_text: Optional[Callable[[Optional[str], str], None]] = None
+    ):
+        self.manager = manager
+        self.build = build
+        self.cmd = cmd
+        self.name = name
+        self.label = label
+        self.show = show
+        self.variant = variant
+        self.on_text = on_text
+        self.splitter = SourceOutputSplitter(sources)
+        self.timer = StepTimer(build, self.splitter.sources) if timings else None
+        self.watchdog = None
+        if command == "build":
+            self.watchdog = Watchdog.for_build(build, manager.timeouts, manager.idle_timeouts)
+        self.log = manager.runner.open_log(build, log_name)
+        self.processes: List = []
+        self.timings_path: Optional[Path] = None
+    
+    def on_line(self, stream: str, line: str, elapsed: float) -> None:
+        """Handle a line of either stream; called on the runner's loop thread"""
+        lines = self.timer.feed(line, elapsed) if self.timer and stream == "stdout" else [("", line)]
+        multiple = len(self.splitter.sources) > 1
+        for kind, text in lines:
+            if self.watchdog:
+                self.watchdog.feed(text)
+            source = self.splitter.feed(text)
+            if self.on_text:
+                self.on_text(source, text)
+            label = f"{self.name}:{source}" if multiple and source else self.label
+            out = StepTimer.stream(kind, stream)
+            self.log.write(f"{elapsed:10.3f} [{label}] {out}: {text}")
+            if self.manager.runner.visible(out, text):
+                self.show(source if multiple else None, text, StepTimer.style(kind, text))
+    
+    def start(self, on_start: Optional[Callable] = None, new_session: bool = True) -> Future:
+        """Start packer on the manager's runner and return a future for its exit code"""
+        def started(proc) -> None:
+            self.processes.append(proc)
+            if on_start:
+                on_start(proc)
+        
+        return self.manager.runner.submit(
+            self.cmd, self.build.path, self.manager.packer_env(), self.on_line, started, new_session
+        )
+    
+    @staticmethod
+    def signal_group(proc, sig: int) -> None:
+        """Send a signal to a packer process group"""
+        try:
+            if os.name == "nt":
+                proc.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                os.killpg(proc.pid, sig)
+        except (ProcessLookupError, PermissionError, OSError):
+            pass
+    
+    def send(self, sig: int) -> None:
+        for proc in list(self.processes):
+            self.signal_group(proc, sig)
+    
+    def wait(self, future: Future) -> int:
+        """Exit code of the run, which the watchdog stops if it hangs"""
+        if self.watchdog is None:
+            return future.result()
+        return self.watchdog.wait(future, self.send)
+    
+    def finish(self, returncode: int, interrupted: bool = False) -> Dict[str, str]:
+        """Close the log, save the step timings and return the result of each source"""
+        self.log.close()
+        if self.timer:
+            self.timer.finish()
+            self.timings_path = self.manager.save_timings(self.timer, self.variant)
+        results = self.splitter.results(returncode, interrupted)
+        if self.watchdog and self.watchdog.reason:
+            results = {s: r if r == "succeeded" else "timed-out" for s, r in results.items()}
+        return results
+
+
+class ParallelBuildExecutor:
+    """Run build tasks on a bounded worker pool with per-provider caps"""
+    
+    def __init__(
+        self,
+        manager: "PackerBuildManager",
+        max_workers: int = 1,
+        provider_limits: Optional[Dict[str, int]] = None,
+        dry_run: bool = False,
+        cache: Optional[BuildCache] = None,
+        force: bool = False,
+        parallel_builds: Optional[int] = None,
+        leases: Optional[VmIdAllocator] = None,
+        graph: Optional[BuildGraph] = None,
+        inventory: Optional[NodeInventory] = None,
+        estimator: Optional[DurationEstimator] = None,
+        order: str = "fifo",
+        progress_interval: float = 0,
+        run_state: Optional[RunState] = None,
+        retries: int = 0,
+        retry_backoff: float = 60,
+        retry_on: Optional[List[str]] = None,
+        on_error: Optional[str] = None
+    ):
+        self.manager = manager
+        self.max_workers = max(1, max_workers)
+        self.provider_limits = provider_limits or {}
+        self.dry_run = dry_run
+        self.cache = cache
+        self.force = force
+        self.parallel_builds = parallel_builds
+        self.leases = leases
+        self.graph = graph
+        self.inventory = inventory
+        self.estimator = estimator or DurationEstimator()
+        self.order = order
+        self.progress_interval = progress_interval
+        self.run_state = run_state
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.transient = re.compile("|".join(self.TRANSIENT_ERRORS + list(retry_on or [])), re.IGNORECASE)
+        self.on_error = on_error
+        self._processes: Dict[int, asyncio.subprocess.Process] = {}
+        self._lock = threading.Lock()
+        self._print_lock = threading.Lock()
+        self._stop = manager.stop or threading.Event()
+        self.slots = manager.slots
+        self._starved = False
+    
+    def _log(self, task: BuildTask, message: str, source: Optional[str] = None) -> None:
+        label = f"{task.name}:{source}" if source else task.label
+        with self._print_lock:
+            self.manager.echo(f"{Colors.OKBLUE}[{label}]{Colors.ENDC} {message}", flush=True)
+    
+    # Output of failures worth retrying: Proxmox API/task timeouts and
+    # communicators that could not connect yet
+    TRANSIENT_ERRORS = [
+        r"timeout waiting for",
+        r"context deadline exceeded",
+        r"i/o timeout",
+        r"connection (?:refused|reset by peer)",
+        r"TLS handshake timeout",
+        r"\b50[234]\b .*(?:Bad Gateway|Service Unavailable|Gateway Time-?out)",
+        r"got timeout",
+        r"unable to create VM .*(?:locked|timeout)",
+        r"winrm.*(?:error|timeout|connection)",
+        r"Timeout waiting for (?:WinRM|SSH)",
+    ]
+    
+    # Final states that prevent dependent tasks from running
+    BLOCKING_STATES = ("failed", "timed-out", "interrupted", "cancelled", "skipped")
+    # Final states that count as a successful build
+    SUCCESS_STATES = ("succeeded", "cached")
+    
+    def _can_start(self, task: BuildTask, running: List[BuildTask]) -> bool:
+        """Check whether a task's dependencies are done and it fits the caps"""
+        if any(dep.status not in self.SUCCESS_STATES for dep in task.dependencies):
+            return False
+        if task.ready_at is None:
+            task.ready_at = time.monotonic()
+        if len(running) >= self.max_workers:
+            return False
+        limit = self.provider_limits.get(task.provider)
+        if limit is not None:
+            active = sum(1 for t in running if t.provider == task.provider)
+            if active >= limit:
+                return False
+        if self.inventory and task.node and not self.inventory.fits(task.node, task.demand):
+            return False
+        # Claimed last, so a slot is only taken by a task that starts now
+        if self.slots and not self.slots.try_acquire(task.provider):
+            self._starved = True
+            return False
+        return True
+    
+    def _run_process(self, task: BuildTask, command: str, sources: Optional[List[str]]) -> int:
+        """Run one packer command for a task, prefixing its output per source"""
+        timings = self.manager.wants_timings(command, task.extra_args)
+        extra_args = self.manager.with_on_error(
+            command, list(task.extra_args) + (task.var_overrides if command == "build" else []), self.on_error
+        )
+        task.transient = set()
+        cmd = self.manager.build_packer_command(
+            task.build, command, ",".join(sources) if sources else None,
+            task.variables_file, extra_args, self.parallel_builds, timings
+        )
+        self._log(task, f"{Colors.OKCYAN}{' '.join(cmd)}{Colors.ENDC}")
+        if self.dry_run:
+            self._log(task, f"{Colors.WARNING}[DRY RUN] Command not executed{Colors.ENDC}")
+            task.source_status.update(SourceOutputSplitter(sources or task.build.sources).results(0))
+            return 0
+        
+        if self._stop.is_set():
+            return 130
+        
+        def on_start(proc) -> None:
+            with self._lock:
+                self._processes[proc.pid] = proc
+                stopping = self._stop.is_set()
+            if stopping:
+                PackerRun.signal_group(proc, signal.SIGINT)
+        
+        def show(source: Optional[str], text: str, styled: str) -> None:
+            task.output.append(text)
+            self._log(task, styled, source)
+        
+        def on_text(source: Optional[str], text: str) -> None:
+            if command == "build" and self.transient.search(text):
+                task.transient.add(source or "*")
+        
+        name = f"{command}@{task.variant}" if task.variant else command
+        run = PackerRun(
+            self.manager, task.build, command, cmd, sources or task.build.sources, task.name, task.label,
+            f"{name}-{','.join(sources)}" if sources else name, show, timings, task.variant, on_text
+        )
+        returncode = 1
+        try:
+            returncode = run.wait(run.start(on_start))
+        except Exception as e:
+            self._log(task, f"{Colors.FAIL}Error executing packer: {e}{Colors.ENDC}")
+            return 1
+        finally:
+            with self._lock:
+                for proc in run.processes:
+                    self._processes.pop(proc.pid, None)
+            results = run.finish(returncode, self._stop.is_set())
+            if run.log.paths:
+                self._log(task, f"{Colors.OKCYAN}log: {run.log.paths[0]}{Colors.ENDC}")
+            if run.timings_path:
+                self._log(task, f"{Colors.OKCYAN}step timings: {run.timings_path}{Colors.ENDC}")
+        
+        if command == "build":
+            if run.watchdog and run.watchdog.reason:
+                task.timed_out = run.watchdog.reason
+                self._log(task, f"{Colors.FAIL}timed out: {run.watchdog.reason}{Colors.ENDC}")
+            task.source_status.update(results)
+        return returncode
+    
+    def _run_task(self, task: BuildTask) -> int:
+        """Validate and/or build a task, stopping at the first failure"""
+        steps = []
+        if task.validate:
+            steps.append("validate")
+        if task.run_build:
+            steps.append("build")
+        
+        # Sources left to run; None lets packer build every source
+        sources = task.sources
+        fingerprints = {}
+        if self.cache and task.run_build and task.selected_sources:
+            fingerprints, cached = self.cache.partition(
+                task.build, task.selected_sources, task.variables_file, task.extra_args, task.variant
+            )
+            # A base rebuilt in this run always forces its clones to rebuild
+            rebuilt_upstream = any(dep.status == "succeeded" for dep in task.dependencies)
+            if self.force or rebuilt_upstream:
+                cached = {}
+            for source, manifest in cached.items():
+                task.source_status[source] = "cached"
+                self._log(task, f"{Colors.OKGREEN}up to date ({manifest}), "
+                                f"skipping (use --force to rebuild){Colors.ENDC}", source)
+            if cached and len(cached) == len(task.selected_sources):
+                task.cached = True
+                return 0
+            if cached:
+                sources = [s for s in task.selected_sources if s not in cached]
+        
+        leases = []
+        if self.leases and task.run_build and task.provider == "proxmox" and not self.dry_run:
+            run_sources = sources or task.selected_sources
+            result = self.leases.lease_build(
+                task.build, run_sources, task.label, self._clone_ids(task, run_sources),
+                self._stop, lambda message: self._log(task, message)
+            )
+            if result is None:
+                return 130
+            leases, task.var_overrides, task.vm_ids = result
+            if leases:
+                ids = ", ".join(str(lease["vm_id"]) for lease in leases)
+                self._log(task, f"leased VM ID(s) {ids}")
+        
+        started = time.time()
+        returncode = 0
+        try:
+            for command in steps:
+                if self._stop.is_set():
+                    return 130
+                returncode = self._run_process(task, command, sources)
+                attempt = 0
+                while command == "build" and returncode != 0 and attempt < self.retries:
+                    retry = self._transient_failures(task, sources)
+                    if not retry or self._stop.is_set():
+                        break
+                    attempt += 1
+                    delay = self.retry_backoff * 2 ** (attempt - 1)
+                    self._log(task, f"{Colors.WARNING}transient failure of {', '.join(retry)}; "
+                                    f"retry {attempt}/{self.retries} in {format_duration(delay)}{Colors.ENDC}")
+                    if self._stop.wait(delay):
+                        return 130
+                    returncode = self._run_process(task, command, retry)
+                    # Sources that failed for good still fail the task
+                    if returncode == 0 and any(
+                        task.source_status.get(s) == "failed" for s in (sources or task.selected_sources)
+                    ):
+                        returncode = 1
+                if returncode != 0:
+                    break
+        finally:
+            for lease in leases:
+                self.leases.release(lease)
+        
+        # A failed validate never reached the per-source build step
+        for source in (sources or task.selected_sources) if task.run_build else []:
+            if source not in task.source_status:
+                task.source_status[source] = "succeeded" if returncode == 0 else \
+                    "interrupted" if self._stop.is_set() else "failed"
+        
+        succeeded = {s: fp for s, fp in fingerprints.items()
+                     if task.source_status.get(s) == "succeeded"}
+        if succeeded and not self.dry_run:
+            self.cache.record(task.build, succeeded, started, task.variant)
+        return returncode
+    
+    def _transient_failures(self, task: BuildTask, sources: Optional[List[str]]) -> List[str]:
+        """Failed sources whose output matched a transient error"""
+        failed = [s for s in (sources or task.selected_sources) if task.source_status.get(s) == "failed"]
+        if "*" in task.transient:
+            return failed
+        return [s for s in failed if s in task.transient]
+    
+    def _clone_ids(self, task: BuildTask, sources: List[str]) -> Dict[str, int]:
+        """Template IDs that dependencies of this run were built under"""
+        clone_ids = {}
+        if not self.graph:
+            return clone_ids
+        for source in sources:
+            producer = self.graph.producer_of(task.build, source)
+            if not producer:
+                continue
+            for dep in task.dependencies:
+                if dep.build is producer[0] and producer[1] in dep.vm_ids:
+                    clone_ids[source] = dep.vm_ids[producer[1]]
+        return clone_ids
+    
+    def _signal_all(self, sig: int) -> None:
+        """Send a signal to every running packer process group"""
+        with self._lock:
+            processes = list(self._processes.values())
+        for proc in processes:
+            PackerRun.signal_group(proc, sig)
+    
+    def _interrupt(self, futures: Dict[Future, BuildTask]) -> None:
+        """Forward Ctrl-C to all children and wait for them to clean up"""
+        self._stop.set()
+        with self._print_lock:
+            self.manager.echo(f"\n{Colors.WARNING}Interrupt received, stopping "
+                              f"{len(futures)} running build(s)... "
+                              f"(press Ctrl-C again to kill){Colors.ENDC}", flush=True)
+        self._signal_all(signal.SIGINT)
+        try:
+            wait(futures, timeout=Watchdog.GRACE)
+        except KeyboardInterrupt:
+            pass
+        with self._lock:
+            still_running = bool(self._processes)
+        if still_running:
+            self._signal_all(signal.SIGKILL if os.name != "nt" else signal.SIGTERM)
+            wait(futures)
+    
+    def run(self, tasks: List[BuildTask]) -> int:
+        """Run all tasks and return an aggregate exit code"""
+        pending = list(tasks)
+        futures: Dict[Future, BuildTask] = {}
+        interrupted = False
+        started = time.monotonic()
+        
+        if self.inventory:
+            for task in tasks:
+                if task.provider == "proxmox" and task.run_build:
+                    task.node = self.inventory.node_for(
+                        task.build, task.selected_sources, task.variables_file, task.extra_args
+                    )
+                    task.demand = NodeInventory.demand(
+                        task.build, task.selected_sources, self.parallel_builds
+                    )
+        
+        if self.run_state:
+            for task in tasks:
+                self.run_state.update(task, self.manager.repo_root)
+        
+        self.estimator.plan(tasks, self.parallel_builds)
+        key = ORDER_POLICIES[self.order]
+        pending.sort(key=lambda task: key(task, self.estimator))
+        if any(e is not None for e in self.estimator.estimates.values()):
+            total = self.estimator.batch_remaining([], pending, self.max_workers)
+            self.manager.echo(f"Estimated duration {format_duration(total)} (order: {self.order})")
+        last_progress = time.monotonic()
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            try:
+                while pending or futures:
+                    # A daemon job was cancelled: stop its builds like Ctrl-C would
+                    if self._stop.is_set() and not interrupted:
+                        interrupted = True
+                        self._signal_all(signal.SIGINT)
+                        for task in pending:
+                            task.status = "cancelled"
+                        pending.clear()
+                    running = list(futures.values())
+                    self._starved = False
+                    for task in list(pending):
+                        blocked = [d for d in task.dependencies if d.status in self.BLOCKING_STATES]
+                        if blocked:
+                            pending.remove(task)
+                            task.status = "skipped"
+                            self._log(task, f"{Colors.WARNING}skipped: "
+                                            f"{blocked[0].label} {blocked[0].status}{Colors.ENDC}")
+                            continue
+                        if not self._can_start(task, running):
+                            continue
+                        pending.remove(task)
+                        task.status = "running"
+                        task.started = time.monotonic()
+                        if self.inventory and task.node:
+                            self.inventory.reserve(task.node, task.demand)
+                        # Workers inherit the context, which routes a daemon job's output
+                        futures[pool.submit(self._run_task, task)] = task
+                        running.append(task)
+                        estimate = self.estimator.estimate(task)
+                        if estimate is not None:
+                            self._log(task, f"started, estimated {format_duration(estimate)}")
+                    
+                    if not futures:
+                        # Other jobs of the daemon hold every slot this one could use
+                        if self._starved:
+                            self.slots.wait(1)
+                            continue
+                        for task in pending:
+                            task.status = "cancelled"
+                        break
+                    
+                    # Shared slots free up without a local future finishing
+                    timeout = self.progress_interval or None
+                    if self.slots:
+                        timeout = min(timeout or 1, 1)
+                    done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._finish(futures.pop(future), future)
+                    if self.progress_interval and time.monotonic() - last_progress >= self.progress_interval:
+                        self.print_progress(tasks, list(futures.values()), pending)
+                        last_progress = time.monotonic()
+            except KeyboardInterrupt:
+                interrupted = True
+                self._interrupt(futures)
+                for future, task in list(futures.items()):
+                    self._finish(task, future)
+                for task in pending:
+                    task.status = "cancelled"
+        
+        self.print_summary(tasks)
+        waits = [t for t in tasks if t.queue_wait >= 1]
+        if waits:
+            longest = max(waits, key=lambda t: t.queue_wait)
+            self.manager.echo(f"{Colors.BOLD}Queue wait:{Colors.ENDC} {len(waits)} build(s) waited "
+                              f"{format_duration(sum(t.queue_wait for t in waits))} in total, longest "
+                              f"{longest.label} {format_duration(longest.queue_wait)}")
+        if self.inventory:
+            self.inventory.print_report(time.monotonic() - started, self.manager.echo)
+        if waits or self.inventory:
+            self.manager.echo()
+        if self.run_state:
+            for task in tasks:
+                self.run_state.update(task, self.manager.repo_root)
+            if not all(t.status in self.SUCCESS_STATES for t in tasks):
+                self.manager.echo(f"{Colors.BOLD}Run state:{Colors.ENDC} {self.run_state.path} "
+                                  f"(rerun failed sources with --resume {self.run_state.run_id})\n")
+        if interrupted:
+            return 130
+        return 0 if all(t.status in self.SUCCESS_STATES for t in tasks) else 1
+    
+    def _finish(self, task: BuildTask, future: Future) -> None:
+        task.finished = time.monotonic()
+        if self.slots:
+            self.slots.release(task.provider)
+        if self.inventory and task.node:
+            self.inventory.release(task.node, task.demand)
+        try:
+            task.returncode = future.result()
+        except Exception as e:
+            self._log(task, f"{Colors.FAIL}Error: {e}{Colors.ENDC}")
+            task.returncode = 1
+        if task.returncode == 0:
+            task.status = "cached" if task.cached else "succeeded"
+        elif task.timed_out:
+            task.status = "timed-out"
+        elif self._stop.is_set():
+            task.status = "interrupted"
+        else:
+            task.status = "failed"
+        self._log(task, f"finished: {task.status} (exit {task.returncode}, "
+                        f"{format_duration(task.duration)})")
+        if self.run_state:
+            self.run_state.update(task, self.manager.repo_root)
+    
+    def print_progress(self, tasks: List[BuildTask], running: List[BuildTask], pending: List[BuildTask]) -> None:
+        """Print elapsed time and ETA of every running build and of the batch"""
+        done = len(tasks) - len(running) - len(pending)
+        eta = self.estimator.batch_remaining(running, pending, self.max_workers)
+        finish = time.strftime("%H:%M", time.localtime(time.time() + eta))
+        width = max((len(t.label) for t in running), default=10)
+        with self._print_lock:
+            self.manager.echo(f"{Colors.BOLD}Progress:{Colors.ENDC} {done}/{len(tasks)} done, {len(running)} running, "
+                              f"{len(pending)} queued, batch ETA {format_duration(eta)} (~{finish})")
+            for task in running:
+                estimate = self.estimator.estimate(task)
+                if estimate is None:
+                    eta_text = "no history"
+                elif task.duration > estimate:
+                    eta_text = f"{Colors.WARNING}over estimate{Colors.ENDC}"
+                else:
+                    eta_text = f"ETA {format_duration(estimate - task.duration)}"
+                expected = "?" if estimate is None else format_duration(estimate)
+                self.manager.echo(f"  {task.label:<{width}}  {format_duration(task.duration)} / {expected}  {eta_text}",
+                                  flush=True)
+    
+    def print_summary(self, tasks: List[BuildTask]) -> None:
+        """Print one line per task with its final status"""
+        colors = {
+            "succeeded": Colors.OKGREEN,
+            "cached": Colors.OKGREEN,
+            "failed": Colors.FAIL,
+            "timed-out": Colors.FAIL,
+            "interrupted": Colors.WARNING,
+            "cancelled": Colors.WARNING,
+            "skipped": Colors.WARNING,
+        }
+        width = max((len(t.label) for t in tasks), default=10)
+        self.manager.echo(f"\n{Colors.BOLD}{Colors.HEADER}Build Summary:{Colors.ENDC}\n")
+        for task in tasks:
+            color = colors.get(task.status, Colors.ENDC)
+            code = "-" if task.returncode is None else str(task.returncode)
+            self.manager.echo(f"  {task.label:<{width}}  {color}{task.status:<11}{Colors.ENDC}"
+                              f"  exit {code:>3}  {format_duration(task.duration)}")
+            if task.timed_out:
+                self.manager.echo(f"    {Colors.FAIL}{task.timed_out}{Colors.ENDC}")
+            if len(task.source_status) > 1:
+                for source, status in task.source_status.items():
+                    color = colors.get(status, Colors.ENDC)
+                    self.manager.echo(f"    {Colors.OKCYAN}{source}{Colors.ENDC}  {color}{status}{Colors.ENDC}")
+        
+        failed = sum(1 for t in tasks if t.status not in self.SUCCESS_STATES)
+        total = len(tasks)
+        color = Colors.OKGREEN if failed == 0 else Colors.FAIL
+        self.manager.echo(f"\n{color}{total - failed}/{total} succeeded{Colors.ENDC}\n")
+        
+        variants = list(dict.fromkeys(t.variant for t in tasks if t.variant))
+        if variants:
+            self.manager.echo(f"{Colors.BOLD}Variants:{Colors.ENDC}")
+            for variant in variants:
+                members = [t for t in tasks if t.variant == variant]
+                ok = sum(1 for t in members if t.status in self.SUCCESS_STATES)
+                color = Colors.OKGREEN if ok == len(members) else Colors.FAIL
+                self.manager.echo(f"  {variant:<20} {color}{ok}/{len(members)} succeeded{Colors.ENDC}")
+            self.manager.echo()
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration in seconds as h:mm:ss"""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def write_metrics_textfile(path: Path, samples: Dict[str, float]) -> None:
+    """Merge samples into a Prometheus textfile-collector file, atomically
+    
+    Series already in the file for other builds are kept, series with the
+    same name and labels are replaced.
+    """
+    help_text = {
+        "packer_build_duration_seconds": ("gauge", "Wall time of the last packer build of a source"),
+        "packer_build_success": ("gauge", "Whether the last packer build of a source succeeded"),
+        "packer_build_step_seconds": ("gauge", "Time spent per step category in the last build"),
+        "packer_build_last_run_timestamp_seconds": ("gauge", "Start time of the last packer build"),
+    }
+    series: Dict[str, float] = {}
+    if path.exists():
+        for line in path.read_text().splitlines():
+            if line and not line.startswith("#"):
+                key, _, value = line.rpartition(" ")
+                try:
+                    series[key] = float(value)
+                except ValueError:
+                    pass
+    series.update({key: float(value) for key, value in samples.items()})
+    
+    lines = []
+    for metric, (kind, description) in help_text.items():
+        keys = sorted(k for k in series if k.split("{", 1)[0] == metric)
+        if not keys:
+            continue
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} {kind}")
+        lines.extend(
+            f"{key} {int(series[key]) if series[key].is_integer() else round(series[key], 3)}"
+            for key in keys
+        )
+    
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text("\n".join(lines) + "\n")
+    os.replace(tmp, path)
+
+
+def format_size(num_bytes: float) -> str:
+    """Format a byte count with a binary unit"""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(num_bytes) < 1024 or unit == "GiB":
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+
+def parse_duration(value: str) -> float:
+    """Parse a duration such as 90, 90s, 45m, 3h or 1h30m into seconds"""
+    match = re.fullmatch(r"(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s?)?", value.strip().lower())
+    if not match or not any(match.groups()):
+        raise ValueError(f"Invalid duration '{value}' (e.g. 90, 45m, 3h, 1h30m)")
+    hours, minutes, seconds = (int(g or 0) for g in match.groups())
+    return float(hours * 3600 + minutes * 60 + seconds)
+
+
+def parse_timeouts(values: Optional[List[str]]) -> Dict[str, float]:
+    """Parse repeated [SELECTOR=]DURATION options; the bare form is the default"""
+    timeouts = {}
+    for value in values or []:
+        selector, sep, duration = value.rpartition("=")
+        timeouts[selector.strip() if sep else ""] = parse_duration(duration)
+    return timeouts
+
+
+def matrix_variants(
+    files: Optional[List[Path]],
+    variables: Optional[List[str]]
+) -> List[Tuple[str, Optional[Path], List[str]]]:
+    """Expand matrix options into (name, variables file, -var arguments) variants"""
+    axes: List[List[Tuple[str, Optional[Path], List[str]]]] = []
+    if files:
+        for path in files:
+            if not path.is_file():
+                raise ValueError(f"Variables file not found: {path}")
+        stems = [re.sub(r"(\.auto)?(\.pkrvars)?\.(hcl|json)$", "", p.name) for p in files]
+        axes.append([
+            (stem if stems.count(stem) == 1 else f"{stem}{i + 1}", path.resolve(), [])
+            for i, (stem, path) in enumerate(zip(stems, files))
+        ])
+    for value in variables or []:
+        name, sep, values = value.partition("=")
+        choices = [v.strip() for v in values.split(",") if v.strip()]
+        if not sep or not name.strip() or not choices:
+            raise ValueError(f"Invalid matrix variable '{value}' (expected NAME=V1[,V2...])")
+        axes.append([(v, None, ["-var", f"{name.strip()}={v}"]) for v in choices])
+    
+    variants = [("", None, [])] if axes else []
+    for axis in axes:
+        variants = [
+            ("+".join(filter(None, (name, axis_name))), axis_file or path, args + axis_args)
+            for name, path, args in variants
+            for axis_name, axis_file, axis_args in axis
+        ]
+    return variants
+
+
+def parse_provider_limits(values: Optional[List[str]]) -> Dict[str, int]:
+    """Parse repeated PROVIDER=N options into a dict"""
+    limits = {}
+    for value in values or []:
+        provider, sep, count = value.partition("=")
+        if not sep or not count.isdigit() or int(count) < 1:
+            raise ValueError(f"Invalid provider limit '{value}' (expected PROVIDER=N)")
+        limits[provider.strip()] = int(count)
+    return limits
+
+
+def run_parallel(
+    manager: PackerBuildManager,
+    tasks: List[BuildTask],
+    args,
+    run_state: Optional[RunState] = None
+) -> int:
+    """Run several selected builds through the parallel executor"""
+    try:
+        provider_limits = parse_provider_limits(args.provider_limit)
+    except ValueError as e:
+        manager.echo(f"{Colors.FAIL}Error: {e}{Colors.ENDC}")
+        return 1
+    
+    if args.vars and not args.vars.exists():
+        manager.echo(f"{Colors.FAIL}Error: Variables file not found: {args.vars}{Colors.ENDC}")
+        return 1
+    
+    inventory = None
+    if args.node_inventory:
+        try:
+            inventory = NodeInventory.load(args.node_inventory)
+        except (OSError, ValueError, RuntimeError) as e:
+            manager.echo(f"{Colors.FAIL}Error: Cannot load node inventory: {e}{Colors.ENDC}")
+            return 1
+    
+    # Batch every selected source of a build directory into one task
+    unique: Dict[Path, BuildTask] = {}
+    for task in tasks:
+        if task.build.path in unique:
+            unique[task.build.path].add_sources(task.sources)
+        else:
+            unique[task.build.path] = task
+    tasks = list(unique.values())
+    
+    graph = BuildGraph(manager.builds)
+    if args.with_deps:
+        tasks = graph.expand(tasks)
+        for task in tasks:
+            for source, clone_id in graph.unresolved(task.build, task.sources):
+                manager.echo(f"{Colors.WARNING}Warning: {source} clones VM {clone_id}, which no build "
+                             f"produces; it must already exist{Colors.ENDC}")
+    
+    # One task per build and matrix variant; clones wait for the base of their variant
+    if args.variants:
+        tasks = [task.with_variant(*variant) for variant in args.variants for task in tasks]
+    try:
+        tasks = graph.link(tasks)
+    except ValueError as e:
+        manager.echo(f"{Colors.FAIL}Error: {e}{Colors.ENDC}")
+        return 1
+    
+    if args.graph:
+        graph.print_graph(tasks, manager.builds_dir, manager.echo)
+        return 0
+    
+    # Install plugins once per plugin set, before anything runs concurrently
+    if not args.dry_run or args.init_only:
+        return_code = manager.init_builds([t.build for t in tasks], force=args.force_init)
+        if return_code != 0 or args.init_only:
+            return return_code
+    
+    for task in tasks:
+        task.variables_file = task.variant_file or args.vars
+        task.extra_args = list(args.packer_args) + task.variant_args
+        task.run_build = not args.validate_only
+    
+    # Durations of past runs drive the ordering policies and ETAs
+    estimator = DurationEstimator()
+    try:
+        history = BuildHistory(manager.state_dir / "history.sqlite", manager.repo_root)
+        try:
+            history.refresh(manager.builds)
+            estimator = DurationEstimator(history, manager.repo_root)
+        finally:
+            history.close()
+    except (OSError, sqlite3.Error) as e:
+        manager.echo(f"{Colors.WARNING}Warning: build history unavailable, no ETAs: {e}{Colors.ENDC}")
+    
+    if run_state is None and not args.dry_run and not args.validate_only:
+        try:
+            run_state = RunState.create(manager.state_dir / "runs", args.vars, args.packer_args)
+        except OSError as e:
+            manager.echo(f"{Colors.WARNING}Warning: cannot record run state: {e}{Colors.ENDC}")
+    
+    executor = ParallelBuildExecutor(
+        manager,
+        max_workers=args.parallel or 1,
+        provider_limits=provider_limits,
+        dry_run=args.dry_run,
+        cache=BuildCache(manager.repo_root, graph),
+        force=args.force,
+        parallel_builds=args.parallel_builds,
+        leases=args.leases,
+        graph=graph,
+        inventory=inventory,
+        estimator=estimator,
+        order=args.order,
+        progress_interval=args.progress,
+        run_state=run_state,
+        retries=args.retries,
+        retry_backoff=args.retry_backoff,
+        retry_on=args.retry_on,
+        on_error=args.on_error
+    )
+    manager.echo(f"\n{Colors.BOLD}Running {len(tasks)} build(s) with "
+                 f"{executor.max_workers} worker(s){Colors.ENDC}")
+    return executor.run(tasks)
+
+
+def run_resume(manager: PackerBuildManager, args) -> int:
+    """Rerun the sources of a recorded run that failed or never started"""
+    try:
+        state = RunState.load(manager.state_dir / "runs", args.resume)
+    except RuntimeError as e:
+        manager.echo(f"{Colors.FAIL}Error: {e}{Colors.ENDC}")
+        return 1
+    
+    # Reuse the variables and packer arguments of the original run
+    if args.vars is None and state.data.get("variables_file"):
+        args.vars = Path(state.data["variables_file"])
+    if not args.packer_args:
+        args.packer_args = list(state.data.get("packer_args", []))
+    
+    by_key = {b.path.relative_to(manager.repo_root).as_posix(): b for b in manager.builds}
+    tasks = []
+    manager.echo(f"\n{Colors.BOLD}Resuming run {state.run_id}{Colors.ENDC}\n")
+    for key, sources in state.unfinished().items():
+        path, _, variant = key.partition("@")
+        build = by_key.get(path)
+        if build is None:
+            manager.echo(f"{Colors.WARNING}Warning: build directory {path} no longer exists{Colors.ENDC}")
+            continue
+        sources = [s for s in sources if s in build.sources]
+        if not sources:
+            continue
+        task = BuildTask(build, None if len(sources) == len(build.sources) else sources)
+        if variant:
+            spec = state.data.get("variants", {}).get(variant, {})
+            task = task.with_variant(
+                variant,
+                Path(spec["variables_file"]) if spec.get("variables_file") else None,
+                spec.get("var_args", [])
+            )
+        manager.echo(f"  {Colors.OKGREEN}{task.name}{Colors.ENDC}: {', '.join(sources)}")
+        tasks.append(task)
+    
+    if not tasks:
+        manager.echo(f"{Colors.OKGREEN}Every source of run {state.run_id} succeeded{Colors.ENDC}")
+        return 0
+    return run_parallel(manager, tasks, args, run_state=state)
+
+
+def run_affected(manager: PackerBuildManager, args) -> int:
+    """Build the sources affected by files changed since ``--affected-since``"""
+    graph = BuildGraph(manager.builds)
+    impact = ChangeImpact(manager.repo_root, manager.builds, graph)
+    try:
+        changed = impact.changed_files(args.affected_since)
+    except (OSError, RuntimeError) as e:
+        manager.echo(f"{Colors.FAIL}Error: Cannot diff against '{args.affected_since}': {e}{Colors.ENDC}")
+        return 1
+    affected = impact.affected(changed, args.vars)
+    
+    manager.echo(f"\n{Colors.BOLD}{len(changed)} file(s) changed since {args.affected_since}, "
+                 f"{sum(len(s) for s in affected.values())} source(s) affected{Colors.ENDC}\n")
+    tasks = []
+    for build in manager.builds:
+        if build not in affected:
+            continue
+        manager.echo(f"  {Colors.OKGREEN}{build.build_name}{Colors.ENDC}")
+        for source, reason in affected[build].items():
+            manager.echo(f"    {Colors.OKCYAN}{source}{Colors.ENDC}  {reason}")
+        sources = None if len(affected[build]) == len(build.sources) else list(affected[build])
+        tasks.append(BuildTask(build, sources))
+    
+    if not tasks:
+        manager.echo(f"{Colors.OKGREEN}Nothing to build{Colors.ENDC}")
+        return 0
+    return run_parallel(manager, tasks, args)
+
+
+def run_validate(manager: PackerBuildManager, builds: List[PackerBuild], args) -> int:
+    """Validate many build directories concurrently and report the results"""
+    if args.vars and not args.vars.exists():
+        manager.echo(f"{Colors.FAIL}Error: Variables file not found: {args.vars}{Colors.ENDC}")
+        return 1
+    
+    builds = list({build.path: build for build in builds}.values())
+    if not args.dry_run:
+        return_code = manager.init_builds(builds, force=args.force_init)
+        if return_code != 0:
+            return return_code
+    
+    tasks = [
+        BuildTask(build, variables_file=args.vars, extra_args=list(args.packer_args), run_build=False)
+        for build in builds
+    ]
+    # Validation is mostly waiting on plugin processes, so default to the
+    # same pool size as ThreadPoolExecutor rather than one worker
+    workers = args.parallel or min(len(tasks), 32, (os.cpu_count() or 1) + 4)
+    executor = ParallelBuildExecutor(manager, max_workers=workers, dry_run=args.dry_run)
+    manager.echo(f"\n{Colors.BOLD}Validating {len(tasks)} build(s) with "
+                 f"{executor.max_workers} worker(s){Colors.ENDC}")
+    
+    started = time.monotonic()
+    return_code = executor.run(tasks)
+    elapsed = time.monotonic() - started
+    manager.echo(f"Wall time {elapsed:.1f}s, "
+                 f"sum of validate times {sum(t.duration for t in tasks):.1f}s\n")
+    
+    if args.report:
+        write_validation_report(tasks, args.report, manager.builds_dir, elapsed)
+        manager.echo(f"{Colors.OKCYAN}Report written to {args.report}{Colors.ENDC}")
+    return return_code
+
+
+def write_validation_report(tasks: List[BuildTask], path: Path, builds_dir: Path, elapsed: float) -> None:
+    """Write validation results as JUnit XML (``.xml``) or JSON (anything else)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    failed = [t for t in tasks if t.status == "failed"]
+    errors = [t for t in tasks if t.status not in ("succeeded", "failed")]
+    
+    if path.suffix.lower() == ".xml":
+        suite = ET.Element("testsuite", {
+            "name": "packer-validate",
+            "tests": str(len(tasks)),
+            "failures": str(len(failed)),
+            "errors": str(len(errors)),
+            "time": f"{elapsed:.3f}",
+        })
+        for task in tasks:
+            rel_path = task.build.path.relative_to(builds_dir)
+            case = ET.SubElement(suite, "testcase", {
+                "classname": ".".join(rel_path.parts),
+                "name": task.build.build_name,
+                "time": f"{task.duration:.3f}",
+            })
+            if task.status == "failed":
+                failure = ET.SubElement(case, "failure", {"message": f"exit {task.returncode}"})
+                failure.text = "\n".join(task.output)
+            elif task.status != "succeeded":
+                ET.SubElement(case, "error", {"message": task.status})
+        ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+        return
+    
+    report = {
+        "generated": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "wall_time": round(elapsed, 3),
+        "total": len(tasks),
+        "failed": len(failed) + len(errors),
+        "builds": [
+            {
+                "name": task.build.build_name,
+                "path": task.build.path.relative_to(builds_dir).as_posix(),
+                "status": task.status,
+                "returncode": task.returncode,
+                "duration": round(task.duration, 3),
+                "output": list(task.output) if task.status != "succeeded" else [],
+            }
+            for task in tasks
+        ],
+    }
+    path.write_text(json.dumps(report, indent=2) + "\n")
+
+
+def build_history_parser(parser_class=argparse.ArgumentParser) -> argparse.ArgumentParser:
+    """Command line parser of the ``history`` subcommand"""
+    parser = parser_class(
+        prog=f"{Path(sys.argv[0]).name} history",
+        description="Query the index of every manifests/*.json build record"
+    )
+    parser.add_argument(
+        "query",
+        nargs="?",
+        choices=["latest", "runs", "trend", "commit"],
+        default="latest",
+        help="latest: newest artifact per source; runs: recent builds; "
+             "trend: durations over time; commit: builds of a git commit"
+    )
+    parser.add_argument(
+        "selector",
+        nargs="?",
+        help="Source/build name substring or glob (commit: hash or prefix)"
+    )
+    parser.add_argument("--limit", type=int, default=20, help="Maximum rows for runs/trend (default: 20)")
+    parser.add_argument("--format", choices=["text", "json"], default="text", help="Output format")
+    parser.add_argument("--rebuild", action="store_true", help="Drop the index and re-read every manifest")
+    parser.add_argument("--repo-root", type=Path, help="Repository root path (auto-detected if not specified)")
+    return parser
+
+
+def check_history_args(parser: argparse.ArgumentParser, args) -> None:
+    """Reject history queries that are missing their selector"""
+    if args.query == "commit" and not args.selector:
+        parser.error("commit needs a commit hash")
+
+
+def history_main(argv: List[str]) -> int:
+    """Entry point of the ``history`` subcommand"""
+    parser = build_history_parser()
+    args = parser.parse_args(argv)
+    check_history_args(parser, args)
+    try:
         manager = PackerBuildManager(args.repo_root)
     except RuntimeError as e:
         print(f"{Colors.FAIL}Error: {e}{Colors.ENDC}")
         return 1
+    try:
+        return run_history(manager, args)
+    finally:
+        manager.save_index()
+
+
+def run_history(manager: PackerBuildManager, args) -> int:
+    """Query the manifest index of a discovered repository"""
+    path = manager.state_dir / "history.sqlite"
+    if args.rebuild and path.exists():
+        path.unlink()
+    history = BuildHistory(path, manager.repo_root)
+    try:
+        started = time.perf_counter()
+        read, dropped = history.refresh(manager.builds)
+        refreshed = time.perf_counter()
+        
+        pattern = "%"
+        if args.selector and args.query != "commit":
+            pattern = args.selector.replace("*", "%").replace("?", "_")
+            if "%" not in pattern:
+                pattern = f"%{pattern}%"
+        if args.query == "latest":
+            rows = history.latest(pattern)
+        elif args.query == "runs":
+            rows = history.runs(pattern, args.limit)
+        elif args.query == "trend":
+            rows = history.trend(pattern, args.limit)
+        else:
+            rows = history.commit(args.selector)
+        queried = time.perf_counter()
+    finally:
+        history.close()
+    
+    if args.format == "json":
+        manager.echo(json.dumps([dict(row) for row in rows], indent=2))
+        return 0
+    
+    if not rows:
+        manager.echo(f"{Colors.WARNING}No matching builds{Colors.ENDC}")
+    else:
+        width = max(len(row["source"]) for row in rows)
+        manager.echo(f"\n{Colors.BOLD}{'started (UTC)':<17}  {'source':<{width}}  {'artifact':>8}  "
+                     f"{'version':<10}  {'duration':>9}{Colors.ENDC}")
+        for row in rows:
+            when = time.strftime("%Y-%m-%d %H:%M", time.gmtime(row["started"])) if row["started"] else "-"
+            duration = format_duration(row["duration"]) if row["duration"] is not None else "-"
+            if row["duration_source"] == "mtime":
+                duration += "~"
+            manager.echo(f"{when:<17}  {Colors.OKGREEN}{row['source']:<{width}}{Colors.ENDC}  "
+                         f"{row['artifact_id'] or '-':>8}  {(row['build_version'] or '-')[:10]:<10}  {duration:>9}")
+    manager.echo(f"\n{Colors.OKCYAN}{len(rows)} row(s); indexed {read} new/changed manifest(s), "
+                 f"dropped {dropped} in {(refreshed - started) * 1000:.1f} ms; "
+                 f"query {(queried - refreshed) * 1000:.1f} ms{Colors.ENDC}")
+    return 0
+
+
+def build_parser(parser_class=argparse.ArgumentParser) -> argparse.ArgumentParser:
+    """Command-line parser of builds, shared by the CLI and the ``serve`` daemon"""
+    parser = parser_class(
+        description="Packer Build Manager - Manage and execute Packer builds",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    
+    parser.add_argument(
+        "--list", "-l",
+        action="store_true",
+        help="List all available builds"
+    )
+    
+    parser.add_argument(
+        "--format",
+        choices=["text", "json"],
+        default="text",
+        help="Output format for --list (default: text)"
+    )
+    
+    parser.add_argument(
+        "--os",
+        action="append",
+        help="Build specific OS (e.g., 'debian-12', 'windows-server-2019'); repeatable"
+    )
+    
+    parser.add_argument(
+        "--source", "-s",
+        action="append",
+        help="Build specific source (e.g., 'proxmox-iso.debian_12_base'); repeatable"
+    )
+    
+    parser.add_argument(
+        "--vars", "-v",
+        type=Path,
+        help="Path to custom variables.auto.pkrvars.hcl file"
+    )
+    
+    parser.add_argument(
+        "--validate-only",
+        action="store_true",
+        help="Only validate, don't build"
+    )
+    
+    parser.add_argument(
+        "--validate-all",
+        action="store_true",
+        help="Validate every discovered build concurrently"
+    )
+    
+    parser.add_argument(
+        "--validate",
+        action="append",
+        metavar="SELECTOR",
+        help="Validate builds whose name, path or source matches SELECTOR "
+             "(substring or glob); repeatable"
+    )
+    
+    parser.add_argument(
+        "--report",
+        type=Path,
+        metavar="PATH",
+        help="Write a validation report (JUnit XML for .xml, JSON otherwise)"
+    )
+    
+    parser.add_argument(
+        "--init-only",
+        action="store_true",
+        help="Only initialize (packer init)"
+    )
+    
+    parser.add_argument(
+        "--force-init",
+        action="store_true",
+        help="Force re-initialization (packer init -upgrade)"
+    )
+    
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Show commands without executing"
+    )
+    
+    parser.add_argument(
+        "--parallel", "-j",
+        type=int,
+        metavar="N",
+        help="Run the selected builds on a pool of N workers"
+    )
+    
+    parser.add_argument(
+        "--parallel-builds",
+        type=int,
+        metavar="N",
+        help="Limit packer -parallel-builds when several sources of one build "
+             "directory run in a single packer process (default: all at once)"
+    )
+    
+    parser.add_argument(
+        "--provider-limit",
+        action="append",
+        metavar="PROVIDER=N",
+        help="Cap concurrent builds per provider (e.g., 'proxmox=2'); repeatable"
+    )
+    
+    parser.add_argument(
+        "--order",
+        choices=sorted(ORDER_POLICIES),
+        default="fifo",
+        help="Order of runnable builds, using durations of past runs: longest "
+             "(shortest makespan), shortest (fast feedback), critical-path "
+             "(longest dependency chain first) or fifo (default)"
+    )
+    
+    parser.add_argument(
+        "--progress",
+        type=float,
+        metavar="SECONDS",
+        default=0,
+        help="Print elapsed time and ETA of running builds this often (default: 0, off)"
+    )
+    
+    parser.add_argument(
+        "--node-inventory",
+        type=Path,
+        metavar="FILE",
+        default=os.environ.get("BUILDMANAGER_NODE_INVENTORY"),
+        help="TOML/YAML file with the cores and memory of each Proxmox node; "
+             "builds wait until their cores/memory fit (default: $BUILDMANAGER_NODE_INVENTORY)"
+    )
+    
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rebuild even if the inputs match a previous successful build"
+    )
+    
+    parser.add_argument(
+        "--with-deps",
+        action="store_true",
+        help="Also build the base templates the selected builds clone from"
+    )
+    
+    parser.add_argument(
+        "--affected-since",
+        metavar="REF",
+        help="Build only the sources fed by files changed since a git ref "
+             "(e.g. origin/main), and the templates cloned from them"
+    )
+    
+    parser.add_argument(
+        "--matrix-vars",
+        action="append",
+        type=Path,
+        metavar="FILE",
+        help="Build every selected build once per variables file, concurrently; repeatable"
+    )
+    
+    parser.add_argument(
+        "--matrix-var",
+        action="append",
+        metavar="NAME=V1[,V2...]",
+        help="Build once per value of a variable, e.g. 'node=pve1,pve2,pve3'; "
+             "combined with --matrix-vars and other --matrix-var options as a product"
+    )
+    
+    parser.add_argument(
+        "--timeout",
+        action="append",
+        metavar="[BUILD=]DURATION",
+        help="Stop a packer build running longer than this (e.g. 3h, or "
+             "'windows_server*=4h' for matching builds; 0 disables); repeatable"
+    )
+    
+    parser.add_argument(
+        "--idle-timeout",
+        action="append",
+        metavar="[BUILD|STEP=]DURATION",
+        help="Stop a packer build that printed nothing for this long; STEP is a "
+             "step-timing category such as communicator or provision; repeatable"
+    )
+    
+    parser.add_argument(
+        "--resume",
+        metavar="RUN_ID",
+        help="Rerun only the failed or unstarted sources of a recorded run ('last' for the latest)"
+    )
+    
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Retry sources that failed with a transient error (timeouts, WinRM/API "
+             "connection failures) up to N times (default: 0)"
+    )
+    
+    parser.add_argument(
+        "--retry-backoff",
+        type=float,
+        default=60,
+        metavar="SECONDS",
+        help="Delay before the first retry, doubled for each further one (default: 60)"
+    )
+    
+    parser.add_argument(
+        "--retry-on",
+        action="append",
+        metavar="REGEX",
+        help="Additional output pattern that marks a failure as transient; repeatable"
+    )
+    
+    parser.add_argument(
+        "--on-error",
+        choices=["cleanup", "abort", "run-cleanup-provisioner"],
+        help="Packer -on-error policy for builds (abort keeps a failed VM for debugging)"
+    )
+    
+    parser.add_argument(
+        "--graph",
+        action="store_true",
+        help="Print the inferred build dependency graph and exit"
+    )
+    
+    parser.add_argument(
+        "--metrics-textfile",
+        type=Path,
+        metavar="PATH",
+        help="Export per-step build timings to a Prometheus textfile (e.g. "
+             "/var/lib/node_exporter/textfile/packer.prom)"
+    )
+    
+    parser.add_argument(
+        "--log-compression",
+        choices=["gzip", "zstd", "none"],
+        default="gzip",
+        help="Compression of the per-build logs in .buildmanager/logs (default: gzip; "
+             "zstd needs the zstandard package)"
+    )
+    
+    parser.add_argument(
+        "--log-keep",
+        type=int,
+        default=20,
+        metavar="N",
+        help="Number of log files kept per build (default: 20)"
+    )
+    
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Also show PACKER_LOG debug lines on the console (they are always logged)"
+    )
+    
+    parser.add_argument(
+        "--vm-id-pool",
+        metavar="FIRST-LAST",
+        default=os.environ.get("BUILDMANAGER_VM_ID_POOL"),
+        help="Turn on VM ID leases and lease IDs from this range for sources whose "
+             "vm_id is a variable (e.g. 9100-9199; default: $BUILDMANAGER_VM_ID_POOL)"
+    )
+    
+    parser.add_argument(
+        "--vm-inventory",
+        metavar="URL|FILE",
+        help="Skip pool IDs that already exist: a Proxmox API URL (token in "
+             "$PROXMOX_TOKEN, $PROXMOX_INSECURE_TLS=1 for a self-signed certificate) "
+             "or a JSON file listing IDs"
+    )
+    
+    parser.add_argument(
+        "--vm-lease-ttl",
+        type=int,
+        default=4 * 3600,
+        metavar="SECONDS",
+        help="Expiry of VM ID leases not renewed by a live build (default: 14400)"
+    )
+    
+    parser.add_argument(
+        "--lease-dir",
+        type=Path,
+        help="Host-wide VM ID lease directory (default: $BUILDMANAGER_LEASE_DIR "
+             "or <tmp>/packer-vm-id-leases)"
+    )
+    
+    parser.add_argument(
+        "--vm-leases",
+        action="store_true",
+        help="Lease literal Proxmox VM IDs even without --vm-id-pool, so runs of the "
+             "same template wait for each other"
+    )
+    
+    parser.add_argument(
+        "--no-vm-leases",
+        action="store_true",
+        help="Do not lease Proxmox VM IDs, even with --vm-id-pool or $BUILDMANAGER_VM_ID_POOL"
+    )
+    
+    parser.add_argument(
+        "--repo-root",
+        type=Path,
+        help="Repository root path (auto-detected if not specified)"
+    )
+    
+    parser.add_argument(
+        "--refresh-index",
+        action="store_true",
+        help="Ignore the cached discovery index and rescan the builds tree"
+    )
+    
+    parser.add_argument(
+        "--server",
+        default=os.environ.get("BUILDMANAGER_SERVER"),
+        metavar="ADDRESS",
+        help="Submit this command line as a job to a 'serve' daemon (unix:PATH or "
+             "http://127.0.0.1:PORT) and follow its output (env: BUILDMANAGER_SERVER)"
+    )
+    
+    parser.add_argument(
+        "packer_args",
+        nargs="*",
+        help="Additional arguments to pass to packer"
+    )
+    
+    return parser
+
+
+def check_args(parser: argparse.ArgumentParser, args) -> None:
+    """Reject option combinations that cannot work and derive matrix variants"""
+    if (args.affected_since or args.resume) and (args.os or args.source):
+        parser.error("--affected-since/--resume select the builds themselves; drop --os/--source")
+    if args.affected_since and args.resume:
+        parser.error("--affected-since and --resume cannot be combined")
+    if args.retries and args.on_error == "abort":
+        parser.error("--retries needs packer to clean up failed VMs; drop --on-error abort")
+    try:
+        args.variants = matrix_variants(args.matrix_vars, args.matrix_var)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.matrix_vars and args.vars:
+        parser.error("--vars cannot be combined with --matrix-vars")
+    if args.variants and args.resume:
+        parser.error("--resume reruns the variants of the recorded run; drop the matrix options")
+
+
+def configure_run(manager: PackerBuildManager, args) -> int:
+    """Apply per-run settings to the manager and set up VM ID leases
+    
+    Leasing is opt-in: it needs a VM ID pool or ``--vm-leases``, and
+    ``--no-vm-leases`` turns it off again (e.g. over a pool from the
+    environment).
+    """
+    manager.metrics_textfile = args.metrics_textfile
+    try:
+        manager.timeouts = parse_timeouts(args.timeout)
+        manager.idle_timeouts = parse_timeouts(args.idle_timeout)
+    except ValueError as e:
+        manager.echo(f"{Colors.FAIL}Error: {e}{Colors.ENDC}")
+        return 1
+    
+    args.leases = None
+    if (args.vm_id_pool or args.vm_leases) and not args.no_vm_leases:
+        try:
+            pool = VmIdAllocator.parse_pool(args.vm_id_pool) if args.vm_id_pool else None
+        except ValueError as e:
+            manager.echo(f"{Colors.FAIL}Error: {e}{Colors.ENDC}")
+            return 1
+        lease_dir = args.lease_dir or Path(
+            os.environ.get("BUILDMANAGER_LEASE_DIR")
+            or Path(tempfile.gettempdir()) / "packer-vm-id-leases"
+        )
+        args.leases = VmIdAllocator(
+            lease_dir, pool, args.vm_lease_ttl,
+            VmInventory(args.vm_inventory) if args.vm_inventory else None
+        )
+    return 0
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+    
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DaemonClient:
+    """Client of a ``serve`` daemon's job API
+    
+    Addresses are ``unix:/path/to/serve.sock`` (or a plain socket path) and
+    ``http://127.0.0.1:PORT`` (or ``HOST:PORT``).
+    """
+    
+    # Job states in which a job's output is complete
+    FINAL = ("succeeded", "failed", "cancelled", "interrupted")
+    
+    def __init__(self, address: str):
+        self.address = address
+    
+    @staticmethod
+    def default_address(repo_root: Optional[Path] = None) -> str:
+        if os.environ.get("BUILDMANAGER_SERVER"):
+            return os.environ["BUILDMANAGER_SERVER"]
+        root = repo_root or PackerBuildManager._find_repo_root()
+        return f"unix:{root / '.buildmanager' / 'serve.sock'}"
+    
+    def _connection(self, timeout: float) -> http.client.HTTPConnection:
+        address = self.address
+        if address.startswith("unix:"):
+            return _UnixHTTPConnection(address[len("unix:"):], timeout)
+        if "://" in address:
+            url = urllib.parse.urlsplit(address)
+            return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+        if re.fullmatch(r"[\w.-]+:\d+", address):
+            host, _, port = address.rpartition(":")
+            return http.client.HTTPConnection(host, int(port), timeout=timeout)
+        return _UnixHTTPConnection(address, timeout)
+    
+    def request(self, method: str, path: str, body: Optional[Dict] = None, timeout: float = 30) -> Dict:
+        """Send one API request and return its JSON reply
+        
+        Raises RuntimeError when the daemon is unreachable or rejects the request.
+        """
+        connection = self._connection(timeout)
+        try:
+            data = json.dumps(body).encode() if body is not None else None
+            headers = {"Content-Type": "application/json"} if data is not None else {}
+            connection.request(method, path, body=data, headers=headers)
+            response = connection.getresponse()
+            reply = json.loads(response.read() or b"{}")
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            raise RuntimeError(f"Cannot reach build manager daemon at {self.address}: {e}")
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise RuntimeError(reply.get("error", f"HTTP {response.status}"))
+        return reply
+    
+    def follow(self, job_id: str, offset: int = 0) -> int:
+        """Print a job's output until it finishes and return its exit code
+        
+        Ctrl-C cancels the job and keeps following while its builds clean
+        up; a second Ctrl-C stops following and leaves the job to the daemon.
+        """
+        cancelled = False
+        while True:
+            try:
+                reply = self.request("GET", f"/jobs/{job_id}/log?offset={offset}&wait=30", timeout=60)
+            except KeyboardInterrupt:
+                if cancelled:
+                    return 130
+                cancelled = True
+                print(f"\n{Colors.WARNING}Cancelling job {job_id}... "
+                      f"(press Ctrl-C again to stop following){Colors.ENDC}", flush=True)
+                self.request("POST", f"/jobs/{job_id}/cancel")
+                continue
+            for line in reply["lines"]:
+                print(line, flush=True)
+            offset = reply["offset"]
+            if reply["status"] in self.FINAL and not reply["lines"]:
+                return reply["returncode"] if reply["returncode"] is not None else 1
+
+
+def run_remote(address: str, argv: List[str]) -> int:
+    """Run a command line as a job of a ``serve`` daemon and follow it"""
+    client = DaemonClient(address)
+    try:
+        job = client.request("POST", "/jobs", {"argv": argv, "cwd": os.getcwd()})
+        # stderr, so that e.g. ``--list --format json`` output stays parseable
+        print(f"{Colors.OKCYAN}Submitted job {job['id']} to {address}{Colors.ENDC}", file=sys.stderr, flush=True)
+        return client.follow(job["id"])
+    except RuntimeError as e:
+        print(f"{Colors.FAIL}Error: {e}{Colors.ENDC}")
+        return 1
+
+
+def jobs_main(argv: List[str]) -> int:
+    """Entry point of the ``jobs`` subcommand"""
+    parser = argparse.ArgumentParser(
+        prog=f"{Path(sys.argv[0]).name} jobs",
+        description="List, follow and cancel the jobs of a build manager daemon"
+    )
+    parser.add_argument(
+        "action",
+        nargs="?",
+        choices=["list", "show", "tail", "cancel", "status"],
+        default="list",
+        help="list: all jobs; show: one job; tail: print (and follow) its output; "
+             "cancel: stop it; status: daemon slots and queue"
+    )
+    parser.add_argument("job", nargs="?", default="last", help="Job ID or 'last' (default: last)")
+    parser.add_argument("--follow", "-f", action="store_true", help="tail: keep printing until the job finishes")
+    parser.add_argument("--format", choices=["text", "json"], default="text", help="Output format")
+    parser.add_argument("--server", help="Daemon address (default: $BUILDMANAGER_SERVER or the repo's serve.sock)")
+    parser.add_argument("--repo-root", type=Path, help="Repository root path (auto-detected if not specified)")
+    args = parser.parse_args(argv)
+    
+    try:
+        client = DaemonClient(args.server or DaemonClient.default_address(args.repo_root))
+        if args.action == "tail":
+            if args.follow:
+                return client.follow(args.job)
+            reply = client.request("GET", f"/jobs/{args.job}/log")
+            for line in reply["lines"]:
+                print(line)
+            return 0
+        if args.action == "list":
+            reply = client.request("GET", "/jobs")
+        elif args.action == "status":
+            reply = client.request("GET", "/status")
+        elif args.action == "cancel":
+            reply = client.request("POST", f"/jobs/{args.job}/cancel")
+        else:
+            reply = client.request("GET", f"/jobs/{args.job}")
+    except RuntimeError as e:
+        print(f"{Colors.FAIL}Error: {e}{Colors.ENDC}")
+        return 1
+    
+    if args.format == "json" or args.action == "status":
+        print(json.dumps(reply, indent=2))
+        return 0
+    jobs = reply["jobs"] if args.action == "list" else [reply]
+    if not jobs:
+        print(f"{Colors.WARNING}No jobs{Colors.ENDC}")
+        return 0
+    print(f"\n{Colors.BOLD}{'job':<22}  {'status':<11}  {'created (UTC)':<16}  {'duration':>9}  command{Colors.ENDC}")
+    for job in jobs:
+        created = time.strftime("%Y-%m-%d %H:%M", time.gmtime(job["created"]))
+        duration = "-"
+        if job["started"]:
+            duration = format_duration((job["finished"] or time.time()) - job["started"])
+        color = {"succeeded": Colors.OKGREEN, "running": Colors.OKCYAN, "queued": Colors.OKBLUE}.get(
+            job["status"], Colors.FAIL
+        )
+        print(f"{job['id']:<22}  {color}{job['status']:<11}{Colors.ENDC}  {created:<16}  "
+              f"{duration:>9}  {' '.join(job['argv'])}")
+    print()
+    return 0
+
+
+def exec_daemon(argv: List[str]) -> int:
+    """Entry point of the ``serve`` subcommand: build_daemon.py next to this file
+    
+    The daemon imports this module, so it runs as a program of its own
+    rather than being imported from here.
+    """
+    daemon = Path(__file__).resolve().with_name("build_daemon.py")
+    os.execv(sys.executable, [sys.executable, str(daemon), *argv])
+    return 1
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "history":
+        return history_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        return exec_daemon(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "jobs":
+        return jobs_main(sys.argv[2:])
+    
+    parser = build_parser()
+    args = parser.parse_args()
+    check_args(parser, args)
+    
+    # Thin client: the daemon parses and runs the same command line
+    if args.server:
+        argv = []
+        skip = False
+        for arg in sys.argv[1:]:
+            if skip:
+                skip = False
+            elif arg == "--server":
+                skip = True
+            elif not arg.startswith("--server="):
+                argv.append(arg)
+        return run_remote(args.server, argv)
+    
+    try:
+        manager = PackerBuildManager(args.repo_root, refresh_index=args.refresh_index)
+    except RuntimeError as e:
+        print(f"{Colors.FAIL}Error: {e}{Colors.ENDC}")
+        return 1
     
+    if args.log_compression == "zstd" and zstandard is None:
+        print(f"{Colors.WARNING}Warning: zstandard is not installed, "
+              f"falling back to gzip logs{Colors.ENDC}")
+        args.log_compression = "gzip"
+    manager.runner.compression = args.log_compression
+    manager.runner.keep = args.log_keep
+    manager.runner.verbose = args.verbose
+    return_code = configure_run(manager, args)
+    if return_code != 0:
+        return return_code
+    
+    try:
+        return run_cli(manager, args)
+    finally:
+        manager.save_index()
+
+
+def run_cli(manager: PackerBuildManager, args) -> int:
+    """Dispatch the parsed command line against a discovered repository"""
     # List builds
     if args.list:
-        manager.list_builds()
+        if args.format == "json":
+            manager.list_builds_json()
+        else:
+            manager.list_builds()
         return 0
     
+    # Rerun what a recorded run left unfinished
+    if args.resume:
+        return run_resume(manager, args)
+    
+    # Build only what changed files feed
+    if args.affected_since:
+        return run_affected(manager, args)
+    
+    # Show the dependency graph of the whole repository
+    if args.graph and not any([args.os, args.source]):
+        graph = BuildGraph(manager.builds)
+        tasks = graph.link([BuildTask(build) for build in manager.builds])
+        graph.print_graph(tasks, manager.builds_dir, manager.echo)
+        return 0
+    
+    # Validate many builds concurrently
+    if args.validate_all or args.validate:
+        builds = list(manager.builds) if args.validate_all else []
+        for selector in args.validate or []:
+            matched = manager.find_builds(selector)
+            if not matched:
+                manager.echo(f"{Colors.FAIL}Error: No builds match '{selector}'{Colors.ENDC}")
+                manager.echo(f"\nRun '{sys.argv[0]} --list' to see available builds")
+                return 1
+            builds.extend(matched)
+        return run_validate(manager, builds, args)
+    
     # Interactive mode if no arguments
     if not any([args.os, args.source]):
         manager.interactive_mode()
         return 0
     
-    # Find build by source
-    if args.source:
-        result = manager.find_build_by_source(args.source)
+    # Resolve every selector to a build task
+    tasks = []
+    for pattern in args.source or []:
+        result = manager.find_build_by_source(pattern)
         if not result:
-            print(f"{Colors.FAIL}Error: Source '{args.source}' not found{Colors.ENDC}")
-            print(f"\nRun '{sys.argv[0]} --list' to see available sources")
+            manager.echo(f"{Colors.FAIL}Error: Source '{pattern}' not found{Colors.ENDC}")
+            manager.echo(f"\nRun '{sys.argv[0]} --list' to see available sources")
             return 1
         
         build, source = result
-        print(f"{Colors.OKGREEN}Found source in: {build.build_name}{Colors.ENDC}")
+        manager.echo(f"{Colors.OKGREEN}Found source in: {build.build_name}{Colors.ENDC}")
+        tasks.append(BuildTask(build, [source]))
     
-    # Find build by OS pattern
-    elif args.os:
-        build = manager.find_build_by_pattern(args.os)
+    for pattern in args.os or []:
+        build = manager.find_build_by_pattern(pattern)
         if not build:
-            print(f"{Colors.FAIL}Error: Build matching '{args.os}' not found{Colors.ENDC}")
-            print(f"\nRun '{sys.argv[0]} --list' to see available builds")
+            manager.echo(f"{Colors.FAIL}Error: Build matching '{pattern}' not found{Colors.ENDC}")
+            manager.echo(f"\nRun '{sys.argv[0]} --list' to see available builds")
             return 1
         
-        source = None
-        print(f"{Colors.OKGREEN}Found build: {build.build_name}{Colors.ENDC}")
-    else:
-        print(f"{Colors.FAIL}Error: Must specify --os or --source{Colors.ENDC}")
-        return 1
+        manager.echo(f"{Colors.OKGREEN}Found build: {build.build_name}{Colors.ENDC}")
+        tasks.append(BuildTask(build))
+    
+    # Retries, matrix variants, node admission and daemon jobs (whose
+    # builds take the daemon's shared worker slots) need the executor; a
+    # single build runs packer directly
+    if (len(tasks) > 1 or args.parallel or args.with_deps or args.graph or args.retries
+            or args.variants or args.node_inventory or manager.slots):
+        return run_parallel(manager, tasks, args)
+    
+    task = tasks[0]
+    build, source = task.build, task.only
     
     # Execute commands
     return_code = 0
     
-    # Initialize if requested or forced
-    if args.init_only or args.force_init:
-        return_code = manager.init_build(build, force=args.force_init)
-        if args.init_only:
+    # Install plugins into the shared cache (skipped when unchanged)
+    if not args.dry_run or args.init_only:
+        return_code = manager.init_builds([build], force=args.force_init)
+        if return_code != 0 or args.init_only:
             return return_code
     
+    # Skip sources whose inputs did not change since their last build
+    cache = BuildCache(manager.repo_root, BuildGraph(manager.builds))
+    fingerprints, cached = {}, {}
+    if not args.validate_only and not args.init_only and task.selected_sources:
+        fingerprints, cached = cache.partition(
+            build, task.selected_sources, args.vars, args.packer_args
+        )
+        if args.force:
+            cached = {}
+        for name, manifest in cached.items():
+            manager.echo(f"{Colors.OKGREEN}✓ {name} up to date ({manifest}), skipping "
+                         f"(use --force to rebuild){Colors.ENDC}")
+        if cached and len(cached) == len(fingerprints):
+            return 0
+        if cached:
+            fingerprints = {s: fp for s, fp in fingerprints.items() if s not in cached}
+            source = ",".join(fingerprints)
+    
     # Validate
     if args.validate_only or not args.init_only:
         return_code = manager.run_packer_command(
@@ -483,9 +4796,53 @@ def main():
     
     # Build
     if not args.validate_only and not args.init_only:
-        return_code = manager.run_packer_command(
-            build, "build", source, args.vars, args.packer_args, args.dry_run
-        )
+        leases, overrides = [], []
+        if args.leases and build.cloud_provider == "proxmox" and not args.dry_run:
+            try:
+                leases, overrides, _ = args.leases.lease_build(
+                    build, source.split(",") if source else build.sources, build.build_name,
+                    log=lambda message: manager.echo(f"{Colors.WARNING}{message}{Colors.ENDC}", flush=True)
+                )
+            except KeyboardInterrupt:
+                return 130
+            if leases:
+                ids = ", ".join(str(lease["vm_id"]) for lease in leases)
+                manager.echo(f"{Colors.OKCYAN}Leased VM ID(s) {ids}{Colors.ENDC}")
+        
+        # A run of several sources records their outcomes, so --resume can
+        # rebuild only the ones that failed
+        run_state = None
+        if len(task.selected_sources) > 1 and not args.dry_run:
+            try:
+                run_state = RunState.create(manager.state_dir / "runs", args.vars, args.packer_args)
+            except OSError as e:
+                manager.echo(f"{Colors.WARNING}Warning: cannot record run state: {e}{Colors.ENDC}")
+        
+        started = time.time()
+        try:
+            return_code = manager.run_packer_command(
+                build, "build", source, args.vars, list(args.packer_args) + overrides, args.dry_run,
+                source_status=task.source_status, on_error=args.on_error
+            )
+        finally:
+            for lease in leases:
+                args.leases.release(lease)
+        # Only sources that wrote a manifest are recorded, so a partial
+        # failure still remembers the sources that finished
+        if not args.dry_run:
+            cache.record(build, fingerprints, started)
+        
+        if run_state:
+            task.source_status.update({name: "cached" for name in cached})
+            task.status = "succeeded" if return_code == 0 else "failed"
+            try:
+                run_state.update(task, manager.repo_root)
+            except OSError as e:
+                manager.echo(f"{Colors.WARNING}Warning: cannot record run state: {e}{Colors.ENDC}")
+            else:
+                if return_code != 0:
+                    manager.echo(f"{Colors.BOLD}Run state:{Colors.ENDC} {run_state.path} "
+                                 f"(rerun failed sources with --resume {run_state.run_id})\n")
     
     return return_code
 
@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+"""
+Build daemon of the Packer Build Manager
+
+``buildManager.py serve`` runs this file as a program of its own. It keeps
+one build manager with a warm discovery index in memory and runs submitted
+command lines as queued jobs, over a JSON API on a Unix socket (or a
+loopback TCP port). The clients, ``buildManager.py jobs`` and
+``buildManager.py --server ADDRESS ...``, live in buildManager.py, which
+never imports this module.
+
+Every job runs on a build manager of its own that writes to the job's
+output and shares only the daemon's discovery index, plugin cache, output
+loop and worker slots.
+"""
+
+import argparse
+import http.server
+import json
+import os
+import queue
+import re
+import socket
+import socketserver
+import sys
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from buildManager import (
+    Colors,
+    DaemonClient,
+    PackerBuildManager,
+    build_history_parser,
+    build_parser,
+    check_args,
+    check_history_args,
+    configure_run,
+    parse_provider_limits,
+    run_cli,
+    run_history,
+    zstandard,
+)
+
+
+class _JobParser(argparse.ArgumentParser):
+    """Parser for job command lines that reports errors instead of exiting"""
+    
+    def error(self, message: str):
+        raise ValueError(message)
+    
+    def print_help(self, file=None):
+        raise ValueError(self.format_help())
+
+
+class WorkerSlots:
+    """Worker slots shared by every job of a ``serve`` daemon
+    
+    Each running build holds one slot, so concurrent jobs together stay
+    within the daemon's ``--slots`` and ``--provider-limit`` caps.
+    """
+    
+    def __init__(self, workers: int, provider_limits: Optional[Dict[str, int]] = None):
+        self.workers = max(1, workers)
+        self.provider_limits = provider_limits or {}
+        self.active: Dict[str, int] = {}
+        self._changed = threading.Condition()
+    
+    def try_acquire(self, provider: str) -> bool:
+        with self._changed:
+            if sum(self.active.values()) >= self.workers:
+                return False
+            limit = self.provider_limits.get(provider)
+            if limit is not None and self.active.get(provider, 0) >= limit:
+                return False
+            self.active[provider] = self.active.get(provider, 0) + 1
+            return True
+    
+    def release(self, provider: str) -> None:
+        with self._changed:
+            self.active[provider] -= 1
+            self._changed.notify_all()
+    
+    def wait(self, timeout: float) -> None:
+        """Wait until a slot is released or the timeout passes"""
+        with self._changed:
+            self._changed.wait(timeout)
+
+
+class BuildJob:
+    """A command line queued on a ``serve`` daemon, with its captured output
+    
+    The job is the output stream of the build manager that runs it.
+    """
+    
+    FINAL = DaemonClient.FINAL
+    # Lines kept in memory; older ones are dropped but keep their offsets
+    MAX_LINES = 100000
+    
+    def __init__(self, job_id: str, argv: List[str], cwd: str, log_path: Path):
+        self.id = job_id
+        self.argv = argv
+        self.cwd = cwd
+        self.log_path = log_path
+        self.status = "queued"
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.returncode: Optional[int] = None
+        self.lines: Optional[List[str]] = []
+        self.dropped = 0
+        self.args = None
+        self.stop = threading.Event()
+        self._partial = ""
+        self._changed = threading.Condition()
+    
+    @property
+    def done(self) -> bool:
+        return self.status in self.FINAL
+    
+    def write(self, text: str) -> None:
+        with self._changed:
+            *lines, self._partial = (self._partial + text).split("\n")
+            if lines:
+                self.lines.extend(lines)
+                excess = len(self.lines) - self.MAX_LINES
+                if excess > 0:
+                    del self.lines[:excess]
+                    self.dropped += excess
+                self._changed.notify_all()
+    
+    def flush(self) -> None:
+        pass
+    
+    def isatty(self) -> bool:
+        return False
+    
+    def set_status(self, status: str, returncode: Optional[int] = None) -> None:
+        with self._changed:
+            if status == "running":
+                self.started = time.time()
+            if status in self.FINAL:
+                self.finished = time.time()
+                self.returncode = returncode
+                if self._partial:
+                    self.lines.append(self._partial)
+                    self._partial = ""
+            self.status = status
+            self._changed.notify_all()
+    
+    def tail(self, offset: int, wait: float = 0) -> Tuple[List[str], int]:
+        """Lines from ``offset`` on, waiting up to ``wait`` seconds for new ones
+        
+        Returns the lines and the offset to ask for next.
+        """
+        with self._changed:
+            if self.lines is None:
+                try:
+                    self.lines = self.log_path.read_text(errors="replace").splitlines()
+                except OSError:
+                    self.lines = []
+            if wait > 0:
+                self._changed.wait_for(
+                    lambda: self.done or self.dropped + len(self.lines) > offset, wait
+                )
+            start = max(offset - self.dropped, 0)
+            return self.lines[start:], self.dropped + len(self.lines)
+    
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "argv": self.argv,
+            "cwd": self.cwd,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "returncode": self.returncode,
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict, log_dir: Path) -> "BuildJob":
+        job = cls(data["id"], data["argv"], data["cwd"], log_dir / f"{data['id']}.log")
+        for key in ("status", "created", "started", "finished", "returncode"):
+            setattr(job, key, data.get(key))
+        job.lines = None
+        if not job.done:
+            # The daemon stopped while the job was queued or running
+            job.status = "interrupted"
+            job.finished = job.finished or time.time()
+        return job
+
+
+class BuildDaemon:
+    """Job queue of ``buildManager.py serve`` around one warm build manager
+    
+    Jobs are build manager command lines. Each runs on a manager of its own
+    whose output is the job, created against the discovery index and plugin
+    cache the daemon keeps in memory, and draws its builds' worker slots
+    from the shared ``WorkerSlots``. Job records are kept in
+    ``.buildmanager/jobs.json`` and their output in
+    ``.buildmanager/jobs/<job-id>.log``.
+    """
+    
+    KEEP = 100
+    
+    def __init__(self, manager: PackerBuildManager, slots: WorkerSlots, max_jobs: int):
+        self.manager = manager
+        self.slots = slots
+        self.path = manager.state_dir / "jobs.json"
+        self.log_dir = manager.state_dir / "jobs"
+        self.jobs: Dict[str, BuildJob] = {}
+        self._queue: "queue.Queue[BuildJob]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._running = 0
+        self.load()
+        self.workers = [
+            threading.Thread(target=self._worker, name=f"job-{i}", daemon=True)
+            for i in range(max(1, max_jobs))
+        ]
+        for worker in self.workers:
+            worker.start()
+    
+    def load(self) -> None:
+        try:
+            data = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            print(f"{Colors.WARNING}Warning: ignoring corrupt job list {self.path}: {e}{Colors.ENDC}")
+            return
+        for record in data.get("jobs", []):
+            job = BuildJob.from_dict(record, self.log_dir)
+            self.jobs[job.id] = job
+        self.save()
+    
+    def save(self) -> None:
+        with self._lock:
+            jobs = list(self.jobs.values())[-self.KEEP:]
+            self.jobs = {job.id: job for job in jobs}
+            data = {"jobs": [job.to_dict() for job in jobs]}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data, indent=2))
+            os.replace(tmp, self.path)
+            if self.log_dir.is_dir():
+                for log in self.log_dir.glob("*.log"):
+                    if log.stem not in self.jobs:
+                        log.unlink(missing_ok=True)
+    
+    def get(self, job_id: str) -> BuildJob:
+        """Look up a job by ID, or the most recent one for ``last``"""
+        with self._lock:
+            if job_id == "last" and self.jobs:
+                return list(self.jobs.values())[-1]
+            if job_id in self.jobs:
+                return self.jobs[job_id]
+        raise KeyError(f"Unknown job '{job_id}'")
+    
+    def parse(self, argv: List[str], cwd: str):
+        """Parse a job command line the way ``main`` would, or raise ValueError"""
+        if argv[:1] in (["serve"], ["jobs"]):
+            raise ValueError(f"'{argv[0]}' cannot run as a job")
+        if argv[:1] == ["history"]:
+            parser = build_history_parser(_JobParser)
+            args = parser.parse_args(argv[1:])
+            check_history_args(parser, args)
+            self._check_repo_root(args.repo_root and Path(cwd) / args.repo_root)
+            return args
+        parser = build_parser(_JobParser)
+        args = parser.parse_args(argv)
+        # Paths are relative to the client's working directory
+        for name, value in vars(args).items():
+            if isinstance(value, Path):
+                setattr(args, name, Path(cwd) / value)
+            elif isinstance(value, list) and value and isinstance(value[0], Path):
+                setattr(args, name, [Path(cwd) / path for path in value])
+        check_args(parser, args)
+        self._check_repo_root(args.repo_root)
+        if not any([args.list, args.resume, args.affected_since, args.graph,
+                    args.validate_all, args.validate, args.os, args.source]):
+            raise ValueError("jobs cannot use the interactive menu; select builds with --os/--source")
+        return args
+    
+    def _check_repo_root(self, repo_root: Optional[Path]) -> None:
+        if repo_root and repo_root.resolve() != self.manager.repo_root.resolve():
+            raise ValueError(f"this daemon serves {self.manager.repo_root}, not {repo_root}")
+    
+    def submit(self, argv: List[str], cwd: str) -> BuildJob:
+        args = self.parse(argv, cwd)
+        job_id = time.strftime("%Y%m%d-%H%M%S", time.gmtime()) + "-" + os.urandom(2).hex()
+        job = BuildJob(job_id, list(argv), cwd, self.log_dir / f"{job_id}.log")
+        job.args = args
+        with self._lock:
+            self.jobs[job.id] = job
+        self.save()
+        self._queue.put(job)
+        print(f"{Colors.OKCYAN}[{job.id}] queued: {' '.join(argv)}{Colors.ENDC}", flush=True)
+        return job
+    
+    def cancel(self, job: BuildJob) -> None:
+        """Drop a queued job, or stop the builds of a running one"""
+        job.stop.set()
+        if job.status == "queued":
+            job.set_status("cancelled")
+            self.save()
+    
+    def _worker(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job.status != "queued":
+                continue
+            with self._lock:
+                self._running += 1
+            job.set_status("running")
+            self.save()
+            print(f"{Colors.OKCYAN}[{job.id}] running{Colors.ENDC}", flush=True)
+            returncode = self._run(job)
+            if job.stop.is_set():
+                status = "cancelled"
+            else:
+                status = "succeeded" if returncode == 0 else "failed"
+            job.set_status(status, returncode)
+            try:
+                self.log_dir.mkdir(parents=True, exist_ok=True)
+                job.log_path.write_text("".join(f"{line}\n" for line in job.lines))
+            except OSError as e:
+                print(f"{Colors.WARNING}Warning: cannot save output of job {job.id}: {e}{Colors.ENDC}")
+            with self._lock:
+                self._running -= 1
+                idle = self._running == 0
+            if idle:
+                with self._index_lock:
+                    self.manager.save_index()
+            self.save()
+            print(f"{Colors.OKCYAN}[{job.id}] {status} (exit {returncode}){Colors.ENDC}", flush=True)
+    
+    def _run(self, job: BuildJob) -> int:
+        """Run a job's command line on a manager of its own that writes to the job"""
+        args = job.args
+        try:
+            # Rediscovery against the warm index only re-reads changed directories
+            with self._index_lock:
+                manager = PackerBuildManager(
+                    self.manager.repo_root, index=self.manager.index, plugins=self.manager.plugins, output=job
+                )
+            if job.argv[:1] == ["history"]:
+                return run_history(manager, args)
+            compression = args.log_compression
+            if compression == "zstd" and zstandard is None:
+                compression = "gzip"
+            manager.runner = self.manager.runner.configured(compression, args.log_keep, args.verbose)
+            manager.slots = self.slots
+            manager.stop = job.stop
+            return_code = configure_run(manager, args)
+            if return_code != 0:
+                return return_code
+            return run_cli(manager, args)
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            job.write(f"{Colors.FAIL}Error: {e}{Colors.ENDC}\n")
+            return 1
+    
+    def status(self) -> Dict:
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return {
+            "repo_root": str(self.manager.repo_root),
+            "pid": os.getpid(),
+            "slots": {"workers": self.slots.workers, "active": dict(self.slots.active),
+                      "provider_limits": self.slots.provider_limits},
+            "jobs": {status: sum(1 for j in jobs if j.status == status)
+                     for status in ("queued", "running") + BuildJob.FINAL},
+        }
+    
+    def shutdown(self) -> None:
+        """Stop the builds of running jobs and wait for them to clean up"""
+        with self._lock:
+            jobs = [job for job in self.jobs.values() if not job.done]
+        for job in jobs:
+            self.cancel(job)
+        for job in jobs:
+            while not job.done:
+                time.sleep(0.2)
+
+
+class DaemonRequestHandler(http.server.BaseHTTPRequestHandler):
+    """JSON API of a ``serve`` daemon
+    
+    ``GET /status``, ``GET /jobs``, ``POST /jobs`` with ``{"argv": [...],
+    "cwd": ...}``, ``GET /jobs/<id>``, ``GET /jobs/<id>/log?offset=N&wait=S``
+    (long polls for up to S seconds) and ``POST /jobs/<id>/cancel``.
+    """
+    
+    protocol_version = "HTTP/1.1"
+    # Longest long poll a client may ask for
+    MAX_WAIT = 60
+    
+    def address_string(self) -> str:
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+    
+    def log_message(self, format, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+    
+    def _reply(self, code: int, body: Dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _route(self, method: str) -> None:
+        daemon: BuildDaemon = self.server.build_daemon
+        url = urllib.parse.urlsplit(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            if method == "GET" and parts == ["status"]:
+                return self._reply(200, daemon.status())
+            if parts == ["jobs"]:
+                if method == "GET":
+                    with daemon._lock:
+                        jobs = list(daemon.jobs.values())
+                    return self._reply(200, {"jobs": [job.to_dict() for job in jobs]})
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                argv = body.get("argv")
+                if not isinstance(argv, list) or not all(isinstance(a, str) for a in argv):
+                    raise ValueError("argv must be a list of strings")
+                job = daemon.submit(argv, body.get("cwd") or str(daemon.manager.repo_root))
+                return self._reply(201, job.to_dict())
+            if len(parts) >= 2 and parts[0] == "jobs":
+                job = daemon.get(parts[1])
+                if method == "GET" and len(parts) == 2:
+                    return self._reply(200, job.to_dict())
+                if method == "GET" and parts[2:] == ["log"]:
+                    offset = int(query.get("offset", ["0"])[0])
+                    timeout = min(float(query.get("wait", ["0"])[0]), self.MAX_WAIT)
+                    lines, offset = job.tail(offset, timeout)
+                    return self._reply(200, {"lines": lines, "offset": offset, **job.to_dict()})
+                if method == "POST" and parts[2:] == ["cancel"]:
+                    daemon.cancel(job)
+                    return self._reply(200, job.to_dict())
+            self._reply(404, {"error": f"no such endpoint: {method} {url.path}"})
+        except KeyError as e:
+            self._reply(404, {"error": e.args[0]})
+        except ValueError as e:
+            self._reply(400, {"error": str(e)})
+    
+    def do_GET(self) -> None:
+        self._route("GET")
+    
+    def do_POST(self) -> None:
+        self._route("POST")
+
+
+class UnixHTTPServer(http.server.ThreadingHTTPServer):
+    """HTTP server on a Unix domain socket"""
+    
+    address_family = socket.AF_UNIX
+    
+    def server_bind(self) -> None:
+        socketserver.TCPServer.server_bind(self)
+        self.server_name, self.server_port = "localhost", 0
+
+
+def serve_main(argv: List[str]) -> int:
+    """Entry point of the ``serve`` subcommand"""
+    parser = argparse.ArgumentParser(
+        prog="buildManager.py serve",
+        description="Keep the discovery index warm and run submitted command lines as queued jobs"
+    )
+    parser.add_argument("--repo-root", type=Path, help="Repository root path (auto-detected if not specified)")
+    parser.add_argument(
+        "--socket",
+        type=Path,
+        help="Unix socket to listen on (default: .buildmanager/serve.sock)"
+    )
+    parser.add_argument(
+        "--listen",
+        metavar="HOST:PORT",
+        help="Listen on a loopback TCP address instead of a Unix socket"
+    )
+    parser.add_argument(
+        "--slots",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Builds that may run at once across all jobs (default: CPU count)"
+    )
+    parser.add_argument(
+        "--provider-limit",
+        action="append",
+        metavar="PROVIDER=N",
+        help="Cap builds of a provider across all jobs (repeatable)"
+    )
+    parser.add_argument(
+        "--max-jobs",
+        type=int,
+        help="Jobs that may run at once; the rest wait in the queue (default: --slots)"
+    )
+    parser.add_argument("--refresh-index", action="store_true", help="Ignore the discovery index and rebuild it")
+    parser.add_argument("--verbose", action="store_true", help="Log every API request")
+    args = parser.parse_args(argv)
+    
+    try:
+        provider_limits = parse_provider_limits(args.provider_limit)
+    except ValueError as e:
+        parser.error(str(e))
+    address = None
+    if args.listen:
+        host, _, port = args.listen.rpartition(":")
+        host = host or "127.0.0.1"
+        if host not in ("127.0.0.1", "localhost") or not port.isdigit():
+            # Jobs run arbitrary packer builds, so the API stays on this host
+            parser.error("--listen takes a loopback HOST:PORT such as 127.0.0.1:8150")
+        address = (host, int(port))
+    elif not hasattr(socket, "AF_UNIX"):
+        parser.error("Unix sockets are not available here; use --listen 127.0.0.1:PORT")
+    
+    try:
+        manager = PackerBuildManager(args.repo_root, refresh_index=args.refresh_index)
+    except RuntimeError as e:
+        print(f"{Colors.FAIL}Error: {e}{Colors.ENDC}")
+        return 1
+    manager.save_index()
+    
+    if address:
+        server = http.server.ThreadingHTTPServer(address, DaemonRequestHandler)
+        location = f"http://{args.listen}"
+    else:
+        path = args.socket or manager.state_dir / "serve.sock"
+        if path.exists():
+            try:
+                DaemonClient(f"unix:{path}").request("GET", "/status", timeout=2)
+            except RuntimeError:
+                path.unlink()
+            else:
+                print(f"{Colors.FAIL}Error: a daemon is already listening on {path}{Colors.ENDC}")
+                return 1
+        path.parent.mkdir(parents=True, exist_ok=True)
+        server = UnixHTTPServer(str(path), DaemonRequestHandler)
+        os.chmod(path, 0o600)
+        location = f"unix:{path}"
+    
+    slots = WorkerSlots(args.slots, provider_limits)
+    server.build_daemon = BuildDaemon(manager, slots, args.max_jobs or slots.workers)
+    server.verbose = args.verbose
+    print(f"{Colors.BOLD}Build manager daemon for {manager.repo_root} listening on {location}{Colors.ENDC}")
+    print(f"{len(manager.builds)} build(s) indexed, {slots.workers} worker slot(s)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n{Colors.WARNING}Stopping, cancelling running jobs... "
+              f"(press Ctrl-C again to exit now){Colors.ENDC}", flush=True)
+        try:
+            server.build_daemon.shutdown()
+        except KeyboardInterrupt:
+            pass
+    finally:
+        server.server_close()
+        if not address:
+            path.unlink(missing_ok=True)
+        manager.save_index()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(serve_main(sys.argv[1:]))
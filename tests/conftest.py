@@ -0,0 +1,71 @@
+"""
+Shared fixtures for the buildManager.py and winrm-tool.py tests
+
+Both tools are single-file scripts, so the tests import them from their
+directories instead of from an installed package.
+"""
+
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from fake_wsman import FakeWsMan
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "scripts"))
+
+
+@pytest.fixture(scope="session")
+def winrm_tool():
+    """utils/winrm-tool.py as a module (its file name is not importable)"""
+    pytest.importorskip("winrm")
+    spec = importlib.util.spec_from_file_location("winrm_tool", REPO_ROOT / "utils" / "winrm-tool.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def servers():
+    """Start fake WS-Man servers (tests/fake_wsman.py) from {command: (stdout, stderr, exit code)}"""
+    started = []
+
+    def start(commands: dict) -> FakeWsMan:
+        started.append(FakeWsMan(commands))
+        return started[-1]
+    yield start
+    for server in started:
+        server.stop()
+
+
+@pytest.fixture
+def write_build(tmp_path):
+    """Create a build directory under tmp_path/builds from {file name: HCL text}"""
+    def write(relative: str, files: dict) -> Path:
+        path = tmp_path / "builds" / relative
+        path.mkdir(parents=True, exist_ok=True)
+        for name, content in files.items():
+            (path / name).write_text(content)
+        return path
+    return write
+
+
+@pytest.fixture
+def fake_packer(tmp_path, monkeypatch):
+    """Put scripts/benchmarks/fake_packer.py on PATH as packer, with instant steps"""
+    if os.name == "nt":
+        pytest.skip("the fake packer is installed as a POSIX script")
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    packer = bin_dir / "packer"
+    packer.write_text(f"#!/bin/sh\nexec {sys.executable} {REPO_ROOT / 'scripts/benchmarks/fake_packer.py'} \"$@\"\n")
+    packer.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_PACKER_STEP_SECONDS", "0")
+    monkeypatch.setenv("FAKE_PACKER_INIT_SECONDS", "0")
+    monkeypatch.setenv("FAKE_PACKER_STATS", str(tmp_path / "stats.jsonl"))
+    monkeypatch.delenv("BUILDMANAGER_VM_ID_POOL", raising=False)
+    return packer
@@ -0,0 +1,172 @@
+"""
+A minimal WS-Man endpoint for testing winrm-tool.py without Windows
+
+It answers the shell requests pywinrm sends (Create, Command, Receive,
+Signal, Delete) and runs each PowerShell command by looking it up in
+``commands``. A command mapped to ``HANG`` blocks until the server stops.
+Requests for a shell the server does not know, e.g. after
+``expire_shells()``, fail with HTTP 500 like an expired shell on Windows.
+An unauthenticated Identify is refused with 401, as Windows does by
+default, unless ``identify`` is set. The script of ``follow_logs`` reads
+the remote files in ``files`` ({path: bytes}), and ``unavailable`` makes
+every request fail with HTTP 503.
+"""
+
+import base64
+import re
+import socket
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HANG = object()
+
+ENVELOPE = (
+    '<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" '
+    'xmlns:a="http://schemas.xmlsoap.org/ws/2004/08/addressing" '
+    'xmlns:w="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" '
+    'xmlns:rsp="http://schemas.microsoft.com/wbem/wsman/1/windows/shell">'
+    '<s:Header><a:RelatesTo>{message_id}</a:RelatesTo></s:Header><s:Body>{body}</s:Body></s:Envelope>'
+)
+DONE = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Done"
+TAIL = re.compile(r"\$paths = @\((.*)\)\s+\$offsets = @\((.*)\)")
+TAIL_MAX = re.compile(r"Min\(\$length - \$offsets\[\$i\], (\d+)\)")
+
+
+def free_port() -> int:
+    """A localhost port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class WsManHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body: str):
+        data = ENVELOPE.format(message_id=self.message_id, body=body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/soap+xml;charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        if "<wsmid:Identify/>" in request and self.server.identify:
+            data = ('<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope"><s:Body>'
+                    '<wsmid:IdentifyResponse xmlns:wsmid="http://schemas.dmtf.org/wbem/wsman/identity/1/'
+                    'wsmanidentity.xsd"><wsmid:ProductVendor>Fake</wsmid:ProductVendor>'
+                    '</wsmid:IdentifyResponse></s:Body></s:Envelope>').encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/soap+xml;charset=UTF-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if not self.headers.get("Authorization", "").startswith("Basic "):
+            self.send_response(401)
+            self.send_header("WWW-Authenticate", "Basic")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.server.unavailable:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        action = re.search(r"Action[^>]*>([^<]+)<", request).group(1)
+        self.message_id = re.search(r"MessageID[^>]*>([^<]+)<", request).group(1)
+        server = self.server
+        shell = re.search(r'Name="ShellId">([^<]+)<', request)
+        if shell and shell.group(1) not in server.shells:
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if action.endswith("transfer/Create"):
+            shell_id = str(uuid.uuid4()).upper()
+            server.shells.add(shell_id)
+            server.shells_created += 1
+            self.reply('<x:ResourceCreated xmlns:x="http://schemas.xmlsoap.org/ws/2004/09/transfer">'
+                       f'<w:SelectorSet><w:Selector Name="ShellId">{shell_id}</w:Selector></w:SelectorSet>'
+                       '</x:ResourceCreated>')
+        elif action.endswith("shell/Command"):
+            # pywinrm's Session passes the whole command line as the command
+            arguments = " ".join(re.findall(r"<rsp:(?:Command|Arguments)>(.*?)</rsp:", request))
+            encoded = re.search(r"-EncodedCommand (\S+)", arguments, re.IGNORECASE)
+            script = base64.b64decode(encoded.group(1)).decode("utf-16-le") if encoded else arguments
+            server.scripts.append(script)
+            result = server.commands.get(script) or server.tail(script)
+            if result is HANG:
+                server.stopped.wait()
+                return
+            command_id = str(uuid.uuid4()).upper()
+            server.results[command_id] = result
+            self.reply(f"<rsp:CommandResponse><rsp:CommandId>{command_id}</rsp:CommandId></rsp:CommandResponse>")
+        elif action.endswith("shell/Receive"):
+            command_id = re.search(r'CommandId="([^"]+)"', request).group(1)
+            stdout, stderr, exit_code = server.results.pop(command_id)
+            streams = "".join(
+                f'<rsp:Stream Name="{name}" CommandId="{command_id}">{base64.b64encode(text.encode()).decode()}</rsp:Stream>'
+                for name, text in [("stdout", stdout), ("stderr", stderr)] if text
+            )
+            self.reply(f'<rsp:ReceiveResponse>{streams}<rsp:CommandState CommandId="{command_id}" '
+                       f'State="{DONE}"><rsp:ExitCode>{exit_code}</rsp:ExitCode></rsp:CommandState>'
+                       '</rsp:ReceiveResponse>')
+        else:
+            # Signal and Delete
+            if action.endswith("transfer/Delete"):
+                server.shells.discard(shell.group(1))
+            self.reply("")
+
+
+class FakeWsMan(ThreadingHTTPServer):
+    """A WS-Man server on a free localhost port, served from a thread"""
+
+    daemon_threads = True
+
+    def __init__(self, commands: dict):
+        super().__init__(("127.0.0.1", 0), WsManHandler)
+        self.commands = {"hostname": ("FAKEHOST\r\n", "", 0), **commands}
+        self.scripts = []
+        self.results = {}
+        self.shells = set()
+        self.shells_created = 0
+        self.identify = False
+        self.files = {}
+        self.unavailable = False
+        self.stopped = threading.Event()
+        self.port = self.server_address[1]
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def tail(self, script: str) -> tuple:
+        """Answer the polling script of follow_logs from ``files``"""
+        match = TAIL.search(script)
+        if not match:
+            return ("", f"unknown command: {script}", 1)
+        paths = [p.replace("''", "'") for p in re.findall(r"'((?:[^']|'')*)'", match.group(1))]
+        offsets = [int(o) for o in match.group(2).split(",")]
+        max_bytes = int(TAIL_MAX.search(script).group(1))
+        lines = []
+        for i, (path, offset) in enumerate(zip(paths, offsets)):
+            data = self.files.get(path)
+            if data is None:
+                lines.append(f"{i} -1")
+                continue
+            chunk = data[offset:offset + max_bytes] if len(data) > offset else b""
+            lines.append(f"{i} {len(data)} {base64.b64encode(chunk).decode()}")
+        return ("".join(f"{line}\r\n" for line in lines), "", 0)
+
+    def expire_shells(self):
+        """Forget every open shell, as Windows does after its idle timeout"""
+        self.shells.clear()
+
+    def stop(self):
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,99 @@
+"""Tests for the input fingerprints that let unchanged builds be skipped"""
+
+import json
+import time
+
+import pytest
+
+from buildManager import BuildCache, BuildGraph, PackerBuild
+
+BASE = "proxmox-iso.base"
+CLONE = "proxmox-clone.minimal"
+
+
+@pytest.fixture
+def builds(tmp_path, write_build):
+    (tmp_path / "builds" / "proxmox" / "scripts").mkdir(parents=True)
+    (tmp_path / "builds" / "proxmox" / "scripts" / "setup.sh").write_text("echo setup\n")
+    base = write_build("proxmox/linux/base", {
+        "sources.pkr.hcl": 'source "proxmox-iso" "base" {\n  vm_id = 9000\n}\n',
+        "build.pkr.hcl": 'build {\n  sources = ["source.proxmox-iso.base"]\n'
+                         '  provisioner "shell" {\n    script = "../../scripts/setup.sh"\n  }\n}\n',
+    })
+    clone = write_build("proxmox/linux/minimal", {
+        "sources.pkr.hcl": 'source "proxmox-clone" "minimal" {\n  clone_vm_id = 9000\n  vm_id = 9001\n}\n',
+    })
+    return PackerBuild(base, "proxmox", "linux"), PackerBuild(clone, "proxmox", "linux")
+
+
+def fingerprints(tmp_path, base, clone, **kwargs):
+    # Parsed metadata and input digests are memoized, so start from scratch
+    fresh = [PackerBuild(b.path, b.cloud_provider, b.os_type) for b in (base, clone)]
+    cache = BuildCache(tmp_path, BuildGraph(fresh))
+    return cache.fingerprint(fresh[0], BASE, **kwargs), cache.fingerprint(fresh[1], CLONE, **kwargs)
+
+
+def test_unchanged_inputs_keep_their_fingerprint(tmp_path, builds):
+    assert fingerprints(tmp_path, *builds) == fingerprints(tmp_path, *builds)
+
+
+def test_template_change_invalidates_the_build_and_its_clones(tmp_path, builds):
+    base, clone = builds
+    before = fingerprints(tmp_path, base, clone)
+    (base.path / "sources.pkr.hcl").write_text('source "proxmox-iso" "base" {\n  vm_id = 9000\n  cores = 4\n}\n')
+    after = fingerprints(tmp_path, base, clone)
+    assert after[0] != before[0]
+    assert after[1] != before[1]
+
+
+def test_clone_change_leaves_the_base_alone(tmp_path, builds):
+    base, clone = builds
+    before = fingerprints(tmp_path, base, clone)
+    (clone.path / "variables.pkr.hcl").write_text('variable "node" {\n  default = "pve2"\n}\n')
+    after = fingerprints(tmp_path, base, clone)
+    assert after[0] == before[0]
+    assert after[1] != before[1]
+
+
+def test_referenced_script_change_invalidates(tmp_path, builds):
+    base, clone = builds
+    before = fingerprints(tmp_path, base, clone)
+    (tmp_path / "builds" / "proxmox" / "scripts" / "setup.sh").write_text("echo setup v2\n")
+    assert fingerprints(tmp_path, base, clone)[0] != before[0]
+
+
+def test_manifests_do_not_invalidate(tmp_path, builds):
+    base, clone = builds
+    before = fingerprints(tmp_path, base, clone)
+    (base.path / "manifests").mkdir()
+    (base.path / "manifests" / "run.json").write_text("{}")
+    assert fingerprints(tmp_path, base, clone) == before
+
+
+def test_variables_and_arguments_are_part_of_the_fingerprint(tmp_path, builds):
+    base, clone = builds
+    before = fingerprints(tmp_path, base, clone)
+    assert fingerprints(tmp_path, base, clone, extra_args=["-var", "cores=4"]) != before
+    variables = tmp_path / "custom.pkrvars.hcl"
+    variables.write_text('node = "pve2"\n')
+    assert fingerprints(tmp_path, base, clone, variables_file=variables) != before
+
+
+def test_record_and_lookup(tmp_path, builds):
+    base, _ = builds
+    cache = BuildCache(tmp_path)
+    since = time.time() - 1
+    manifests = base.path / "manifests"
+    manifests.mkdir()
+    (manifests / "2026-01-01.json").write_text(json.dumps({
+        "builds": [{"name": "base", "builder_type": "proxmox-iso", "packer_run_uuid": "abc"}]
+    }))
+    assert cache.record(base, {BASE: "f1"}, since) == [BASE]
+    assert cache.lookup(base, BASE, "f1") == "2026-01-01.json"
+    # The fingerprints file is replaced in one step, leaving no temporary file
+    assert sorted(p.name for p in manifests.iterdir()) == [BuildCache.FILENAME, "2026-01-01.json"]
+    # Other inputs, another matrix variant or a deleted manifest mean a rebuild
+    assert cache.lookup(base, BASE, "f2") is None
+    assert cache.lookup(base, BASE, "f1", variant="large") is None
+    (manifests / "2026-01-01.json").unlink()
+    assert cache.lookup(base, BASE, "f1") is None
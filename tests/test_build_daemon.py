@@ -0,0 +1,164 @@
+"""
+Tests for the JSON API of the ``serve`` daemon on a temporary Unix socket,
+running jobs against the fake packer from scripts/benchmarks
+"""
+
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+import build_daemon
+import buildManager
+from build_daemon import BuildDaemon, DaemonRequestHandler, UnixHTTPServer, WorkerSlots
+from buildManager import DaemonClient
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix sockets")
+
+
+def base_build(name: str, vm_id: int) -> dict:
+    return {
+        "build.pkr.hcl": f'build {{\n  name = "{name}"\n  sources = ["source.proxmox-iso.{name}"]\n}}\n',
+        "sources.pkr.hcl": f'source "proxmox-iso" "{name}" {{\n  vm_id = {vm_id}\n}}\n',
+    }
+
+
+@pytest.fixture
+def repo(tmp_path, write_build, fake_packer):
+    (tmp_path / ".git").mkdir()
+    write_build("proxmox/linux/debian/12/base", base_build("debian_12_base", 9000))
+    write_build("proxmox/linux/ubuntu/24/base", base_build("ubuntu_24_base", 9100))
+    return tmp_path
+
+
+@pytest.fixture
+def daemon(repo):
+    """A daemon with two slots serving ``repo`` on a temporary socket"""
+    manager = buildManager.PackerBuildManager(repo)
+    daemon = BuildDaemon(manager, WorkerSlots(2), 2)
+    # Unix socket paths are short; pytest's tmp_path can be too long
+    socket_dir = Path(tempfile.mkdtemp(prefix="bm-"))
+    server = UnixHTTPServer(str(socket_dir / "serve.sock"), DaemonRequestHandler)
+    server.build_daemon = daemon
+    server.verbose = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield daemon, DaemonClient(f"unix:{socket_dir / 'serve.sock'}")
+    daemon.shutdown()
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(socket_dir)
+
+
+def finish(client: DaemonClient, job_id: str) -> tuple:
+    """Follow a job's log until it is done; return the job and its output"""
+    lines, offset = [], 0
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        reply = client.request("GET", f"/jobs/{job_id}/log?offset={offset}&wait=5")
+        lines.extend(reply["lines"])
+        offset = reply["offset"]
+        if reply["status"] in build_daemon.BuildJob.FINAL and not reply["lines"]:
+            return reply, lines
+    pytest.fail(f"job {job_id} did not finish")
+
+
+def submit(client: DaemonClient, repo: Path, *argv: str) -> dict:
+    return client.request("POST", "/jobs", {"argv": list(argv), "cwd": str(repo)})
+
+
+def test_status(daemon, repo):
+    _, client = daemon
+    status = client.request("GET", "/status")
+
+    assert status["repo_root"] == str(repo)
+    assert status["slots"]["workers"] == 2
+    assert status["jobs"]["queued"] == 0
+
+
+def test_submitted_build_streams_its_output(daemon, repo):
+    _, client = daemon
+    job = submit(client, repo, "--os", "debian/12/base")
+    assert job["status"] in ("queued", "running")
+
+    reply, lines = finish(client, job["id"])
+    assert (reply["status"], reply["returncode"]) == ("succeeded", 0)
+    assert any("Builds finished" in line for line in lines)
+    assert client.request("GET", "/jobs")["jobs"][-1]["id"] == job["id"]
+
+    # Reading from an offset returns only what follows it
+    reply = client.request("GET", f"/jobs/{job['id']}/log?offset={len(lines) - 2}")
+    assert reply["lines"] == lines[-2:]
+    assert reply["offset"] == len(lines)
+
+
+def test_concurrent_jobs_keep_their_output_apart(daemon, repo, monkeypatch):
+    # Slow enough steps that both builds run at the same time
+    monkeypatch.setenv("FAKE_PACKER_STEP_SECONDS", "0.1")
+    _, client = daemon
+    jobs = {name: submit(client, repo, "--os", path)
+            for name, path in [("debian_12_base", "debian/12/base"), ("ubuntu_24_base", "ubuntu/24/base")]}
+
+    for name, job in jobs.items():
+        reply, lines = finish(client, job["id"])
+        other = ({"debian_12_base", "ubuntu_24_base"} - {name}).pop()
+        assert reply["status"] == "succeeded"
+        assert any(f"[{name}]" in line for line in lines)
+        assert not any(other in line for line in lines)
+    # Jobs write to their own output, never to the daemon's streams
+    assert not isinstance(sys.stdout, build_daemon.BuildJob)
+
+
+def test_invalid_command_lines_are_rejected(daemon, repo):
+    _, client = daemon
+    with pytest.raises(RuntimeError, match="interactive menu"):
+        submit(client, repo)
+    with pytest.raises(RuntimeError, match="cannot run as a job"):
+        submit(client, repo, "serve")
+    with pytest.raises(RuntimeError, match="commit needs a commit hash"):
+        submit(client, repo, "history", "commit")
+    with pytest.raises(RuntimeError, match="Unknown job"):
+        client.request("GET", "/jobs/nope")
+
+
+def test_cancel_stops_a_running_build(daemon, repo, monkeypatch):
+    monkeypatch.setenv("FAKE_PACKER_STEP_SECONDS", "5")
+    _, client = daemon
+    job = submit(client, repo, "--os", "debian/12/base")
+
+    deadline = time.monotonic() + 10
+    while "Creating VM" not in "\n".join(client.request("GET", f"/jobs/{job['id']}/log")["lines"]):
+        assert time.monotonic() < deadline, "the build did not start"
+        time.sleep(0.1)
+    client.request("POST", f"/jobs/{job['id']}/cancel")
+
+    reply, _ = finish(client, job["id"])
+    assert reply["status"] == "cancelled"
+    assert reply["finished"] - reply["started"] < 20
+
+
+def test_history_job_uses_the_daemon_index(daemon, repo, monkeypatch):
+    _, client = daemon
+    created = []
+    original = buildManager.DiscoveryIndex.__init__
+    monkeypatch.setattr(buildManager.DiscoveryIndex, "__init__",
+                        lambda self, *a, **kw: created.append(a) or original(self, *a, **kw))
+
+    job = submit(client, repo, "history", "latest", "--format", "json")
+    reply, lines = finish(client, job["id"])
+
+    assert reply["status"] == "succeeded"
+    assert "\n".join(lines).strip() == "[]"
+    assert created == []
+
+
+def test_build_manager_does_not_import_the_daemon():
+    # build_daemon imports buildManager, never the other way round
+    code = "import sys, buildManager; sys.exit('build_daemon' in sys.modules)"
+    scripts = Path(buildManager.__file__).parent
+    assert subprocess.run([sys.executable, "-c", code], cwd=scripts).returncode == 0
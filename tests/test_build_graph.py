@@ -0,0 +1,117 @@
+"""Tests for clone -> base template resolution in BuildGraph"""
+
+from pathlib import Path
+
+import pytest
+
+from buildManager import BuildGraph, BuildTask, PackerBuild, PackerBuildManager
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def make_build(path, provider="proxmox", os_type="linux"):
+    return PackerBuild(path, provider, os_type)
+
+
+def iso(name, vm_id):
+    return f'source "proxmox-iso" "{name}" {{\n  vm_id = {vm_id}\n}}\n'
+
+
+def clone(name, clone_vm_id, vm_id):
+    return f'source "proxmox-clone" "{name}" {{\n  clone_vm_id = {clone_vm_id}\n  vm_id = {vm_id}\n}}\n'
+
+
+@pytest.fixture
+def tree(write_build):
+    """Two distros that both use VM ID 9000 for their base template"""
+    return {
+        "debian_base": make_build(write_build("proxmox/linux/debian/12/base", {
+            "sources.pkr.hcl": iso("debian_base", 9000)})),
+        "debian_minimal": make_build(write_build("proxmox/linux/debian/12/minimal", {
+            "sources.pkr.hcl": clone("debian_minimal", 9000, 9001)})),
+        "ubuntu_base": make_build(write_build("proxmox/linux/ubuntu/24/base", {
+            "sources.pkr.hcl": iso("ubuntu_base", 9000)})),
+        "ubuntu_minimal": make_build(write_build("proxmox/linux/ubuntu/24/minimal", {
+            "sources.pkr.hcl": clone("ubuntu_minimal", 9000, 9002)})),
+        "orphan": make_build(write_build("proxmox/linux/ubuntu/24/orphan", {
+            "sources.pkr.hcl": clone("orphan", 9999, 9003)})),
+        "aws_clone": make_build(write_build("aws/linux/debian/12/minimal", {
+            "sources.pkr.hcl": clone("aws_clone", 9000, 9004)}), provider="aws"),
+    }
+
+
+def test_producer_is_the_closest_build_with_that_vm_id(tree):
+    graph = BuildGraph(list(tree.values()))
+    assert graph.producer_of(tree["debian_minimal"], "proxmox-clone.debian_minimal") == \
+        (tree["debian_base"], "proxmox-iso.debian_base")
+    assert graph.producer_of(tree["ubuntu_minimal"], "proxmox-clone.ubuntu_minimal") == \
+        (tree["ubuntu_base"], "proxmox-iso.ubuntu_base")
+
+
+def test_producers_of_other_providers_are_ignored(tree):
+    graph = BuildGraph(list(tree.values()))
+    assert graph.producer_of(tree["aws_clone"], "proxmox-clone.aws_clone") is None
+
+
+def test_unresolved_clone_is_reported(tree):
+    graph = BuildGraph(list(tree.values()))
+    assert graph.producer_of(tree["orphan"], "proxmox-clone.orphan") is None
+    assert graph.unresolved(tree["orphan"]) == [("proxmox-clone.orphan", 9999)]
+    assert graph.unresolved(tree["debian_minimal"]) == []
+
+
+def test_vm_id_from_variable_default(write_build):
+    base = make_build(write_build("proxmox/linux/debian/12/base", {
+        "sources.pkr.hcl": 'source "proxmox-iso" "base" {\n  vm_id = var.vm_id\n}\n',
+        "variables.pkr.hcl": 'variable "vm_id" {\n  default = 9100\n}\n',
+    }))
+    child = make_build(write_build("proxmox/linux/debian/12/minimal", {
+        "sources.pkr.hcl": clone("minimal", 9100, 9101)}))
+    assert BuildGraph([base, child]).producer_of(child, "proxmox-clone.minimal") == (base, "proxmox-iso.base")
+
+
+def test_expand_and_link_order_bases_first(tree):
+    graph = BuildGraph(list(tree.values()))
+    tasks = graph.expand([BuildTask(tree["debian_minimal"])])
+    assert [t.build for t in tasks] == [tree["debian_base"], tree["debian_minimal"]]
+    ordered = graph.link(list(reversed(tasks)))
+    assert [t.build for t in ordered] == [tree["debian_base"], tree["debian_minimal"]]
+    assert ordered[1].dependencies == [ordered[0]]
+
+
+def test_link_detects_cycles(write_build):
+    a = make_build(write_build("proxmox/linux/a", {"sources.pkr.hcl": clone("a", 2, 1)}))
+    b = make_build(write_build("proxmox/linux/b", {"sources.pkr.hcl": clone("b", 1, 2)}))
+    with pytest.raises(ValueError, match="cycle"):
+        BuildGraph([a, b]).link([BuildTask(a), BuildTask(b)])
+
+
+@pytest.fixture(scope="module")
+def manager():
+    return PackerBuildManager(REPO_ROOT)
+
+
+class TestRepositoryTree:
+    """Producer resolution on the templates of this repository"""
+    
+    def build(self, manager, relative):
+        path = REPO_ROOT / "builds" / relative
+        return next(b for b in manager.builds if b.path == path)
+    
+    def test_windows_2019_atomic_red_team_clones_the_base(self, manager):
+        graph = BuildGraph(manager.builds)
+        build = self.build(manager, "proxmox/windows/server/2019/atomic_red_team")
+        (source,) = build.sources
+        producer, producer_source = graph.producer_of(build, source)
+        assert producer.path == REPO_ROOT / "builds/proxmox/windows/server/2019/base"
+        assert producer_source == "proxmox-iso.windows_server_2k19_data_center_base"
+    
+    @pytest.mark.parametrize("variant", ["hardened", "minimal"])
+    def test_windows_2019_clones_of_vm_9010_are_unresolved(self, manager, variant):
+        # VM 9010 is only defined in server/2019/sources.pkr.hcl, a directory
+        # without build.pkr.hcl, so no discovered build produces it
+        graph = BuildGraph(manager.builds)
+        build = self.build(manager, f"proxmox/windows/server/2019/{variant}")
+        (source,) = build.sources
+        assert graph.producer_of(build, source) is None
+        assert graph.unresolved(build) == [(source, 9010)]
@@ -0,0 +1,190 @@
+"""Tests for the SQLite index over manifests/*.json behind the history subcommand"""
+
+import calendar
+import json
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from buildManager import BuildHistory, PackerBuild, PackerBuildManager, build_history_parser, run_history
+
+BASE = "proxmox-iso.base"
+DOCKER = "proxmox-clone.docker"
+# Runs in these tests started a day ago
+EPOCH = time.time() - 24 * 3600
+
+
+@pytest.fixture
+def build(write_build):
+    path = write_build("proxmox/linux/debian/12", {
+        "build.pkr.hcl": 'build {\n  name = "debian_12"\n'
+                         '  sources = ["source.proxmox-iso.base", "source.proxmox-clone.docker"]\n}\n',
+    })
+    (path / "manifests").mkdir()
+    return PackerBuild(path, "proxmox", "linux")
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = BuildHistory(tmp_path / ".buildmanager" / "history.sqlite", tmp_path)
+    yield history
+    history.close()
+
+
+def stamp(offset: float) -> str:
+    return time.strftime("%Y-%m-%d-%H-%M-%S", time.gmtime(EPOCH + offset))
+
+
+def started(offset: float) -> float:
+    return float(calendar.timegm(time.strptime(stamp(offset), "%Y-%m-%d-%H-%M-%S")))
+
+
+def write_manifest(build, offset, sources, version, duration=None) -> Path:
+    """Write the manifest of a run started ``offset`` seconds after EPOCH"""
+    manifest = build.path / "manifests" / f"{stamp(offset)}.json"
+    manifest.write_text(json.dumps({"builds": [
+        {
+            "name": source.split(".")[1],
+            "builder_type": source.split(".")[0],
+            "artifact_id": f"{9000 + n}",
+            "packer_run_uuid": f"run-{offset}",
+            "custom_data": {"build_version": version, "author": "ci"},
+        }
+        for n, source in enumerate(sources)
+    ]}))
+    if duration is not None:
+        os.utime(manifest, (started(offset) + duration, started(offset) + duration))
+    settle(build)
+    return manifest
+
+
+def settle(build) -> None:
+    """Date the manifests/ directory back an hour, as if nothing changed since"""
+    then = time.time_ns() - 3600 * 10**9
+    os.utime(build.path / "manifests", ns=(then, then))
+
+
+def test_ingest_keeps_versions_and_durations(history, build):
+    write_manifest(build, 0, [BASE, DOCKER], "aaa111", duration=600)
+    timings = build.path / "manifests" / "timings"
+    timings.mkdir()
+    (timings / f"{stamp(3)}.json").write_text(json.dumps({"sources": {BASE: {"duration": 420.5}}}))
+    settle(build)
+
+    assert history.refresh([build]) == (1, 0)
+    rows = {row["source"]: row for row in history.runs()}
+    assert rows[BASE]["build_version"] == "aaa111"
+    assert rows[BASE]["build_name"] == "debian_12"
+    assert rows[BASE]["build_dir"] == "builds/proxmox/linux/debian/12"
+    assert rows[BASE]["started"] == started(0)
+    # Step timings win over the manifest mtime
+    assert (rows[BASE]["duration"], rows[BASE]["duration_source"]) == (420.5, "timings")
+    assert (rows[DOCKER]["duration"], rows[DOCKER]["duration_source"]) == (600, "mtime")
+
+
+def test_refresh_reads_only_new_and_changed_manifests(tmp_path, history, build):
+    first = write_manifest(build, 0, [BASE], "aaa111")
+    assert history.refresh([build]) == (1, 0)
+    assert history.refresh([build]) == (0, 0)
+
+    second = write_manifest(build, 3600, [BASE], "bbb222")
+    assert history.refresh([build]) == (1, 0)
+
+    # Packer rewrites the manifest of a run in place as each source finishes,
+    # which leaves the directory mtime alone
+    write_manifest(build, 3600, [BASE, DOCKER], "bbb222")
+    assert history.refresh([build]) == (1, 0)
+    assert {row["source"] for row in history.runs()} == {BASE, DOCKER}
+
+    first.unlink()
+    settle(build)
+    assert history.refresh([build]) == (0, 1)
+    assert [row["manifest"] for row in history.runs()] == [second.relative_to(tmp_path).as_posix()] * 2
+
+
+def test_unchanged_directory_is_not_listed(history, build, monkeypatch):
+    write_manifest(build, 0, [BASE], "aaa111")
+    write_manifest(build, 3600, [BASE], "bbb222")
+    history.refresh([build])
+
+    def glob(self, pattern):
+        raise AssertionError(f"listed {self}")
+    monkeypatch.setattr(Path, "glob", glob)
+    assert history.refresh([build]) == (0, 0)
+    assert len(history.runs()) == 2
+
+
+def test_recently_changed_directory_is_listed_again(history, build, monkeypatch):
+    write_manifest(build, 0, [BASE], "aaa111")
+    os.utime(build.path / "manifests")
+    history.refresh([build])
+
+    listed = []
+    glob = Path.glob
+    monkeypatch.setattr(Path, "glob", lambda self, pattern: listed.append(self) or glob(self, pattern))
+    assert history.refresh([build]) == (0, 0)
+    assert listed == [build.path / "manifests"]
+
+
+def test_missing_build_drops_its_manifests(history, build):
+    write_manifest(build, 0, [BASE], "aaa111")
+    history.refresh([build])
+
+    assert history.refresh([]) == (0, 1)
+    assert history.runs() == []
+
+
+@pytest.mark.parametrize("argv, expected", [
+    (["latest"], [(DOCKER, "aaa111"), (BASE, "bbb222")]),
+    (["latest", "docker"], [(DOCKER, "aaa111")]),
+    (["latest", "proxmox-iso*"], [(BASE, "bbb222")]),
+    (["latest", "debian_12"], [(DOCKER, "aaa111"), (BASE, "bbb222")]),
+    (["runs", "base"], [(BASE, "bbb222"), (BASE, "aaa111")]),
+    (["runs", "--limit", "1"], [(BASE, "bbb222")]),
+    (["trend", "base"], [(BASE, "bbb222"), (BASE, "aaa111")]),
+    (["commit", "AAA1"], [(BASE, "aaa111"), (DOCKER, "aaa111")]),
+    (["latest", "windows"], []),
+])
+def test_queries(tmp_path, build, capsys, argv, expected):
+    write_manifest(build, 0, [BASE, DOCKER], "aaa111", duration=600)
+    write_manifest(build, 3600, [BASE], "bbb222", duration=300)
+    manager = PackerBuildManager(tmp_path)
+    args = build_history_parser().parse_args([*argv, "--format", "json"])
+
+    assert run_history(manager, args) == 0
+    rows = json.loads(capsys.readouterr().out)
+    assert sorted((row["source"], row["build_version"]) for row in rows) == sorted(expected)
+    if argv[0] in ("runs", "trend"):
+        assert [row["build_version"] for row in rows] == [version for _, version in expected]
+
+
+def test_trend_skips_builds_without_a_duration(tmp_path, build, capsys):
+    write_manifest(build, 0, [BASE], "aaa111")
+    write_manifest(build, 3600, [BASE], "bbb222", duration=300)
+    manager = PackerBuildManager(tmp_path)
+
+    assert run_history(manager, build_history_parser().parse_args(["trend", "base", "--format", "json"])) == 0
+    assert [(row["build_version"], row["duration"]) for row in json.loads(capsys.readouterr().out)] == [
+        ("bbb222", 300)
+    ]
+
+
+def test_rebuild_reads_every_manifest_again(tmp_path, build, capsys):
+    write_manifest(build, 0, [BASE], "aaa111")
+    manager = PackerBuildManager(tmp_path)
+    latest = build_history_parser().parse_args(["latest", "--format", "json"])
+    run_history(manager, latest)
+    # Rows lost behind the index's back stay lost until --rebuild
+    history = BuildHistory(manager.state_dir / "history.sqlite", tmp_path)
+    with history.db:
+        history.db.execute("DELETE FROM builds")
+    history.close()
+    capsys.readouterr()
+
+    run_history(manager, latest)
+    assert json.loads(capsys.readouterr().out) == []
+    latest.rebuild = True
+    run_history(manager, latest)
+    assert [row["source"] for row in json.loads(capsys.readouterr().out)] == [BASE]
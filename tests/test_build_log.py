@@ -0,0 +1,124 @@
+"""Tests for streaming packer output into per-build compressed log files"""
+
+import gzip
+import os
+import sys
+import time
+
+import pytest
+
+import buildManager
+from buildManager import BuildLog, PackerBuild, StreamingRunner
+
+
+def test_gzip_log_rolls_over_into_parts(tmp_path):
+    log = BuildLog(tmp_path / "logs" / "run", max_bytes=20)
+    for n in range(5):
+        log.write(f"line {n} of output")
+    log.close()
+
+    # Two 18 byte lines fill a part
+    assert [p.name for p in log.paths] == ["run.log.gz", "run.1.log.gz", "run.2.log.gz"]
+    text = "".join(gzip.open(p, "rt", encoding="utf-8").read() for p in log.paths)
+    assert text == "".join(f"line {n} of output\n" for n in range(5))
+
+
+def test_parts_hold_max_bytes(tmp_path):
+    log = BuildLog(tmp_path / "run", compression="none", max_bytes=10)
+    for line in ["1234", "5678", "abcd", "ef"]:
+        log.write(line)
+    log.close()
+
+    # A part is closed once it reaches max_bytes
+    assert [p.read_text() for p in log.paths] == ["1234\n5678\n", "abcd\nef\n"]
+
+
+def test_nothing_written_creates_no_file(tmp_path):
+    log = BuildLog(tmp_path / "run")
+    log.close()
+    assert log.paths == []
+    assert not list(tmp_path.iterdir())
+
+
+def test_zstd_log(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    log = BuildLog(tmp_path / "run", compression="zstd")
+    log.write("==> proxmox-iso.base: Creating VM")
+    log.close()
+
+    [path] = log.paths
+    assert path.name == "run.log.zst"
+    with zstandard.ZstdDecompressor().stream_reader(path.open("rb")) as reader:
+        assert reader.read() == b"==> proxmox-iso.base: Creating VM\n"
+
+
+def test_open_log_keeps_the_newest_logs(tmp_path, write_build):
+    build = PackerBuild(write_build("proxmox/linux/debian/12/base", {
+        "build.pkr.hcl": 'build {\n  name = "base"\n}\n',
+    }), "proxmox", "linux")
+    runner = StreamingRunner(tmp_path / "logs", keep=3)
+    directory = tmp_path / "logs" / "base"
+    directory.mkdir(parents=True)
+    for n in range(5):
+        (directory / f"20240101-00000{n}-000-build.log.gz").write_bytes(b"")
+
+    log = runner.open_log(build, "build base/proxmox-iso.base")
+    log.write("new")
+    log.close()
+
+    # Room is made for the new log, which sorts after the old ones
+    names = sorted(p.name for p in directory.iterdir())
+    assert names[:2] == ["20240101-000003-000-build.log.gz", "20240101-000004-000-build.log.gz"]
+    assert len(names) == 3
+    assert names[2].endswith("-build_base_proxmox-iso.base.log.gz")
+
+
+def test_debug_lines_only_reach_the_log():
+    runner = StreamingRunner(None)
+    debug = "2024/01/01 12:00:00 packer-plugin-proxmox plugin: debug"
+    assert runner.visible("stdout", debug)
+    assert not runner.visible("stderr", debug)
+    assert runner.visible("stderr", "Error: boom")
+    assert StreamingRunner(None, verbose=True).visible("stderr", debug)
+
+
+def test_output_is_streamed_as_it_is_produced(tmp_path):
+    runner = StreamingRunner(tmp_path)
+    script = ("import sys, time\n"
+              "print('first', flush=True)\n"
+              "time.sleep(0.5)\n"
+              "print('error', file=sys.stderr, flush=True)\n"
+              "sys.stdout.write('x' * (2 * 1024 * 1024))\n")
+    lines = []
+
+    def on_line(stream, line, elapsed):
+        lines.append((stream, line, elapsed, time.monotonic()))
+
+    future = runner.submit([sys.executable, "-c", script], tmp_path, dict(os.environ), on_line)
+    assert future.result(timeout=10) == 0
+
+    assert [(stream, line) for stream, line, _, _ in lines[:2]] == [("stdout", "first"), ("stderr", "error")]
+    # The first line arrived while the process was still sleeping
+    assert lines[1][3] - lines[0][3] >= 0.4
+    assert lines[1][2] >= 0.5
+    # A line longer than LINE_LIMIT is passed on in pieces
+    assert len(lines) > 3
+    assert sum(len(line) for _, line, _, _ in lines[2:]) == 2 * 1024 * 1024
+
+
+def test_build_writes_a_log_per_run(tmp_path, write_build, fake_packer, monkeypatch):
+    (tmp_path / ".git").mkdir()
+    write_build("proxmox/linux/debian/12/base", {
+        "build.pkr.hcl": 'build {\n  name = "base"\n  sources = ["source.proxmox-iso.base"]\n}\n',
+        "sources.pkr.hcl": 'source "proxmox-iso" "base" {\n}\n',
+    })
+    monkeypatch.setattr(sys, "argv", [
+        "buildManager.py", "--repo-root", str(tmp_path), "--os", "debian/12/base",
+        "--log-compression", "none", "--log-keep", "1",
+    ])
+
+    for _ in range(2):
+        assert buildManager.main() == 0
+    [log] = (tmp_path / ".buildmanager" / "logs" / "base").iterdir()
+    assert log.name.endswith(".log")
+    assert "proxmox-iso.base: Creating VM" in log.read_text()
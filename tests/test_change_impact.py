@@ -0,0 +1,116 @@
+"""Tests for mapping changed files to the build sources they affect (--affected)"""
+
+import subprocess
+
+import pytest
+
+from buildManager import BuildGraph, ChangeImpact, PackerBuild
+
+SOURCES = [f"proxmox-clone.debian_12_hardened_{role}" for role in ("apache", "docker")]
+
+
+@pytest.fixture
+def builds(tmp_path, write_build):
+    shared = tmp_path / "builds" / "proxmox"
+    for name in ("ansible/hardened-apache.yml", "ansible/hardened-docker.yml", "ansible/site.yml",
+                 "scripts/common.sh", "scripts/unused.sh", "http/preseed.cfg", "http/preseed-uefi.cfg"):
+        (shared / name).parent.mkdir(parents=True, exist_ok=True)
+        (shared / name).write_text(f"# {name}\n")
+    base = write_build("proxmox/linux/debian/12/base", {
+        "build.pkr.hcl": 'build {\n  name = "debian_12_base"\n  sources = ["source.proxmox-iso.debian_12_base"]\n'
+                         '  provisioner "shell" {\n    script = "${path.root}/../../../../scripts/common.sh"\n  }\n}\n',
+        "sources.pkr.hcl": 'source "proxmox-iso" "debian_12_base" {\n  vm_id = 9000\n'
+                           '  http_directory = "${path.root}/../../../../http/${var.preseed}"\n}\n',
+    })
+    hardened = write_build("proxmox/linux/debian/12/hardened", {
+        "build.pkr.hcl": 'build {\n  name = "debian_12_hardened"\n'
+                         '  sources = ["source.proxmox-clone.debian_12_hardened_apache",\n'
+                         '             "source.proxmox-clone.debian_12_hardened_docker"]\n'
+                         '  provisioner "shell" {\n    script = "${path.root}/../../../../scripts/common.sh"\n  }\n'
+                         '  provisioner "ansible-local" {\n'
+                         '    playbook_file = "${path.root}/../../../../ansible/hardened-${split("_", source.name)[3]}.yml"\n'
+                         '  }\n}\n',
+        "sources.pkr.hcl": "".join(
+            f'source "proxmox-clone" "{s.split(".")[1]}" {{\n  clone_vm_id = 9000\n  vm_id = {9100 + n}\n}}\n'
+            for n, s in enumerate(SOURCES)
+        ),
+    })
+    return [PackerBuild(base, "proxmox", "linux"), PackerBuild(hardened, "proxmox", "linux")]
+
+
+def affected(tmp_path, builds, *changed, **kwargs):
+    """{build name: {source: reason}} for files changed under builds/proxmox"""
+    impact = ChangeImpact(tmp_path, builds, BuildGraph(builds))
+    paths = [tmp_path / "builds" / "proxmox" / name for name in changed]
+    return {build.build_name: sources for build, sources in impact.affected(paths, **kwargs).items()}
+
+
+def test_split_source_name_narrows_to_one_source(tmp_path, builds):
+    assert affected(tmp_path, builds, "ansible/hardened-apache.yml") == {
+        "debian_12_hardened": {SOURCES[0]: "builds/proxmox/ansible/hardened-apache.yml"}
+    }
+
+
+def test_unmatched_file_next_to_a_reference_affects_nothing(tmp_path, builds):
+    assert affected(tmp_path, builds, "ansible/site.yml", "scripts/unused.sh") == {}
+
+
+def test_var_interpolation_matches_any_file(tmp_path, builds):
+    # ${var.preseed} cannot be narrowed, so every file it could name counts,
+    # and only for the source block that references it
+    for name in ("http/preseed.cfg", "http/preseed-uefi.cfg"):
+        result = affected(tmp_path, builds, name)
+        assert result["debian_12_base"] == {"proxmox-iso.debian_12_base": f"builds/proxmox/{name}"}
+        # The hardened templates are clones of the base
+        assert result["debian_12_hardened"] == {s: "clones debian_12_base:proxmox-iso.debian_12_base" for s in SOURCES}
+
+
+def test_shared_script_affects_every_build_that_uses_it(tmp_path, builds):
+    result = affected(tmp_path, builds, "scripts/common.sh")
+    assert result == {
+        "debian_12_base": {"proxmox-iso.debian_12_base": "builds/proxmox/scripts/common.sh"},
+        # Changed themselves, not only as clones of the base
+        "debian_12_hardened": {s: "builds/proxmox/scripts/common.sh" for s in SOURCES},
+    }
+
+
+def test_shared_variables_file_affects_everything(tmp_path, builds):
+    variables = tmp_path / "proxmox.pkrvars.hcl"
+    variables.write_text('proxmox_host = "pve"\n')
+    impact = ChangeImpact(tmp_path, builds, BuildGraph(builds))
+
+    result = impact.affected([variables], variables_file=variables)
+    assert {b.build_name: sorted(s) for b, s in result.items()} == {
+        "debian_12_base": ["proxmox-iso.debian_12_base"], "debian_12_hardened": SOURCES
+    }
+    assert impact.affected([variables]) == {}
+
+
+def test_files_in_a_build_directory(tmp_path, builds):
+    hardened = tmp_path / "builds" / "proxmox" / "linux" / "debian" / "12" / "hardened"
+    impact = ChangeImpact(tmp_path, builds, BuildGraph(builds))
+
+    result = impact.affected([hardened / "sources.pkr.hcl"])
+    assert {b.build_name: sorted(s) for b, s in result.items()} == {"debian_12_hardened": SOURCES}
+    # Manifests are build output, not input
+    assert impact.affected([hardened / "manifests" / "run.json"]) == {}
+
+
+def test_changed_files_include_untracked_ones(tmp_path, builds):
+    def git(*args):
+        subprocess.run(["git", "-c", "user.name=t", "-c", "user.email=t@example.com", *args],
+                       cwd=tmp_path, check=True, capture_output=True)
+    git("init", "-q")
+    git("add", "builds")
+    git("commit", "-q", "-m", "builds")
+    ansible = tmp_path / "builds" / "proxmox" / "ansible"
+    (ansible / "hardened-docker.yml").write_text("# changed\n")
+    (ansible / "hardened-mysql.yml").write_text("# new\n")
+
+    impact = ChangeImpact(tmp_path, builds, BuildGraph(builds))
+    changed = impact.changed_files("HEAD")
+    assert [p.relative_to(tmp_path.resolve()).as_posix() for p in changed] == [
+        "builds/proxmox/ansible/hardened-docker.yml", "builds/proxmox/ansible/hardened-mysql.yml"
+    ]
+    with pytest.raises(RuntimeError):
+        impact.changed_files("no-such-ref")
@@ -0,0 +1,124 @@
+"""Tests for build duration estimates from the history index and the --order policies"""
+
+import pytest
+
+from buildManager import ORDER_POLICIES, BuildHistory, BuildTask, DurationEstimator, PackerBuild
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = BuildHistory(tmp_path / ".buildmanager" / "history.sqlite", tmp_path)
+    yield history
+    history.close()
+
+
+@pytest.fixture
+def make_task(write_build):
+    """A task of a new build directory with the given sources"""
+    def make(name: str, *sources: str) -> BuildTask:
+        refs = ", ".join(f'"source.{s}"' for s in sources)
+        path = write_build(f"proxmox/linux/{name}", {
+            "build.pkr.hcl": f'build {{\n  name = "{name}"\n  sources = [{refs}]\n}}\n',
+            "sources.pkr.hcl": "".join(f'source "{s.split(".")[0]}" "{s.split(".")[1]}" {{\n}}\n' for s in sources),
+        })
+        return BuildTask(PackerBuild(path, "proxmox", "linux"))
+    return make
+
+
+def seed(history, name, source, *durations):
+    """Record builds of a source, oldest first, as if ingested from manifests"""
+    with history.db:
+        for n, duration in enumerate(durations):
+            history.db.execute(
+                "INSERT INTO builds (manifest, build_dir, build_name, source, started, duration) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (f"builds/proxmox/linux/{name}/manifests/{n}.json", f"builds/proxmox/linux/{name}",
+                 name, source, 1_700_000_000 + n * 3600, duration)
+            )
+
+
+def order(policy, tasks, estimator):
+    key = ORDER_POLICIES[policy]
+    return [task.build.build_name for task in sorted(tasks, key=lambda task: key(task, estimator))]
+
+
+def test_median_of_the_latest_samples(tmp_path, history, make_task):
+    task = make_task("odd", "proxmox-iso.base")
+    even = make_task("even", "proxmox-iso.base")
+    # The two oldest builds fall out of the last five
+    seed(history, "odd", "proxmox-iso.base", 900, 900, 100, 300, 200, 500, 400)
+    seed(history, "even", "proxmox-iso.base", 100, 400)
+
+    estimator = DurationEstimator(history, tmp_path)
+    estimator.plan([task, even])
+    assert estimator.estimate(task) == 300
+    assert estimator.estimate(even) == 250
+
+
+def test_sources_share_packers_lanes(tmp_path, history, make_task):
+    task = make_task("roles", "proxmox-clone.apache", "proxmox-clone.docker", "proxmox-clone.mysql")
+    seed(history, "roles", "proxmox-clone.apache", 100)
+    seed(history, "roles", "proxmox-clone.docker", 60)
+    estimator = DurationEstimator(history, tmp_path)
+
+    # mysql never built and counts as the mean of its siblings, 80
+    for parallel, expected in [(None, 100), (1, 240), (2, 140)]:
+        estimator.plan([task], parallel)
+        assert estimator.estimate(task) == expected
+
+
+def test_no_history_falls_back_to_command_line_order(tmp_path, history, make_task):
+    tasks = [make_task(name, "proxmox-iso.base") for name in ("a", "b", "c")]
+    tasks[2].dependencies = [tasks[0]]
+
+    for estimator in (DurationEstimator(), DurationEstimator(history, tmp_path)):
+        estimator.plan(tasks)
+        assert [estimator.estimate(task) for task in tasks] == [None] * 3
+        assert estimator.expected(tasks[0]) == 0.0
+        assert estimator.batch_remaining([], tasks, 2) == 0.0
+        for policy in ORDER_POLICIES:
+            assert order(policy, tasks, estimator) == ["a", "b", "c"]
+
+
+@pytest.fixture
+def planned(tmp_path, history, make_task):
+    """long (300s), short (100s), unknown (no history) and slow-clone (500s), a clone of short"""
+    tasks = {name: make_task(name, "proxmox-iso.base") for name in ("long", "short", "unknown", "slow-clone")}
+    tasks["slow-clone"].dependencies = [tasks["short"]]
+    for name, duration in [("long", 300), ("short", 100), ("slow-clone", 500)]:
+        seed(history, name, "proxmox-iso.base", duration)
+    estimator = DurationEstimator(history, tmp_path)
+    estimator.plan(list(tasks.values()))
+    return list(tasks.values()), estimator
+
+
+def test_builds_without_history_count_as_average(planned):
+    tasks, estimator = planned
+    unknown = tasks[2]
+    assert estimator.estimate(unknown) is None
+    assert estimator.expected(unknown) == 300
+    assert estimator.critical[tasks[1]] == 600
+
+
+@pytest.mark.parametrize("policy, expected", [
+    ("fifo", ["long", "short", "unknown", "slow-clone"]),
+    ("longest", ["slow-clone", "long", "unknown", "short"]),
+    ("shortest", ["short", "long", "unknown", "slow-clone"]),
+    # short starts the 600s chain through its clone
+    ("critical-path", ["short", "slow-clone", "long", "unknown"]),
+])
+def test_order_policies(planned, policy, expected):
+    tasks, estimator = planned
+    assert order(policy, tasks, estimator) == expected
+
+
+def test_batch_remaining_waits_for_dependencies(planned):
+    tasks, estimator = planned
+    long, short, unknown, clone = tasks
+
+    # Two workers: long | short, then its clone (600s); unknown after long
+    assert estimator.batch_remaining([], [long, short, clone, unknown], 2) == 600
+    assert estimator.batch_remaining([], [long, short, clone, unknown], 1) == 1200
+    # A running build has used up part of its estimate
+    short.started, short.finished = 1000.0, 1040.0
+    assert estimator.batch_remaining([short], [clone], 1) == 560
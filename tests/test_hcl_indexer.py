@@ -0,0 +1,117 @@
+"""Tests for the single-pass HCL tokenizer and parser"""
+
+from buildManager import HclIndexer
+
+
+def test_parse_nested_blocks():
+    root = HclIndexer().parse('''
+source "proxmox-iso" "debian_12_base" {
+  vm_id = 9000
+  disks {
+    disk_size = "32G"
+    type      = "scsi"
+  }
+  network_adapters {
+    bridge = "vmbr0"
+  }
+}
+''')
+    (source,) = root.blocks
+    assert source.type == "source"
+    assert source.labels == ["proxmox-iso", "debian_12_base"]
+    assert source.attributes == {"vm_id": "9000"}
+    assert [(b.type, b.attributes) for b in source.blocks] == [
+        ("disks", {"disk_size": '"32G"', "type": '"scsi"'}),
+        ("network_adapters", {"bridge": '"vmbr0"'}),
+    ]
+
+
+def test_parse_heredoc_keeps_braces_and_quotes_out_of_the_structure():
+    root = HclIndexer().parse('''
+locals {
+  script = <<-EOF
+    if [ "$x" ]; then { echo "}" ; }
+    EOF
+  after = var.node
+}
+''')
+    (block,) = root.blocks
+    assert block.type == "locals"
+    assert block.attributes["after"] == "var.node"
+    assert "echo" in block.attributes["script"]
+
+
+def test_parse_interpolation_with_nested_quotes():
+    content = '''
+build {
+  name = "hardened"
+  provisioner "ansible" {
+    playbook_file = "../../ansible/hardened-${split("_", source.name)[3]}.yml"
+  }
+}
+'''
+    (build,) = HclIndexer().parse(content).blocks
+    (provisioner,) = build.blocks
+    assert provisioner.labels == ["ansible"]
+    assert provisioner.attributes["playbook_file"] == \
+        '"../../ansible/hardened-${split("_", source.name)[3]}.yml"'
+
+
+def test_parse_skips_comments_and_multiline_expressions():
+    (variable,) = HclIndexer().parse('''
+# comment "with" { braces
+variable "tags" {
+  // another comment
+  default = [
+    "a", /* inline } */ "b",
+  ]
+}
+''').blocks
+    assert variable.labels == ["tags"]
+    assert variable.attributes["default"].replace(" ", "").replace("\n", "").startswith('["a",')
+    assert variable.blocks == []
+
+
+def test_index_directory(write_build):
+    path = write_build("proxmox/linux/debian/12/base", {
+        "build.pkr.hcl": '''
+packer {
+  required_plugins {
+    proxmox = {
+      version = ">= 1.1.8"
+      source  = "github.com/hashicorp/proxmox"
+    }
+  }
+}
+build {
+  name    = "debian-12-base"
+  sources = ["source.proxmox-iso.debian_12_base"]
+}
+''',
+        "sources.pkr.hcl": '''
+source "proxmox-iso" "debian_12_base" {
+  vm_id   = var.vm_id
+  node    = var.node
+  http_directory = "${path.root}/http"
+}
+''',
+        "variables.pkr.hcl": '''
+variable "vm_id" {
+  type    = number
+  default = 9000
+}
+variable "node" {
+  type = string
+}
+''',
+    })
+    index = HclIndexer().index_directory(path)
+    assert index["build_name"] == "debian-12-base"
+    assert index["sources"] == ["proxmox-iso.debian_12_base"]
+    assert index["builds"][0]["sources"] == ["proxmox-iso.debian_12_base"]
+    assert index["variable_defaults"] == {"vm_id": "9000"}
+    assert index["required_plugins"]["proxmox"] == {
+        "source": "github.com/hashicorp/proxmox", "version": ">= 1.1.8"
+    }
+    assert index["file_refs"] == ["${path.root}/http"]
+    assert index["source_refs"]["proxmox-iso.debian_12_base"] == ["${path.root}/http"]
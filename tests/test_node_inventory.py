@@ -0,0 +1,141 @@
+"""Tests for admitting builds by Proxmox node capacity (--node-inventory)"""
+
+import json
+import sys
+
+import pytest
+
+import buildManager
+from buildManager import NodeInventory, PackerBuild
+
+NODES = {"pve1": {"cores": 8, "memory": 16384}, "pve2": {"cores": 4, "memory": 8192}}
+
+
+def source_build(write_build, name, settings, variables=""):
+    """A build directory with one proxmox-iso source"""
+    body = "".join(f"  {key} = {value}\n" for key, value in settings.items())
+    path = write_build(f"proxmox/linux/debian/12/{name}", {
+        "build.pkr.hcl": f'build {{\n  name = "{name}"\n  sources = ["source.proxmox-iso.{name}"]\n}}\n',
+        "sources.pkr.hcl": f'source "proxmox-iso" "{name}" {{\n{body}}}\n',
+        "variables.pkr.hcl": variables,
+    })
+    return PackerBuild(path, "proxmox", "linux")
+
+
+def test_load_toml_and_yaml(tmp_path):
+    toml = tmp_path / "nodes.toml"
+    toml.write_text('default_node = "pve2"\n[nodes.pve1]\ncores = 8\nmemory = 16384\n'
+                    '[nodes.pve2]\ncores = 4\nmemory = 8192\n')
+    if buildManager.tomllib:
+        inventory = NodeInventory.load(toml)
+        assert (inventory.nodes, inventory.default_node) == (NODES, "pve2")
+
+    pytest.importorskip("yaml")
+    yaml = tmp_path / "nodes.yaml"
+    yaml.write_text("nodes:\n  pve1:\n    cores: 8\n    memory: 16384\n")
+    inventory = NodeInventory.load(yaml)
+    # A single node is the default
+    assert (inventory.nodes, inventory.default_node) == ({"pve1": NODES["pve1"]}, "pve1")
+
+
+@pytest.mark.parametrize("text, error", [
+    ("nodes: {}\n", "No nodes defined"),
+    ("nodes:\n  pve1:\n    cores: 8\n", "needs integer cores and memory"),
+    ("nodes:\n  pve1:\n    cores: many\n    memory: 1024\n", "needs integer cores and memory"),
+])
+def test_invalid_inventory(tmp_path, text, error):
+    pytest.importorskip("yaml")
+    path = tmp_path / "nodes.yml"
+    path.write_text(text)
+    with pytest.raises(RuntimeError, match=error):
+        NodeInventory.load(path)
+
+
+def test_node_for_follows_variables(tmp_path, write_build):
+    build = source_build(write_build, "base", {"node": "var.node"},
+                         'variable "node" {\n  default = "pve1"\n}\n')
+    inventory = NodeInventory(NODES)
+    sources = build.sources
+
+    assert inventory.node_for(build, sources, None) == "pve1"
+    variables = tmp_path / "pve2.pkrvars.hcl"
+    variables.write_text('node = "pve2"\n')
+    assert inventory.node_for(build, sources, variables) == "pve2"
+    # -var wins over the variables file
+    assert inventory.node_for(build, sources, variables, ["-var", "node=pve1"]) == "pve1"
+    assert inventory.node_for(build, sources, variables, ["-var=node=pve1"]) == "pve1"
+
+
+def test_build_with_no_matching_node(write_build):
+    literal = source_build(write_build, "literal", {"node": '"pve9"'})
+    unset = source_build(write_build, "unset", {})
+
+    # With several nodes and no default a build is not admitted by capacity
+    assert NodeInventory(NODES).node_for(literal, literal.sources, None) is None
+    assert NodeInventory(NODES).node_for(unset, unset.sources, None) is None
+    assert NodeInventory(NODES, "pve2").node_for(literal, literal.sources, None) == "pve2"
+
+
+def test_demand(write_build):
+    sized = source_build(write_build, "sized", {"cores": 2, "sockets": 2, "memory": 4096})
+    defaults = source_build(write_build, "defaults", {})
+
+    assert NodeInventory.demand(sized, sized.sources) == (4, 4096)
+    assert NodeInventory.demand(defaults, defaults.sources) == (1, 512)
+
+
+def test_fits_until_the_node_is_full():
+    inventory = NodeInventory(NODES)
+
+    assert inventory.fits("pve2", (3, 4096))
+    inventory.reserve("pve2", (3, 4096))
+    # Over-subscribing cores or memory waits
+    assert not inventory.fits("pve2", (2, 1024))
+    assert not inventory.fits("pve2", (1, 8192))
+    assert inventory.fits("pve2", (1, 4096))
+    # Other nodes are unaffected
+    assert inventory.fits("pve1", (8, 16384))
+
+    inventory.release("pve2", (3, 4096))
+    assert inventory.used["pve2"] == [0, 0]
+    assert inventory.peak["pve2"] == [3, 4096]
+
+
+def test_oversized_build_runs_on_an_idle_node():
+    inventory = NodeInventory(NODES)
+
+    assert inventory.fits("pve2", (16, 65536))
+    inventory.reserve("pve2", (16, 65536))
+    assert not inventory.fits("pve2", (1, 512))
+
+
+@pytest.mark.parametrize("cores, serial", [(4, True), (8, False)])
+def test_admission_and_leases(tmp_path, write_build, fake_packer, monkeypatch, capsys, cores, serial):
+    """Builds that do not fit next to each other wait for the node before leasing a VM ID"""
+    pytest.importorskip("yaml")
+    for name in ("alpha", "beta"):
+        source_build(write_build, name, {"vm_id": "var.vm_id", "cores": 4, "memory": 2048},
+                     'variable "vm_id" {\n  default = 9000\n}\n')
+    (tmp_path / ".git").mkdir()
+    inventory = tmp_path / "nodes.yml"
+    inventory.write_text(f"nodes:\n  pve1:\n    cores: {cores}\n    memory: 16384\n")
+    monkeypatch.setenv("FAKE_PACKER_STEP_SECONDS", "0.05")
+    monkeypatch.setattr(sys, "argv", [
+        "buildManager.py", "--repo-root", str(tmp_path), "--os", "debian/12/alpha", "--os", "debian/12/beta",
+        "--parallel", "2", "--node-inventory", str(inventory),
+        "--vm-id-pool", "9100-9101", "--lease-dir", str(tmp_path / "leases"),
+    ])
+
+    assert buildManager.main() == 0
+    stats = [json.loads(line) for line in (tmp_path / "stats.jsonl").read_text().splitlines()]
+    first, second = sorted((s for s in stats if s["command"] == "build"), key=lambda s: s["start"])
+    ids = [[a for a in s["args"] if a.startswith("vm_id=")] for s in (first, second)]
+    if serial:
+        # beta waited for alpha's cores, by then its lease was free again
+        assert second["start"] >= first["end"]
+        assert ids == [["vm_id=9100"], ["vm_id=9100"]]
+    else:
+        assert second["start"] < first["end"]
+        assert sorted(ids) == [["vm_id=9100"], ["vm_id=9101"]]
+    assert f"peak {4 if serial else 8}/{cores}" in capsys.readouterr().out
+    assert not list((tmp_path / "leases").glob("*.json"))
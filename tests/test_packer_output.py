@@ -0,0 +1,108 @@
+"""
+Tests for how buildManager.py runs packer: re-rendering -machine-readable
+output and stopping a run with the watchdog
+"""
+
+import os
+import signal
+import sys
+import time
+
+import pytest
+
+import buildManager
+from buildManager import PackerBuildManager, StepTimer, Watchdog
+
+
+def record(target, *fields):
+    return ",".join(["1700000000", target, *fields])
+
+
+def test_ui_records_are_rendered_like_the_normal_ui():
+    timer = StepTimer(None, ["proxmox-iso.base"])
+
+    assert timer.feed(record("", "ui", "say", "==> proxmox-iso.base: Creating VM"), 1.0) == [
+        ("say", "==> proxmox-iso.base: Creating VM")
+    ]
+    assert timer.feed(record("proxmox-iso.base", "ui", "message", "    a%!(PACKER_COMMA) b\\nc"), 2.0) == [
+        ("message", "    a, b"), ("message", "c")
+    ]
+    assert timer.feed(record("proxmox-iso.base", "artifact", "0", "id", "9000"), 3.0) == []
+    assert timer.feed("not a record", 4.0) == [("", "not a record")]
+
+
+def test_errors_go_back_to_stderr_in_red():
+    timer = StepTimer(None, ["proxmox-iso.base"])
+    [(kind, text)] = timer.feed(record("", "ui", "error", "Build 'proxmox-iso.base' errored"), 1.0)
+
+    assert StepTimer.stream(kind, "stdout") == "stderr"
+    assert StepTimer.style(kind, text) == f"{buildManager.Colors.FAIL}{text}{buildManager.Colors.ENDC}"
+    assert StepTimer.stream("message", "stdout") == "stdout"
+    assert StepTimer.style("message", "plain") == "plain"
+    assert timer.results == {"proxmox-iso.base": "failed"}
+
+
+def test_steps_become_spans():
+    timer = StepTimer(None, ["proxmox-iso.base"])
+    timer.feed(record("", "ui", "say", "==> proxmox-iso.base: Creating VM"), 1.0)
+    timer.feed(record("", "ui", "say", "==> proxmox-iso.base: Waiting for WinRM to become available..."), 5.0)
+    timer.feed(record("", "ui", "say", "Build 'proxmox-iso.base' finished after 1 minute."), 65.0)
+
+    spans = timer.spans["proxmox-iso.base"]
+    assert [(s["category"], s["duration"]) for s in spans] == [("create_vm", 4.0), ("communicator", 60.0)]
+    assert timer.results == {"proxmox-iso.base": "succeeded"}
+
+
+FAKE_PACKER = '''#!{python}
+import subprocess, sys, time
+# A stand-in for a plugin process that packer starts
+child = subprocess.Popen([{python!r}, "-c", "import time; time.sleep(60)"])
+open({pidfile!r}, "w").write(str(child.pid))
+print("1700000000,,ui,say,==> proxmox-iso.base: Creating VM", flush=True)
+time.sleep(60)
+'''
+
+
+@pytest.mark.skipif(os.name == "nt", reason="process groups are POSIX only")
+def test_watchdog_stops_the_whole_process_group(tmp_path, write_build, monkeypatch):
+    build_path = write_build("proxmox/linux/test/base", {
+        "build.pkr.hcl": 'build {\n  name = "test"\n  sources = ["source.proxmox-iso.base"]\n}\n',
+        "sources.pkr.hcl": 'source "proxmox-iso" "base" {\n  vm_id = 100\n}\n',
+    })
+    pidfile = tmp_path / "plugin.pid"
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    packer = bin_dir / "packer"
+    packer.write_text(FAKE_PACKER.format(python=sys.executable, pidfile=str(pidfile)))
+    packer.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(Watchdog, "POLL", 0.1)
+    monkeypatch.setattr(Watchdog, "GRACE", 0.5)
+
+    manager = PackerBuildManager(tmp_path)
+    manager.idle_timeouts = {"": 1.0}
+    [build] = manager.builds
+    assert build.path == build_path
+
+    started = time.monotonic()
+    source_status = {}
+    returncode = manager.run_packer_command(build, "build", source_status=source_status)
+
+    assert returncode != 0
+    assert source_status == {"proxmox-iso.base": "timed-out"}
+    assert time.monotonic() - started < 30
+    plugin = int(pidfile.read_text())
+    for _ in range(50):
+        try:
+            os.kill(plugin, 0)
+        except ProcessLookupError:
+            break
+        # Reap the plugin if it became a zombie child of this process
+        try:
+            os.waitpid(plugin, os.WNOHANG)
+        except ChildProcessError:
+            pass
+        time.sleep(0.1)
+    else:
+        os.kill(plugin, signal.SIGKILL)
+        pytest.fail("the plugin process outlived the watchdog")
@@ -0,0 +1,78 @@
+"""Tests for the command line value parsers"""
+
+import pytest
+
+from buildManager import (
+    VmIdAllocator,
+    matrix_variants,
+    parse_duration,
+    parse_provider_limits,
+    parse_timeouts,
+)
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("90", 90), ("90s", 90), ("45m", 2700), ("3h", 10800), ("1h30m", 5400), (" 2H5M10S ", 7510),
+])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == seconds
+
+
+@pytest.mark.parametrize("value", ["", "m", "1d", "-5", "1.5h", "30m1h"])
+def test_parse_duration_rejects(value):
+    with pytest.raises(ValueError, match="Invalid duration"):
+        parse_duration(value)
+
+
+def test_parse_timeouts():
+    assert parse_timeouts(None) == {}
+    assert parse_timeouts(["3h", "windows-*=6h", "debian-12 = 45m"]) == {
+        "": 10800.0, "windows-*": 21600.0, "debian-12": 2700.0
+    }
+    # The last value of a selector wins
+    assert parse_timeouts(["1h", "2h"]) == {"": 7200.0}
+
+
+def test_parse_timeouts_rejects_bad_durations():
+    with pytest.raises(ValueError):
+        parse_timeouts(["windows-*=soon"])
+
+
+def test_parse_provider_limits():
+    assert parse_provider_limits(None) == {}
+    assert parse_provider_limits(["proxmox=2", " aws =4"]) == {"proxmox": 2, "aws": 4}
+
+
+@pytest.mark.parametrize("value", ["proxmox", "proxmox=0", "proxmox=two", "proxmox=-1"])
+def test_parse_provider_limits_rejects(value):
+    with pytest.raises(ValueError, match="Invalid provider limit"):
+        parse_provider_limits([value])
+
+
+def test_parse_pool():
+    assert VmIdAllocator.parse_pool("9100-9102") == range(9100, 9103)
+    for value in ("9100", "9102-9100", "a-b", "9100-"):
+        with pytest.raises(ValueError, match="Invalid VM ID pool"):
+            VmIdAllocator.parse_pool(value)
+
+
+def test_matrix_variants(tmp_path):
+    small = tmp_path / "small.auto.pkrvars.hcl"
+    large = tmp_path / "large.pkrvars.hcl"
+    small.write_text("")
+    large.write_text("")
+    variants = matrix_variants([small, large], ["node=pve1,pve2"])
+    assert [(name, path, args) for name, path, args in variants] == [
+        ("small+pve1", small.resolve(), ["-var", "node=pve1"]),
+        ("small+pve2", small.resolve(), ["-var", "node=pve2"]),
+        ("large+pve1", large.resolve(), ["-var", "node=pve1"]),
+        ("large+pve2", large.resolve(), ["-var", "node=pve2"]),
+    ]
+    assert matrix_variants(None, None) == []
+
+
+def test_matrix_variants_rejects(tmp_path):
+    with pytest.raises(ValueError, match="not found"):
+        matrix_variants([tmp_path / "missing.pkrvars.hcl"], None)
+    with pytest.raises(ValueError, match="Invalid matrix variable"):
+        matrix_variants(None, ["node="])
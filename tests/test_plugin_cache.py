@@ -0,0 +1,92 @@
+"""Tests for the shared plugin cache and running packer init once per plugin set"""
+
+import json
+
+import pytest
+
+from buildManager import PackerBuildManager, PluginCache
+
+PROXMOX = ("proxmox", "github.com/hashicorp/proxmox", ">= 1.1.3")
+ANSIBLE = ("ansible", "github.com/hashicorp/ansible", "~> 1")
+
+
+def packer_block(*plugins):
+    body = "".join(f'    {name} = {{\n      version = "{version}"\n      source  = "{source}"\n    }}\n'
+                   for name, source, version in plugins)
+    return f"packer {{\n  required_plugins {{\n{body}  }}\n}}\n"
+
+
+@pytest.fixture
+def manager(tmp_path, write_build, fake_packer, monkeypatch):
+    """Two builds that share a plugin set, one with another set and one without plugins"""
+    monkeypatch.delenv("PACKER_PLUGIN_PATH", raising=False)
+    (tmp_path / ".git").mkdir()
+    for name, plugins in [("alpha", (PROXMOX,)), ("beta", (PROXMOX,)),
+                          ("roles", (ANSIBLE, PROXMOX)), ("plain", ())]:
+        write_build(f"proxmox/linux/debian/12/{name}", {
+            "build.pkr.hcl": packer_block(*plugins) if plugins else "",
+        })
+    return PackerBuildManager(tmp_path)
+
+
+def inits(tmp_path):
+    """Directories packer init ran in so far"""
+    stats = tmp_path / "stats.jsonl"
+    lines = stats.read_text().splitlines() if stats.exists() else []
+    records = [json.loads(line) for line in lines]
+    return sorted(r["cwd"].rsplit("/", 1)[1] for r in records if r["command"] == "init")
+
+
+def test_plugin_set_ignores_declaration_order(manager):
+    builds = {build.build_name: build for build in manager.builds}
+    assert PluginCache.plugin_set(builds["roles"]) == [ANSIBLE, PROXMOX]
+    assert PluginCache.key(PluginCache.plugin_set(builds["alpha"])) == \
+        PluginCache.key(PluginCache.plugin_set(builds["beta"]))
+    assert PluginCache.plugin_set(builds["plain"]) == []
+
+
+def test_one_init_per_plugin_set(tmp_path, manager, capsys):
+    assert manager.init_builds(manager.builds) == 0
+
+    # alpha initializes the set it shares with beta
+    assert inits(tmp_path) == ["alpha", "roles"]
+    assert manager.plugins.path == tmp_path / ".buildmanager" / "plugins"
+    assert (manager.plugins.path / PROXMOX[1]).is_dir()
+    assert "2 init(s) for 2 plugin set(s) across 3 build(s)" in capsys.readouterr().out
+    state = json.loads((tmp_path / ".buildmanager" / "plugins.json").read_text())
+    assert len(state["sets"]) == 2
+
+
+def test_current_sets_are_skipped(tmp_path, manager, capsys):
+    manager.init_builds(manager.builds)
+    capsys.readouterr()
+
+    # A new manager reads the recorded sets back
+    again = PackerBuildManager(tmp_path)
+    assert again.init_builds(again.builds) == 0
+    assert inits(tmp_path) == ["alpha", "roles"]
+    out = capsys.readouterr().out
+    assert "0 init(s) for 2 plugin set(s)" in out
+    # alpha and beta would each have installed 64 KiB, roles 128 KiB
+    assert "256.0 KiB" in out
+
+
+def test_changed_or_missing_plugins_are_initialized_again(tmp_path, manager, write_build):
+    manager.init_builds(manager.builds)
+
+    # A version bump is a new set
+    write_build("proxmox/linux/debian/12/beta", {
+        "build.pkr.hcl": packer_block((PROXMOX[0], PROXMOX[1], ">= 1.2.0")),
+    })
+    manager.init_builds(PackerBuildManager(tmp_path).builds)
+    assert inits(tmp_path) == ["alpha", "beta", "roles"]
+
+    # A deleted binary makes every set that uses it stale
+    for binary in (manager.plugins.path / ANSIBLE[1]).iterdir():
+        binary.unlink()
+    manager.init_builds(PackerBuildManager(tmp_path).builds)
+    assert inits(tmp_path) == ["alpha", "beta", "roles", "roles"]
+
+    # -upgrade initializes every set
+    manager.init_builds(PackerBuildManager(tmp_path).builds, force=True)
+    assert len(inits(tmp_path)) == 7
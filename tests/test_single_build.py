@@ -0,0 +1,98 @@
+"""
+Tests for a single build without --parallel, run against the fake packer
+from scripts/benchmarks
+"""
+
+import json
+import sys
+
+import pytest
+
+import buildManager
+
+SOURCES = ["proxmox-clone.apache", "proxmox-clone.docker"]
+
+
+@pytest.fixture
+def repo(tmp_path, write_build, fake_packer):
+    """A repository with one two-source build"""
+    (tmp_path / ".git").mkdir()
+    write_build("proxmox/linux/debian/12/hardened", {
+        "build.pkr.hcl": 'build {\n  name = "debian_12_hardened"\n'
+                         '  sources = ["source.proxmox-clone.apache", "source.proxmox-clone.docker"]\n}\n',
+        "sources.pkr.hcl": "".join(
+            f'source "proxmox-clone" "{name}" {{\n  vm_id = {9001 + n}\n}}\n'
+            for n, name in enumerate(["apache", "docker"])
+        ),
+    })
+    return tmp_path
+
+
+@pytest.fixture
+def executor_runs(monkeypatch):
+    """Task lists handed to the parallel executor"""
+    runs = []
+    monkeypatch.setattr(buildManager, "run_parallel", lambda manager, tasks, args, **kw: runs.append(tasks) or 0)
+    return runs
+
+
+def run(repo, monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["buildManager.py", "--repo-root", str(repo), *argv])
+    return buildManager.main()
+
+
+def packer_builds(repo):
+    stats = [json.loads(line) for line in (repo / "stats.jsonl").read_text().splitlines()]
+    return [s for s in stats if s["command"] == "build"]
+
+
+def test_multi_source_build_runs_packer_directly(repo, monkeypatch, executor_runs):
+    assert run(repo, monkeypatch, "--os", "debian/12/hardened") == 0
+
+    assert executor_runs == []
+    assert len(packer_builds(repo)) == 1
+    [state] = (repo / ".buildmanager" / "runs").glob("*.json")
+    builds = json.loads(state.read_text())["builds"]
+    assert builds == {"builds/proxmox/linux/debian/12/hardened": {s: "succeeded" for s in SOURCES}}
+
+
+def test_failed_sources_are_recorded_for_resume(repo, monkeypatch, executor_runs):
+    monkeypatch.setenv("FAKE_PACKER_FAIL_RATE", "1")
+
+    assert run(repo, monkeypatch, "--os", "debian/12/hardened") != 0
+    assert executor_runs == []
+    [state] = (repo / ".buildmanager" / "runs").glob("*.json")
+    builds = json.loads(state.read_text())["builds"]
+    assert builds == {"builds/proxmox/linux/debian/12/hardened": {s: "failed" for s in SOURCES}}
+
+    assert run(repo, monkeypatch, "--resume", "last") == 0
+    [tasks] = executor_runs
+    assert [task.selected_sources for task in tasks] == [SOURCES]
+
+
+@pytest.mark.parametrize("extra, expected", [
+    (["--on-error", "abort"], "-on-error=abort"),
+    # Packer arguments after -- win over --on-error
+    (["--on-error", "abort", "--", "-on-error=cleanup"], "-on-error=cleanup"),
+])
+def test_on_error_reaches_packer(repo, monkeypatch, executor_runs, extra, expected):
+    assert run(repo, monkeypatch, "--os", "debian/12/hardened", *extra) == 0
+
+    assert executor_runs == []
+    [build] = packer_builds(repo)
+    assert [arg for arg in build["args"] if "on-error" in arg] == [expected]
+
+
+def test_node_inventory_uses_the_executor(repo, monkeypatch, executor_runs, tmp_path):
+    inventory = tmp_path / "nodes.json"
+    inventory.write_text("[]")
+
+    assert run(repo, monkeypatch, "--os", "debian/12/hardened", "--node-inventory", str(inventory)) == 0
+    assert len(executor_runs) == 1
+
+
+def test_parallel_still_uses_the_executor(repo, monkeypatch, executor_runs):
+    assert run(repo, monkeypatch, "--os", "debian/12/hardened", "--parallel", "2") == 0
+
+    assert len(executor_runs) == 1
+    assert not (repo / "stats.jsonl").exists() or packer_builds(repo) == []
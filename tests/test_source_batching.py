@@ -0,0 +1,78 @@
+"""Tests for running every selected source of a build directory in one packer process"""
+
+import json
+import sys
+
+import pytest
+
+import buildManager
+from buildManager import SourceOutputSplitter
+
+SOURCES = ["proxmox-clone.apache", "proxmox-clone.apache_php", "proxmox-clone.docker"]
+
+
+@pytest.mark.parametrize("line, source", [
+    ("==> debian_12_hardened.proxmox-clone.apache: Cloning VM", "proxmox-clone.apache"),
+    ("    proxmox-clone.docker: Starting VM", "proxmox-clone.docker"),
+    # The longest name wins over a prefix of it
+    ("==> debian_12_hardened.proxmox-clone.apache_php: Provisioning", "proxmox-clone.apache_php"),
+    ("Build 'debian_12_hardened.proxmox-clone.apache_php' finished after 2 minutes", "proxmox-clone.apache_php"),
+    ("==> Wait completed after 3 minutes", None),
+    ("proxmox-clone.apache2: not a selected source", None),
+])
+def test_lines_are_attributed_to_their_source(line, source):
+    assert SourceOutputSplitter(SOURCES).feed(line) == source
+
+
+def test_results_come_from_build_lines_then_the_exit_code():
+    splitter = SourceOutputSplitter(SOURCES)
+    splitter.feed("Build 'debian_12_hardened.proxmox-clone.apache' finished after 1 minute")
+    splitter.feed("Build 'proxmox-clone.docker' errored after 10 seconds: timeout")
+    splitter.feed("Build 'other.proxmox-clone.mysql' finished after 1 minute")
+
+    assert splitter.results(1) == {
+        "proxmox-clone.apache": "succeeded",
+        "proxmox-clone.apache_php": "failed",
+        "proxmox-clone.docker": "failed",
+    }
+    assert splitter.results(130, interrupted=True)["proxmox-clone.apache_php"] == "interrupted"
+    assert SourceOutputSplitter(SOURCES).results(0) == {s: "succeeded" for s in SOURCES}
+
+
+def test_no_sources():
+    splitter = SourceOutputSplitter([])
+    assert splitter.feed("==> proxmox-clone.apache: Cloning VM") is None
+    assert splitter.results(0) == {}
+
+
+def test_selected_sources_share_one_packer_run(tmp_path, write_build, fake_packer, monkeypatch, capsys):
+    (tmp_path / ".git").mkdir()
+    write_build("proxmox/linux/debian/12/hardened", {
+        "build.pkr.hcl": 'build {\n  name = "debian_12_hardened"\n'
+                         '  sources = ["source.proxmox-clone.apache", "source.proxmox-clone.apache_php",'
+                         ' "source.proxmox-clone.docker"]\n}\n',
+        "sources.pkr.hcl": "".join(
+            f'source "proxmox-clone" "{s.split(".")[1]}" {{\n  vm_id = {9001 + n}\n}}\n'
+            for n, s in enumerate(SOURCES)
+        ),
+    })
+    monkeypatch.setattr(sys, "argv", [
+        "buildManager.py", "--repo-root", str(tmp_path), "--parallel", "2",
+        "--source", "proxmox-clone.apache", "--source", "proxmox-clone.docker",
+    ])
+
+    assert buildManager.main() == 0
+    stats = [json.loads(line) for line in (tmp_path / "stats.jsonl").read_text().splitlines()]
+    [build] = [s for s in stats if s["command"] == "build"]
+    only = build["args"][build["args"].index("-only") + 1]
+    assert only == "proxmox-clone.apache,proxmox-clone.docker"
+    # Output is labelled per source
+    out = capsys.readouterr().out
+    assert "debian_12_hardened:proxmox-clone.apache]" in out
+    assert "debian_12_hardened:proxmox-clone.docker]" in out
+    [state] = (tmp_path / ".buildmanager" / "runs").glob("*.json")
+    assert json.loads(state.read_text())["builds"] == {
+        "builds/proxmox/linux/debian/12/hardened": {
+            "proxmox-clone.apache": "succeeded", "proxmox-clone.docker": "succeeded"
+        }
+    }
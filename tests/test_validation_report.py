@@ -0,0 +1,88 @@
+"""Tests for validating every build concurrently (--validate-all) and its report"""
+
+import json
+import sys
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import buildManager
+from buildManager import BuildTask, PackerBuild, write_validation_report
+
+
+@pytest.fixture
+def tasks(tmp_path, write_build):
+    """A succeeded, a failed and an interrupted validation"""
+    tasks = []
+    for name, status, returncode in [("base", "succeeded", 0), ("broken", "failed", 1),
+                                     ("stopped", "interrupted", 130)]:
+        path = write_build(f"proxmox/linux/debian/12/{name}", {
+            "build.pkr.hcl": f'build {{\n  name = "{name}"\n  sources = ["source.proxmox-iso.{name}"]\n}}\n',
+        })
+        task = BuildTask(PackerBuild(path, "proxmox", "linux"), run_build=False)
+        task.status, task.returncode = status, returncode
+        task.started, task.finished = 100.0, 101.5
+        task.output.extend([f"{name}: line 1", f"{name}: line 2"])
+        tasks.append(task)
+    return tasks
+
+
+def test_junit_report(tmp_path, tasks):
+    path = tmp_path / "reports" / "validate.XML"
+    write_validation_report(tasks, path, tmp_path / "builds", 2.25)
+
+    suite = ET.parse(path).getroot()
+    assert suite.tag == "testsuite"
+    assert {key: suite.get(key) for key in ("tests", "failures", "errors", "time")} == {
+        "tests": "3", "failures": "1", "errors": "1", "time": "2.250"
+    }
+    base, broken, stopped = suite.findall("testcase")
+    assert (base.get("classname"), base.get("name"), base.get("time")) == (
+        "proxmox.linux.debian.12.base", "base", "1.500"
+    )
+    assert list(base) == []
+    failure = broken.find("failure")
+    assert failure.get("message") == "exit 1"
+    assert failure.text == "broken: line 1\nbroken: line 2"
+    assert stopped.find("error").get("message") == "interrupted"
+
+
+def test_json_report(tmp_path, tasks):
+    path = tmp_path / "validate.json"
+    write_validation_report(tasks, path, tmp_path / "builds", 2.25)
+
+    report = json.loads(path.read_text())
+    assert (report["wall_time"], report["total"], report["failed"]) == (2.25, 3, 2)
+    assert report["builds"][0] == {
+        "name": "base", "path": "proxmox/linux/debian/12/base", "status": "succeeded",
+        "returncode": 0, "duration": 1.5, "output": [],
+    }
+    # Output is only kept for builds that did not pass
+    assert report["builds"][1]["output"] == ["broken: line 1", "broken: line 2"]
+    assert report["builds"][2]["status"] == "interrupted"
+
+
+def test_validate_all_runs_concurrently(tmp_path, write_build, fake_packer, monkeypatch, capsys):
+    (tmp_path / ".git").mkdir()
+    for name in ("alpha", "beta", "gamma"):
+        write_build(f"proxmox/linux/debian/12/{name}", {
+            "build.pkr.hcl": f'build {{\n  name = "{name}"\n  sources = ["source.proxmox-iso.{name}"]\n}}\n',
+        })
+    monkeypatch.setenv("FAKE_PACKER_VALIDATE_SECONDS", "0.3")
+    report = tmp_path / "validate.json"
+    monkeypatch.setattr(sys, "argv", [
+        "buildManager.py", "--repo-root", str(tmp_path), "--validate-all", "--report", str(report),
+    ])
+
+    assert buildManager.main() == 0
+    assert "Validating 3 build(s) with 3 worker(s)" in capsys.readouterr().out
+    stats = [json.loads(line) for line in (tmp_path / "stats.jsonl").read_text().splitlines()]
+    validates = [s for s in stats if s["command"] == "validate"]
+    assert len(validates) == 3
+    # Every validation started before the first one ended
+    assert max(s["start"] for s in validates) < min(s["end"] for s in validates)
+    assert not [s for s in stats if s["command"] == "build"]
+    builds = json.loads(report.read_text())["builds"]
+    assert sorted((b["name"], b["status"]) for b in builds) == [
+        ("alpha", "succeeded"), ("beta", "succeeded"), ("gamma", "succeeded")
+    ]
@@ -0,0 +1,162 @@
+"""
+Tests for VM ID leases, with a JSON VmInventory standing in for the cluster
+"""
+
+import io
+import json
+import ssl
+import threading
+import time
+import urllib.request
+from types import SimpleNamespace
+
+import pytest
+
+from buildManager import PackerBuildManager, VmIdAllocator, VmInventory, build_parser, configure_run
+
+
+@pytest.fixture
+def lease_dir(tmp_path):
+    return tmp_path / "leases"
+
+
+def test_concurrent_acquire_hands_out_each_id_once(lease_dir):
+    # One allocator per thread, like separate runs sharing the lease directory
+    pool = range(9100, 9110)
+    allocators = [VmIdAllocator(lease_dir, pool) for _ in range(5)]
+    acquired = []
+    lock = threading.Lock()
+    start = threading.Barrier(len(allocators))
+
+    def take(allocator, n):
+        start.wait()
+        for _ in range(2):
+            lease = allocator.acquire(None, f"run-{n}", log=lambda _: None)
+            with lock:
+                acquired.append(lease["vm_id"])
+
+    threads = [threading.Thread(target=take, args=(a, n)) for n, a in enumerate(allocators)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert len(acquired) == 10
+    assert sorted(acquired) == list(pool)
+    assert sorted(int(p.stem) for p in lease_dir.glob("*.json")) == list(pool)
+
+
+def test_literal_id_waits_for_the_holder(lease_dir):
+    first = VmIdAllocator(lease_dir)
+    second = VmIdAllocator(lease_dir)
+    lease = first.acquire(9000, "first")
+    messages = []
+    stop = threading.Event()
+
+    assert second.try_acquire(9000, "second") is None
+    timer = threading.Timer(0.2, stop.set)
+    timer.start()
+    assert second.acquire(9000, "second", stop=stop, log=messages.append) is None
+    assert "leased by first" in messages[0]
+
+    first.release(lease)
+    assert second.try_acquire(9000, "second")["label"] == "second"
+
+
+def test_expired_lease_is_reclaimed(lease_dir):
+    lease_dir.mkdir()
+    (lease_dir / "9000.json").write_text(json.dumps({
+        "vm_id": 9000, "host": "other-host", "pid": 1, "label": "crashed",
+        "acquired": time.time() - 7200, "expires": time.time() - 1,
+    }))
+    (lease_dir / "9001.json").write_text(json.dumps({
+        "vm_id": 9001, "host": "other-host", "pid": 1, "label": "live",
+        "acquired": time.time(), "expires": time.time() + 3600,
+    }))
+    allocator = VmIdAllocator(lease_dir)
+
+    assert allocator.try_acquire(9000, "next")["label"] == "next"
+    assert allocator.try_acquire(9001, "next") is None
+
+
+def test_release_keeps_a_lease_taken_over_after_expiry(lease_dir):
+    allocator = VmIdAllocator(lease_dir, ttl=3600)
+    lease = allocator.try_acquire(9000, "slow")
+    # Another host reclaimed the ID after the lease expired
+    (lease_dir / "9000.json").write_text(json.dumps({
+        "vm_id": 9000, "host": "other-host", "pid": 1, "label": "new",
+        "acquired": time.time(), "expires": time.time() + 3600,
+    }))
+
+    allocator.release(lease)
+    assert json.loads((lease_dir / "9000.json").read_text())["label"] == "new"
+
+
+def test_pool_skips_ids_in_the_inventory(tmp_path, lease_dir):
+    inventory = tmp_path / "vms.json"
+    inventory.write_text(json.dumps([9100, 9101, 9103]))
+    allocator = VmIdAllocator(lease_dir, range(9100, 9105), inventory=VmInventory(str(inventory)))
+
+    ids = [allocator.acquire(None, "run", log=lambda _: None)["vm_id"] for _ in range(2)]
+    assert ids == [9102, 9104]
+
+    stop = threading.Event()
+    stop.set()
+    assert allocator.acquire(None, "run", stop=stop, log=lambda _: None) is None
+
+
+@pytest.mark.parametrize("insecure, verified", [("", True), ("1", False)])
+def test_api_certificate_is_verified_unless_opted_out(monkeypatch, insecure, verified):
+    contexts = []
+
+    class Response(io.BytesIO):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    def urlopen(request, timeout, context):
+        contexts.append(context)
+        return Response(json.dumps({"data": [{"vmid": 9100}, {"type": "storage"}]}).encode())
+    monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+    monkeypatch.setenv("PROXMOX_INSECURE_TLS", insecure)
+
+    assert VmInventory("https://pve:8006").occupied() == {9100}
+    [context] = contexts
+    assert context.check_hostname is verified
+    assert context.verify_mode == (ssl.CERT_REQUIRED if verified else ssl.CERT_NONE)
+
+
+def test_lease_build_injects_pooled_ids(tmp_path, write_build, lease_dir):
+    write_build("proxmox/linux/debian/12/base", {
+        "build.pkr.hcl": 'build {\n  name = "debian_12_base"\n  sources = ["source.proxmox-iso.base"]\n}\n',
+        "sources.pkr.hcl": 'source "proxmox-iso" "base" {\n  vm_id = var.vm_id\n}\n',
+        "variables.pkr.hcl": 'variable "vm_id" {\n  type    = number\n  default = 9000\n}\n',
+    })
+    inventory = tmp_path / "vms.json"
+    inventory.write_text("[9000, 9100]")
+    [build] = PackerBuildManager(tmp_path).builds
+    allocator = VmIdAllocator(lease_dir, range(9100, 9110), inventory=VmInventory(str(inventory)))
+
+    leases, args, vm_ids = allocator.lease_build(build, build.sources, "debian", log=lambda _: None)
+    assert args == ["-var", "vm_id=9101"]
+    assert vm_ids == {"proxmox-iso.base": 9101}
+    for lease in leases:
+        allocator.release(lease)
+    assert not list(lease_dir.glob("*.json"))
+
+
+@pytest.mark.parametrize("argv, enabled", [
+    ([], False),
+    (["--vm-leases"], True),
+    (["--vm-id-pool", "9100-9199"], True),
+    (["--vm-id-pool", "9100-9199", "--no-vm-leases"], False),
+])
+def test_leasing_is_opt_in(monkeypatch, tmp_path, argv, enabled):
+    monkeypatch.delenv("BUILDMANAGER_VM_ID_POOL", raising=False)
+    args = build_parser().parse_args(argv + ["--lease-dir", str(tmp_path)])
+    manager = SimpleNamespace()
+
+    assert configure_run(manager, args) == 0
+    assert (args.leases is not None) == enabled
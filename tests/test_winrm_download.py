@@ -0,0 +1,130 @@
+"""Tests for the chunked, resumable download of winrm-tool.py"""
+
+import base64
+import gzip
+import hashlib
+import os
+
+import pytest
+
+DATA = os.urandom(10_000)
+REMOTE = r"C:\Windows\Temp\big.log"
+
+
+class FakeRemote:
+    """Stands in for read_chunk/remote_hash of a WinRMClient"""
+    
+    def __init__(self, data=DATA, fail_at=None, failures=0, missing=False):
+        self.data = data
+        self.fail_at = fail_at
+        self.failures = failures
+        self.missing = missing
+        self.offsets = []
+    
+    def read_chunk(self, remote_path, offset, size, compress=False):
+        self.offsets.append(offset)
+        if self.missing:
+            raise FileNotFoundError(f"Could not find file '{remote_path}'")
+        if offset == self.fail_at and self.failures:
+            self.failures -= 1
+            raise IOError("connection reset")
+        return self.data[offset:offset + size], len(self.data)
+    
+    def remote_hash(self, remote_path, length):
+        return hashlib.sha256(self.data[:length]).hexdigest()
+
+
+@pytest.fixture
+def client(winrm_tool, monkeypatch):
+    monkeypatch.setattr(winrm_tool.time, "sleep", lambda seconds: None)
+    return winrm_tool.WinRMClient("127.0.0.1", "user", "password")
+
+
+def attach(client, remote):
+    client.read_chunk = remote.read_chunk
+    client.remote_hash = remote.remote_hash
+    return remote
+
+
+def test_download_in_chunks(client, tmp_path):
+    remote = attach(client, FakeRemote())
+    target = tmp_path / "big.log"
+    assert client.download_file(REMOTE, str(target), chunk_size=4096)
+    assert target.read_bytes() == DATA
+    assert remote.offsets == [0, 4096, 8192]
+    assert not (tmp_path / "big.log.part").exists()
+
+
+def test_download_into_directory_keeps_the_remote_name(client, tmp_path):
+    attach(client, FakeRemote())
+    assert client.download_file(REMOTE, str(tmp_path))
+    assert (tmp_path / "big.log").read_bytes() == DATA
+
+
+def test_resume_from_partial_file(client, tmp_path):
+    (tmp_path / "big.log.part").write_bytes(DATA[:6000])
+    remote = attach(client, FakeRemote())
+    assert client.download_file(REMOTE, str(tmp_path / "big.log"), chunk_size=4096)
+    assert remote.offsets == [6000]
+    assert (tmp_path / "big.log").read_bytes() == DATA
+
+
+def test_failed_chunk_is_retried(client, tmp_path):
+    remote = attach(client, FakeRemote(fail_at=4096, failures=2))
+    assert client.download_file(REMOTE, str(tmp_path / "big.log"), chunk_size=4096)
+    assert remote.offsets == [0, 4096, 4096, 4096, 8192]
+    assert (tmp_path / "big.log").read_bytes() == DATA
+
+
+def test_interrupted_download_keeps_part_and_resumes(client, tmp_path):
+    target = tmp_path / "big.log"
+    attach(client, FakeRemote(fail_at=8192, failures=99))
+    assert not client.download_file(REMOTE, str(target), chunk_size=4096, retries=3)
+    assert (tmp_path / "big.log.part").read_bytes() == DATA[:8192]
+    assert not target.exists()
+    
+    remote = attach(client, FakeRemote())
+    assert client.download_file(REMOTE, str(target), chunk_size=4096)
+    assert remote.offsets == [8192]
+    assert target.read_bytes() == DATA
+
+
+def test_hash_mismatch_discards_the_partial_file(client, tmp_path):
+    (tmp_path / "big.log.part").write_bytes(b"x" * 6000)
+    attach(client, FakeRemote())
+    assert not client.download_file(REMOTE, str(tmp_path / "big.log"), chunk_size=4096)
+    assert not (tmp_path / "big.log.part").exists()
+    assert not (tmp_path / "big.log").exists()
+
+
+def test_missing_remote_file_is_not_retried(client, tmp_path):
+    remote = attach(client, FakeRemote(missing=True))
+    assert not client.download_file(REMOTE, str(tmp_path / "big.log"))
+    assert remote.offsets == [0]
+    assert not (tmp_path / "big.log.part").exists()
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_read_chunk_decodes_output(client, compress):
+    chunk = DATA[100:600]
+    payload = gzip.compress(chunk) if compress else chunk
+    scripts = []
+    
+    def execute_command(script, shell="powershell"):
+        scripts.append(script)
+        return f"{len(chunk)} {len(DATA)} {base64.b64encode(payload).decode()}", "", 0
+    
+    client.execute_command = execute_command
+    assert client.read_chunk("C:\\it's.log", 100, 500, compress) == (chunk, len(DATA))
+    assert "Seek(100, 'Begin')" in scripts[0]
+    assert "'C:\\it''s.log'" in scripts[0]
+
+
+def test_read_chunk_errors(client):
+    client.execute_command = lambda script, shell="powershell": (
+        "", "Exception calling \"Open\": Could not find file 'C:\\x.log'", 1)
+    with pytest.raises(FileNotFoundError):
+        client.read_chunk("C:\\x.log", 0, 10)
+    client.execute_command = lambda script, shell="powershell": ("5 10 " + base64.b64encode(b"abc").decode(), "", 0)
+    with pytest.raises(IOError, match="expected 5 bytes"):
+        client.read_chunk("C:\\x.log", 0, 10)
@@ -0,0 +1,100 @@
+"""
+Tests for running winrm-tool.py on many hosts at once (--hosts), against
+fake WS-Man servers on localhost
+"""
+
+import json
+import sys
+import threading
+import time
+
+import pytest
+
+from fake_wsman import HANG, free_port
+
+COMMAND = "Get-Service WinRM"
+
+
+def run_tool(winrm_tool, monkeypatch, capsys, ports, *argv):
+    hosts = ",".join(f"127.0.0.1:{port}" for port in ports)
+    monkeypatch.setattr(sys, "argv", ["winrm-tool.py", "--hosts", hosts, "--command", COMMAND, *argv])
+    with pytest.raises(SystemExit) as exit:
+        winrm_tool.main()
+    out, err = capsys.readouterr()
+    return exit.value.code, out, err
+
+
+def test_ok_and_failed_hosts(winrm_tool, servers, monkeypatch, capsys):
+    ok = servers({COMMAND: ("Running  WinRM\r\n", "", 0)})
+    failed = servers({COMMAND: ("", "Cannot find any service\r\n", 1)})
+
+    code, out, err = run_tool(winrm_tool, monkeypatch, capsys, [ok.port, failed.port])
+
+    assert code == 1
+    assert f"[127.0.0.1:{ok.port}] Running  WinRM" in out
+    assert f"[127.0.0.1:{failed.port}] Cannot find any service" in err
+    assert f"127.0.0.1:{ok.port}  ok" in out
+    assert f"127.0.0.1:{failed.port}  failed" in out
+    assert "1/2 host(s) succeeded" in out
+    assert ok.scripts == ["hostname", COMMAND]
+
+
+def test_json_result(winrm_tool, servers, monkeypatch, capsys):
+    ok = servers({COMMAND: ("Running  WinRM\r\n", "", 0)})
+    unreachable = free_port()
+
+    code, out, err = run_tool(winrm_tool, monkeypatch, capsys, [ok.port, unreachable], "--json")
+
+    assert code == 1
+    results = json.loads(out)
+    assert [(r["port"], r["status"], r["exit_code"]) for r in results] == [
+        (ok.port, "ok", 0), (unreachable, "unreachable", None)
+    ]
+    assert results[0]["stdout"] == "Running  WinRM\r\n"
+    # The host output and the summary go to stderr
+    assert "Running  WinRM" in err
+    assert "1/2 host(s) succeeded" in err
+
+
+def test_all_hosts_ok(winrm_tool, servers, monkeypatch, capsys):
+    ports = [servers({COMMAND: ("Running\r\n", "", 0)}).port for _ in range(3)]
+
+    code, out, _ = run_tool(winrm_tool, monkeypatch, capsys, ports, "--max-concurrent", "2")
+
+    assert code == 0
+    assert "3/3 host(s) succeeded" in out
+
+
+def test_timed_out_host_is_aborted(winrm_tool, servers, monkeypatch, capsys):
+    ok = servers({COMMAND: ("Running\r\n", "", 0)})
+    hung = servers({COMMAND: HANG})
+    stdout = sys.stdout
+
+    started = time.monotonic()
+    code, out, err = run_tool(winrm_tool, monkeypatch, capsys, [hung.port, ok.port],
+                              "--host-timeout", "1", "--request-timeout", "2")
+
+    assert code == 1
+    assert f"[127.0.0.1:{hung.port}] ✗ timed out after 1s" in err
+    assert f"127.0.0.1:{hung.port}  timeout" in out
+    assert f"127.0.0.1:{ok.port}  ok" in out
+    # The hung host's thread ended within one request timeout, and the
+    # streams are no longer wrapped
+    assert time.monotonic() - started < 10
+    assert not [t for t in threading.enumerate() if t.name.startswith("winrm-")]
+    assert sys.stdout is stdout
+    # Nothing was sent to the hung host after it was given up on
+    assert hung.scripts == ["hostname", COMMAND]
+
+
+def test_request_timeout_bounds_each_request(winrm_tool, servers):
+    hung = servers({"hostname": HANG})
+    client = winrm_tool.WinRMClient("127.0.0.1", "user", "password", hung.port, timeout=2)
+
+    started = time.monotonic()
+    assert not client.test_connection()
+    assert 1.5 < time.monotonic() - started < 10
+
+    client.abort()
+    assert client.execute_command("hostname")[1] == "Error executing command: gave up on 127.0.0.1"
+    assert hung.scripts == ["hostname"]
@@ -0,0 +1,153 @@
+"""
+Tests for following remote log files (--follow), against a fake WS-Man
+server that serves the files from memory
+"""
+
+import re
+
+import pytest
+
+INIT = r"C:\Windows\Temp\windows-init.log"
+PREPARE = r"C:\Windows\Temp\windows-prepare.log"
+LOGS = {"init": INIT, "prepare": PREPARE}
+
+
+@pytest.fixture
+def follow(winrm_tool, servers, monkeypatch):
+    """Follow LOGS on a fake server; each poll's sleep runs the next step"""
+    server = servers({})
+    server.files[PREPARE] = b""
+    client = winrm_tool.WinRMClient("127.0.0.1", "user", "password", server.port, timeout=2)
+    sleeps = []
+
+    def run(steps, **kwargs):
+        steps = list(steps)
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if not steps:
+                raise KeyboardInterrupt
+            steps.pop(0)()
+        monkeypatch.setattr(winrm_tool.time, "sleep", sleep)
+        return client.follow_logs(LOGS, **kwargs)
+    run.server = server
+    run.sleeps = sleeps
+    return run
+
+
+def offsets(server):
+    """Offsets sent with every poll"""
+    return [re.search(r"\$offsets = @\((.*)\)", s).group(1) for s in server.scripts if "$offsets" in s]
+
+
+def printed(capsys):
+    return [line for line in capsys.readouterr().out.splitlines() if line.startswith("[")]
+
+
+def test_only_appended_bytes_are_read(follow, capsys):
+    server = follow.server
+    server.files[INIT] = b"\xef\xbb\xbfstarting\r\nstep 1 of"
+
+    def append():
+        server.files[INIT] += b" 3\r\ndone\r\n"
+
+    assert follow([append], until="done") is True
+    assert printed(capsys) == ["[init   ] starting", "[init   ] step 1 of 3", "[init   ] done"]
+    # The partial line waited for its end, which the second poll read
+    # after the 22 bytes already seen
+    assert offsets(server) == ["0, 0", "22, 0"]
+
+
+def test_marker_stops_following(follow, capsys):
+    server = follow.server
+    server.files[INIT] = b"a\r\nPACKER BUILD COMPLETE\r\nlater\r\n"
+
+    assert follow([], until=r"BUILD COMPLETE") is True
+    out = printed(capsys)
+    assert out == ["[init   ] a", "[init   ] PACKER BUILD COMPLETE"]
+    assert follow.sleeps == []
+
+
+def test_missing_and_truncated_files(follow, capsys):
+    server = follow.server
+    server.files[INIT] = b"old run\r\n"
+    del server.files[PREPARE]
+
+    def create():
+        server.files[PREPARE] = b"prepare\r\n"
+
+    def truncate():
+        server.files[INIT] = b"new\r\n"
+
+    def finish():
+        server.files[INIT] += b"end\r\n"
+
+    follow([create, truncate, finish], until="end")
+    assert printed(capsys) == [
+        "[init   ] old run",
+        rf"[prepare] (waiting for {PREPARE})",
+        "[prepare] prepare",
+        "[init   ] (file was truncated, reading from the start)",
+        "[init   ] new",
+        "[init   ] end",
+    ]
+    assert offsets(follow.server) == ["0, 0", "9, 0", "9, 9", "0, 9"]
+
+
+def test_large_files_are_read_in_chunks_without_waiting(follow, capsys):
+    server = follow.server
+    server.files[INIT] = b"".join(b"line %d\r\n" % n for n in range(10))
+
+    assert follow([], until="line 9", max_bytes=32) is True
+    assert len(printed(capsys)) == 10
+    assert follow.sleeps == []
+    assert offsets(server) == ["0, 0", "32, 0", "64, 0"]
+
+
+def test_polling_backs_off_while_nothing_changes(follow):
+    server = follow.server
+    server.files[INIT] = b""
+
+    def idle():
+        pass
+
+    def write():
+        server.files[INIT] = b"x\r\n"
+
+    follow([idle, idle, idle, idle, write, idle], interval=1, max_interval=5)
+    assert follow.sleeps == [2, 4, 5, 5, 5, 1, 2]
+
+
+def test_host_gone_after_silence(follow, capsys, monkeypatch, winrm_tool):
+    server = follow.server
+    server.files[INIT] = b"rebooting\r\npartial"
+    clock = [1000.0]
+    monkeypatch.setattr(winrm_tool.time, "monotonic", lambda: clock[0])
+
+    def go_away():
+        server.unavailable = True
+
+    def wait():
+        clock[0] += 20
+
+    assert follow([go_away, wait, wait, wait], gone_after=60) is False
+    out = capsys.readouterr().out
+    assert out.count("is not answering, retrying") == 1
+    assert "has not answered for 60s, stopping" in out
+    # A last line without its newline is still printed
+    assert "[init   ] partial" in out
+
+
+def test_host_that_comes_back_is_followed_again(follow, capsys):
+    server = follow.server
+    server.files[INIT] = b"before\r\n"
+
+    def go_away():
+        server.unavailable = True
+
+    def come_back():
+        server.unavailable = False
+        server.files[INIT] += b"after\r\n"
+
+    assert follow([go_away, come_back], until="after", gone_after=60) is True
+    assert printed(capsys) == ["[init   ] before", "[init   ] after"]
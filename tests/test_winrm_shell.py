@@ -0,0 +1,79 @@
+"""
+Tests for the persistent remote shell of winrm-tool.py, against a fake
+WS-Man server on localhost
+"""
+
+import pytest
+
+COMMAND = "Get-Service WinRM"
+CLIXML = (
+    '#< CLIXML\r\n<Objs Version="1.1.0.1" xmlns="http://schemas.microsoft.com/powershell/2004/04">'
+    '<S S="Error">Cannot find any service with service name \'Nope\'._x000D__x000A_</S>'
+    '<S S="Error">+ CategoryInfo : ObjectNotFound_x000D__x000A_</S></Objs>'
+)
+
+
+@pytest.fixture
+def client(winrm_tool, servers):
+    server = servers({COMMAND: ("Running  WinRM\r\n", "", 0), "Get-Service Nope": ("", CLIXML, 1)})
+    client = winrm_tool.WinRMClient("127.0.0.1", "user", "password", server.port)
+    client.server = server
+    yield client
+    client.close()
+
+
+def test_commands_share_one_shell(client):
+    assert client.execute_command("hostname") == ("FAKEHOST\r\n", "", 0)
+    assert client.execute_command(COMMAND) == ("Running  WinRM\r\n", "", 0)
+
+    assert client.server.shells_created == 1
+    assert client.server.scripts == ["hostname", COMMAND]
+    client.close()
+    assert client.server.shells == set()
+
+
+def test_one_shell_per_command_without_persistence(winrm_tool, servers):
+    server = servers({})
+    client = winrm_tool.WinRMClient("127.0.0.1", "user", "password", server.port, persistent=False)
+
+    for _ in range(2):
+        assert client.execute_command("hostname") == ("FAKEHOST\r\n", "", 0)
+    assert server.shells_created == 2
+    assert server.shells == set()
+
+
+def test_clixml_errors_become_plain_text(client):
+    out, err, code = client.execute_command("Get-Service Nope")
+
+    assert (out, code) == ("", 1)
+    assert err == "Cannot find any service with service name 'Nope'.\r\n+ CategoryInfo : ObjectNotFound"
+
+
+def test_other_errors_are_left_alone(winrm_tool):
+    for message in [b"plain error\r\n", b"#< CLIXML\r\n<Objs", b"#< CLIXML\r\n<Objs></Objs>"]:
+        assert winrm_tool.WinRMClient._strip_clixml(message) == message
+
+
+def test_expired_shell_is_reopened_once(client):
+    assert client.execute_command("hostname")[2] == 0
+    client.server.expire_shells()
+
+    assert client.execute_command(COMMAND) == ("Running  WinRM\r\n", "", 0)
+    assert client.server.shells_created == 2
+    # The command ran once, in the new shell
+    assert client.server.scripts == ["hostname", COMMAND]
+
+
+def test_shell_that_fails_again_is_not_retried_forever(client, monkeypatch):
+    assert client.execute_command("hostname")[2] == 0
+    # Every new shell is gone before a command reaches it
+    open_shell = client.protocol.open_shell
+    monkeypatch.setattr(client.protocol, "open_shell",
+                        lambda **kwargs: open_shell(**kwargs) and client.server.expire_shells() or "GONE")
+    client.server.expire_shells()
+
+    out, err, code = client.execute_command(COMMAND)
+    assert (out, code) == ("", 1)
+    assert err.startswith("Error executing command:")
+    assert client.server.scripts == ["hostname"]
+    assert client.shells_opened == 2
@@ -0,0 +1,102 @@
+"""
+Tests for waiting until a Windows host accepts WinRM commands (--wait-ready),
+against a fake WS-Man server on localhost
+"""
+
+import time
+
+import pytest
+
+from fake_wsman import free_port
+
+
+@pytest.fixture
+def delays(winrm_tool, monkeypatch):
+    """Upper bounds of the jittered delays, which are kept short"""
+    bounds = []
+
+    def uniform(low, high):
+        bounds.append(high)
+        return 0.01
+    monkeypatch.setattr(winrm_tool.random, "uniform", uniform)
+    return bounds
+
+
+def client_for(winrm_tool, port):
+    return winrm_tool.WinRMClient("127.0.0.1", "user", "password", port, timeout=2)
+
+
+@pytest.mark.parametrize("identify", [True, False])
+def test_ready_after_all_stages(winrm_tool, servers, capsys, identify):
+    server = servers({})
+    # Without credentials Windows refuses Identify with 401, which still
+    # shows that WinRM is listening
+    server.identify = identify
+
+    result = client_for(winrm_tool, server.port).wait_ready(deadline=10)
+
+    assert result["ready"] is True
+    assert result["attempts"] == 3
+    assert 0 <= result["tcp_seconds"] <= result["winrm_seconds"] <= result["shell_seconds"]
+    assert server.scripts == ["hostname"]
+    out = capsys.readouterr().out
+    assert "✓ TCP port open" in out
+    assert "✓ WS-Man Identify answered" in out
+    assert "✓ Authenticated shell ready" in out
+
+
+def test_stages_are_retried_in_order(winrm_tool, servers, capsys, delays, monkeypatch):
+    server = servers({"hostname": ("", "still in OOBE\r\n", 1)})
+    probes = []
+    client = client_for(winrm_tool, server.port)
+    for stage in ("tcp", "identify", "shell"):
+        probe = getattr(client, f"_probe_{stage}")
+
+        def record(timeout, stage=stage, probe=probe):
+            probes.append(stage)
+            if stage == "shell" and probes.count("shell") == 3:
+                server.commands["hostname"] = ("FAKEHOST\r\n", "", 0)
+            return probe(timeout)
+        monkeypatch.setattr(client, f"_probe_{stage}", record)
+
+    result = client.wait_ready(deadline=30)
+
+    assert result["ready"] is True
+    # The shell stage is retried without going back to the earlier stages
+    assert probes == ["tcp", "identify", "shell", "shell", "shell"]
+    assert result["attempts"] == 5
+    # Exponential backoff, restarted for each stage
+    assert delays == [1, 2]
+    # A repeated error is printed once
+    assert capsys.readouterr().out.count("shell: still in OOBE (retrying)") == 1
+
+
+def test_jitter_is_capped_by_max_delay(winrm_tool, delays):
+    result = client_for(winrm_tool, free_port()).wait_ready(deadline=0.5, max_delay=4)
+
+    assert result["ready"] is False
+    assert len(delays) > 4
+    assert delays[:5] == [1, 2, 4, 4, 4]
+
+
+def test_deadline_gives_up(winrm_tool, capsys):
+    port = free_port()
+
+    started = time.monotonic()
+    result = client_for(winrm_tool, port).wait_ready(deadline=2, max_delay=0.5)
+
+    assert 2 <= time.monotonic() - started < 5
+    assert result["ready"] is False
+    assert result["attempts"] > 1
+    assert (result["tcp_seconds"], result["winrm_seconds"], result["shell_seconds"]) == (None, None, None)
+    assert result["error"]
+    assert "✗ 127.0.0.1 not ready after" in capsys.readouterr().out
+
+
+def test_abort_stops_waiting(winrm_tool):
+    client = client_for(winrm_tool, free_port())
+    client.abort()
+
+    started = time.monotonic()
+    assert client.wait_ready(deadline=30)["error"] == "aborted"
+    assert time.monotonic() - started < 1
@@ -5,19 +5,45 @@ WinRM Client Tool for Packer Build VMs
 A Python-based WinRM client for connecting to Windows VMs during Packer builds.
 Supports interactive shell, command execution, and log file retrieval.
 
+Commands run in one remote shell that is kept open for the whole session
+(re-opened if it expires); --no-persistent-shell opens a shell per command.
+
 Usage:
     python winrm-tool.py --host <IP> --user <username> --password <password>
     python winrm-tool.py --host <IP> --user <username> --password <password> --command "Get-Process"
     python winrm-tool.py --host <IP> --user <username> --password <password> --get-logs
+    python winrm-tool.py --host <IP> --user <username> --password <password> --follow
+    python winrm-tool.py --hosts <IP>,<IP> --user <username> --password <password> --command "hostname"
+    python winrm-tool.py --hosts <IP>,<IP> --user <username> --password <password> --wait-ready
+    python winrm-tool.py --host <IP> --user <username> --password <password> \\
+        --download 'C:\\Windows\\Logs\\CBS\\CBS.log' ./CBS.log --compress
 """
 
 import argparse
+import base64
+import contextlib
+import contextvars
+import gzip
+import hashlib
+import http.client
+import json
+import queue
+import random
+import socket
+import statistics
 import sys
 import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ET
 from typing import Optional
 
 try:
     import winrm
+    from winrm.exceptions import WinRMError, WinRMTransportError
     from winrm.protocol import Protocol
 except ImportError:
     print("Error: pywinrm package not found.")
@@ -28,7 +54,13 @@ except ImportError:
 class WinRMClient:
     """WinRM client for connecting to Windows hosts."""
     
-    def __init__(self, host: str, username: str, password: str, port: int = 5985):
+    BUILD_LOGS = {
+        'windows-init.log': r'C:\Windows\Temp\windows-init.log',
+        'windows-prepare.log': r'C:\Windows\Temp\windows-prepare.log'
+    }
+    
+    def __init__(self, host: str, username: str, password: str, port: int = 5985,
+                 persistent: bool = True, timeout: Optional[float] = None):
         """
         Initialize WinRM client.
         
@@ -37,20 +69,138 @@ class WinRMClient:
             username: Windows username
             password: Windows password
             port: WinRM port (default: 5985 for HTTP)
+            persistent: Reuse one remote shell for all commands instead of
+                opening and closing a shell per command
+            timeout: Seconds a single WS-Man request may take
+                (default: pywinrm's 30)
         """
         self.host = host
         self.username = username
         self.password = password
         self.port = port
         self.endpoint = f"http://{host}:{port}/wsman"
+        self.persistent = persistent
+        # Set by abort(); no WS-Man request is sent after that
+        self.aborted = threading.Event()
+        
+        # pywinrm needs the read timeout to exceed the operation timeout
+        timeouts = {}
+        if timeout:
+            read_timeout = max(2, int(timeout))
+            timeouts = {'read_timeout_sec': read_timeout, 'operation_timeout_sec': read_timeout - 1}
         
         # Create session
         self.session = winrm.Session(
             self.endpoint,
             auth=(username, password),
             transport='basic',
-            server_cert_validation='ignore'
+            server_cert_validation='ignore',
+            **timeouts
+        )
+        
+        # Persistent shell, opened on first use
+        self.protocol = Protocol(
+            endpoint=self.endpoint,
+            transport='basic',
+            username=username,
+            password=password,
+            server_cert_validation='ignore',
+            **timeouts
         )
+        self.shell_id = None
+        self.shells_opened = 0
+        # Every WS-Man request goes through a transport; see abort()
+        for protocol in (self.protocol, self.session.protocol):
+            protocol.transport.send_message = self._guard(protocol.transport.send_message)
+        
+        # Seconds each command took, including the WS-Man round trips
+        self.latencies = []
+    
+    def _open_shell(self):
+        """Open the remote shell that commands are run in (UTF-8 code page)."""
+        self.shell_id = self.protocol.open_shell(codepage=65001)
+        self.shells_opened += 1
+    
+    def _guard(self, send):
+        """Wrap a transport's ``send_message`` so that it fails once aborted."""
+        def guarded(message):
+            if self.aborted.is_set():
+                raise ConnectionAbortedError(f"gave up on {self.host}")
+            return send(message)
+        return guarded
+    
+    def abort(self):
+        """
+        Give up on the host from another thread.
+        
+        A request already in flight still runs into its timeout, but every
+        later request fails at once, so the thread using the client ends
+        after at most one more request timeout. Idle connections are closed.
+        """
+        self.aborted.set()
+        for protocol in (self.protocol, self.session.protocol):
+            protocol.transport.close_session()
+    
+    def close(self):
+        """Close the persistent shell, if one is open."""
+        if self.shell_id and not self.aborted.is_set():
+            try:
+                self.protocol.close_shell(self.shell_id)
+            except Exception:
+                pass
+            self.shell_id = None
+    
+    @staticmethod
+    def _strip_clixml(message: bytes) -> bytes:
+        """
+        Turn PowerShell's CLIXML error stream into the plain error text.
+        
+        A message that is not CLIXML, or that does not parse, is returned
+        unchanged.
+        """
+        if not message.startswith(b'#< CLIXML'):
+            return message
+        try:
+            root = ET.fromstring(message.split(b'\n', 1)[1])
+        except (IndexError, ET.ParseError):
+            return message
+        # Error records are <S S="Error"> children; characters such as CR/LF
+        # are escaped as _x000D_
+        text = ''.join(node.text or '' for node in root if node.tag.rpartition('}')[2] == 'S')
+        text = re.sub(r'_x([0-9A-Fa-f]{4})_', lambda m: chr(int(m.group(1), 16)), text).strip()
+        return text.encode('utf-8') if text else message
+    
+    def _run_in_shell(self, command: str, arguments: list) -> tuple:
+        """
+        Run a command in the persistent shell.
+        
+        A shell that the host has expired or dropped is re-opened once,
+        before the command has started, so nothing runs twice.
+        
+        Returns:
+            Tuple of (stdout bytes, stderr bytes, exit_code)
+        """
+        if self.shell_id is None:
+            self._open_shell()
+        try:
+            command_id = self.protocol.run_command(self.shell_id, command, arguments)
+        except (WinRMError, WinRMTransportError):
+            self.shell_id = None
+            self._open_shell()
+            command_id = self.protocol.run_command(self.shell_id, command, arguments)
+        
+        try:
+            return self.protocol.get_command_output(self.shell_id, command_id)
+        except (WinRMError, WinRMTransportError):
+            # The shell is in an unknown state; start over with the next command
+            self.shell_id = None
+            raise
+        finally:
+            if self.shell_id:
+                try:
+                    self.protocol.cleanup_command(self.shell_id, command_id)
+                except Exception:
+                    pass
     
     def execute_command(self, command: str, shell: str = 'powershell') -> tuple:
         """
@@ -63,19 +213,42 @@ class WinRMClient:
         Returns:
             Tuple of (stdout, stderr, exit_code)
         """
+        started = time.monotonic()
         try:
-            if shell.lower() == 'powershell':
-                result = self.session.run_ps(command)
+            if not self.persistent:
+                if shell.lower() == 'powershell':
+                    result = self.session.run_ps(command)
+                else:
+                    result = self.session.run_cmd(command)
+                std_out, std_err, status_code = result.std_out, result.std_err, result.status_code
+            elif shell.lower() == 'powershell':
+                # Same encoding as Session.run_ps
+                encoded = base64.b64encode(command.encode('utf_16_le')).decode('ascii')
+                std_out, std_err, status_code = self._run_in_shell(
+                    'powershell', ['-NoProfile', '-NonInteractive', '-EncodedCommand', encoded]
+                )
+                if std_err:
+                    std_err = self._strip_clixml(std_err)
             else:
-                result = self.session.run_cmd(command)
+                std_out, std_err, status_code = self._run_in_shell(command, [])
             
             return (
-                result.std_out.decode('utf-8') if result.std_out else '',
-                result.std_err.decode('utf-8') if result.std_err else '',
-                result.status_code
+                std_out.decode('utf-8', errors='replace') if std_out else '',
+                std_err.decode('utf-8', errors='replace') if std_err else '',
+                status_code
             )
         except Exception as e:
             return ('', f'Error executing command: {str(e)}', 1)
+        finally:
+            self.latencies.append(time.monotonic() - started)
+    
+    def latency_summary(self) -> str:
+        """One-line summary of the command latencies of this session."""
+        if not self.latencies:
+            return "no commands run"
+        mode = f"{self.shells_opened} shell(s) opened" if self.persistent else "one shell per command"
+        return (f"{len(self.latencies)} command(s), median {statistics.median(self.latencies):.2f}s, "
+                f"max {max(self.latencies):.2f}s, {mode}")
     
     def get_file_content(self, remote_path: str) -> Optional[str]:
         """
@@ -96,6 +269,179 @@ class WinRMClient:
             print(f"Error reading file: {stderr}")
             return None
     
+    # Reads one chunk of a file, even while another process writes to it,
+    # and prints "<bytes read> <file length> <base64 data>"
+    READ_CHUNK_SCRIPT = """
+$ErrorActionPreference = 'Stop'
+$f = [IO.File]::Open('{path}', 'Open', 'Read', 'ReadWrite')
+try {{
+    $null = $f.Seek({offset}, 'Begin')
+    $buf = New-Object byte[] {size}
+    $n = 0
+    while ($n -lt {size}) {{
+        $r = $f.Read($buf, $n, {size} - $n)
+        if ($r -eq 0) {{ break }}
+        $n += $r
+    }}
+    $data = $buf
+    $count = $n
+    if ({compress}) {{
+        $ms = New-Object IO.MemoryStream
+        $gz = New-Object IO.Compression.GZipStream($ms, [IO.Compression.CompressionMode]::Compress)
+        $gz.Write($buf, 0, $n)
+        $gz.Close()
+        $data = $ms.ToArray()
+        $count = $data.Length
+    }}
+    [Console]::Out.Write("$n $($f.Length) " + [Convert]::ToBase64String($data, 0, $count))
+}} finally {{
+    $f.Close()
+}}
+"""
+    
+    # SHA-256 of the first {length} bytes, which stays comparable while a log grows
+    HASH_SCRIPT = """
+$ErrorActionPreference = 'Stop'
+$f = [IO.File]::Open('{path}', 'Open', 'Read', 'ReadWrite')
+try {{
+    $sha = [Security.Cryptography.SHA256]::Create()
+    $buf = New-Object byte[] 1048576
+    $left = [long]{length}
+    while ($left -gt 0) {{
+        $r = $f.Read($buf, 0, [Math]::Min($buf.Length, $left))
+        if ($r -eq 0) {{ break }}
+        $null = $sha.TransformBlock($buf, 0, $r, $null, 0)
+        $left -= $r
+    }}
+    $null = $sha.TransformFinalBlock($buf, 0, 0)
+    [Console]::Out.Write(([BitConverter]::ToString($sha.Hash) -replace '-', '').ToLower())
+}} finally {{
+    $f.Close()
+}}
+"""
+    
+    def read_chunk(self, remote_path: str, offset: int, size: int, compress: bool = False) -> tuple:
+        """
+        Read up to ``size`` bytes of a remote file starting at ``offset``.
+        
+        Returns:
+            Tuple of (data bytes, current remote file length)
+        
+        Raises:
+            FileNotFoundError: If the remote file or its directory does not exist
+            IOError: If the file cannot be read or the output is malformed
+        """
+        script = self.READ_CHUNK_SCRIPT.format(
+            path=remote_path.replace("'", "''"), offset=offset, size=size,
+            compress='$true' if compress else '$false'
+        )
+        stdout, stderr, exit_code = self.execute_command(script)
+        parts = stdout.strip().split(' ', 2)
+        if exit_code != 0 and ('FileNotFound' in stderr or 'DirectoryNotFound' in stderr
+                               or 'Could not find' in stderr):
+            raise FileNotFoundError(stderr.strip())
+        if exit_code != 0 or len(parts) < 2:
+            raise IOError(stderr.strip() or f"unexpected output: {stdout[:200]!r}")
+        count, length = int(parts[0]), int(parts[1])
+        data = base64.b64decode(parts[2]) if len(parts) > 2 else b''
+        if compress and data:
+            data = gzip.decompress(data)
+        if len(data) != count:
+            raise IOError(f"chunk at {offset}: expected {count} bytes, got {len(data)}")
+        return data, length
+    
+    def remote_hash(self, remote_path: str, length: int) -> str:
+        """SHA-256 hex digest of the first ``length`` bytes of a remote file."""
+        script = self.HASH_SCRIPT.format(path=remote_path.replace("'", "''"), length=length)
+        stdout, stderr, exit_code = self.execute_command(script)
+        if exit_code != 0:
+            raise IOError(stderr.strip() or "cannot hash remote file")
+        return stdout.strip().lower()
+    
+    def download_file(self, remote_path: str, local_path: str, chunk_size: int = 512 * 1024,
+                      compress: bool = False, retries: int = 5) -> bool:
+        """
+        Download a remote file in chunks, resuming an earlier partial download.
+        
+        Chunks are appended to ``<local_path>.part`` as they arrive, so memory
+        use does not grow with the file and a rerun after a disconnect
+        continues at the last byte written. Failed chunks are retried with
+        backoff. The file is renamed to ``local_path`` once its SHA-256
+        matches the remote file's.
+        
+        Args:
+            remote_path: Path to file on remote host
+            local_path: Local file (or directory) to write to
+            chunk_size: Bytes read per WinRM command
+            compress: Gzip every chunk on the remote host before transfer
+            retries: Attempts per chunk before giving up
+        
+        Returns:
+            True if the file was downloaded and verified, False otherwise
+        """
+        if os.path.isdir(local_path):
+            local_path = os.path.join(local_path, remote_path.replace('\\', '/').rsplit('/', 1)[-1])
+        part_path = local_path + '.part'
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset:
+            print(f"Resuming {remote_path} at byte {offset}")
+        
+        started = time.monotonic()
+        transferred = 0
+        length = None
+        with open(part_path, 'ab') as part:
+            while length is None or offset < length:
+                for attempt in range(retries):
+                    try:
+                        data, length = self.read_chunk(remote_path, offset, chunk_size, compress)
+                        break
+                    except FileNotFoundError as e:
+                        print(f"Error downloading {remote_path}: {e}")
+                        part.close()
+                        if not os.path.getsize(part_path):
+                            os.remove(part_path)
+                        return False
+                    except (IOError, ValueError) as e:
+                        if attempt == retries - 1:
+                            print(f"\nError downloading {remote_path} at byte {offset}: {e}")
+                            print(f"Partial file kept in {part_path}; rerun to resume")
+                            return False
+                        delay = min(2 ** attempt, 30)
+                        print(f"\nChunk at byte {offset} failed ({e}), retrying in {delay}s...")
+                        time.sleep(delay)
+                if not data:
+                    # The file shrank below what was already downloaded
+                    break
+                part.write(data)
+                part.flush()
+                offset += len(data)
+                transferred += len(data)
+                elapsed = time.monotonic() - started
+                rate = transferred / elapsed / 1024 if elapsed > 0 else 0
+                print(f"\r{remote_path}: {offset}/{length} bytes ({rate:.0f} KiB/s)", end='', flush=True)
+        print()
+        
+        sha = hashlib.sha256()
+        with open(part_path, 'rb') as part:
+            for block in iter(lambda: part.read(1024 * 1024), b''):
+                sha.update(block)
+        try:
+            expected = self.remote_hash(remote_path, offset)
+        except IOError as e:
+            print(f"Error verifying {remote_path}: {e}")
+            return False
+        if sha.hexdigest() != expected:
+            print(f"✗ SHA-256 mismatch for {remote_path} (the remote file changed?); "
+                  f"removed {part_path}, rerun to download it again")
+            os.remove(part_path)
+            return False
+        
+        os.replace(part_path, local_path)
+        elapsed = time.monotonic() - started
+        print(f"✓ Downloaded {remote_path} to {local_path}: {offset} bytes in {elapsed:.1f}s, "
+              f"sha256 {expected}")
+        return True
+    
     def get_build_logs(self) -> dict:
         """
         Retrieve Packer build log files from standard locations.
@@ -103,13 +449,8 @@ class WinRMClient:
         Returns:
             Dictionary with log file names as keys and content as values
         """
-        log_files = {
-            'windows-init.log': r'C:\Windows\Temp\windows-init.log',
-            'windows-prepare.log': r'C:\Windows\Temp\windows-prepare.log'
-        }
-        
         logs = {}
-        for name, path in log_files.items():
+        for name, path in self.BUILD_LOGS.items():
             print(f"\n{'='*60}")
             print(f"Retrieving: {name}")
             print('='*60)
@@ -123,6 +464,143 @@ class WinRMClient:
         
         return logs
     
+    # Reads whatever was appended to each file since its offset and prints
+    # "<index> <file length> <base64 data>", or "<index> -1" for missing files
+    TAIL_SCRIPT = """
+$ErrorActionPreference = 'Stop'
+$paths = @({paths})
+$offsets = @({offsets})
+for ($i = 0; $i -lt $paths.Count; $i++) {{
+    if (-not (Test-Path -LiteralPath $paths[$i])) {{
+        [Console]::Out.WriteLine("$i -1")
+        continue
+    }}
+    $f = [IO.File]::Open($paths[$i], 'Open', 'Read', 'ReadWrite')
+    try {{
+        $length = $f.Length
+        $n = 0
+        $buf = New-Object byte[] 0
+        if ($length -gt $offsets[$i]) {{
+            $null = $f.Seek($offsets[$i], 'Begin')
+            $buf = New-Object byte[] ([Math]::Min($length - $offsets[$i], {max_bytes}))
+            while ($n -lt $buf.Length) {{
+                $r = $f.Read($buf, $n, $buf.Length - $n)
+                if ($r -eq 0) {{ break }}
+                $n += $r
+            }}
+        }}
+        [Console]::Out.WriteLine("$i $length " + [Convert]::ToBase64String($buf, 0, $n))
+    }} finally {{
+        $f.Close()
+    }}
+}}
+"""
+    
+    def follow_logs(self, log_files: Optional[dict] = None, until: Optional[str] = None,
+                    interval: float = 1.0, max_interval: float = 15.0, gone_after: float = 60.0,
+                    max_bytes: int = 1024 * 1024) -> bool:
+        """
+        Print new lines of log files as they are written, like ``tail -f``.
+        
+        Every poll is a single WinRM command that returns only the bytes
+        appended to each file since the previous poll. Lines are prefixed
+        with their file's name. The poll interval doubles up to
+        ``max_interval`` while no file changes and drops back to
+        ``interval`` as soon as one does.
+        
+        Args:
+            log_files: Names and remote paths of the files (default: build logs)
+            until: Regular expression; stop after a line matching it is printed
+            interval: Shortest time between polls, in seconds
+            max_interval: Longest time between polls, in seconds
+            gone_after: Give up when the host has not answered for this long
+            max_bytes: Most bytes transferred per file and poll
+        
+        Returns:
+            False if the host went away, True otherwise
+        """
+        log_files = log_files or self.BUILD_LOGS
+        names = list(log_files)
+        paths = [log_files[name] for name in names]
+        offsets = [0] * len(names)
+        pending = [b''] * len(names)
+        missing = [False] * len(names)
+        marker = re.compile(until) if until else None
+        width = max(len(name) for name in names)
+        
+        def emit(index: int, line: bytes) -> bool:
+            text = line.decode('utf-8', errors='replace').lstrip('\ufeff').rstrip('\r')
+            print(f"[{names[index]:<{width}}] {text}", flush=True)
+            return bool(marker and marker.search(text))
+        
+        print(f"Following {', '.join(paths)} (Ctrl-C to stop)")
+        delay = interval
+        last_answer = time.monotonic()
+        unanswered = False
+        try:
+            while True:
+                script = self.TAIL_SCRIPT.format(
+                    paths=', '.join("'" + p.replace("'", "''") + "'" for p in paths),
+                    offsets=', '.join(str(o) for o in offsets),
+                    max_bytes=max_bytes
+                )
+                stdout, stderr, exit_code = self.execute_command(script)
+                if exit_code != 0:
+                    silent = time.monotonic() - last_answer
+                    if silent >= gone_after:
+                        print(f"✗ {self.host} has not answered for {silent:.0f}s, stopping: {stderr.strip()}")
+                        return False
+                    if not unanswered:
+                        print(f"({self.host} is not answering, retrying: {stderr.strip()})", flush=True)
+                        unanswered = True
+                    delay = min(delay * 2, max_interval)
+                    time.sleep(delay)
+                    continue
+                last_answer = time.monotonic()
+                unanswered = False
+                
+                changed = more = False
+                for line in stdout.splitlines():
+                    parts = line.split(' ', 2)
+                    if len(parts) < 2 or not parts[0].isdigit() or int(parts[0]) >= len(names):
+                        continue
+                    i, length = int(parts[0]), int(parts[1])
+                    if length < 0:
+                        if not missing[i]:
+                            print(f"[{names[i]:<{width}}] (waiting for {paths[i]})", flush=True)
+                            missing[i] = True
+                        offsets[i], pending[i] = 0, b''
+                        continue
+                    missing[i] = False
+                    if length < offsets[i]:
+                        print(f"[{names[i]:<{width}}] (file was truncated, reading from the start)", flush=True)
+                        offsets[i], pending[i] = 0, b''
+                        changed = True
+                        continue
+                    data = base64.b64decode(parts[2]) if len(parts) > 2 else b''
+                    if not data:
+                        continue
+                    changed = True
+                    offsets[i] += len(data)
+                    more = more or offsets[i] < length
+                    *lines, pending[i] = (pending[i] + data).split(b'\n')
+                    for complete in lines:
+                        if emit(i, complete):
+                            print(f"Marker '{until}' found, stopping")
+                            return True
+                
+                if more:
+                    continue
+                delay = interval if changed else min(delay * 2, max_interval)
+                time.sleep(delay)
+        except KeyboardInterrupt:
+            print()
+            return True
+        finally:
+            for i, rest in enumerate(pending):
+                if rest.strip():
+                    emit(i, rest)
+    
     def interactive_shell(self):
         """
         Start an interactive PowerShell session.
@@ -142,6 +620,7 @@ class WinRMClient:
                 
                 if command.lower() in ['exit', 'quit']:
                     print("Ending session...")
+                    print(f"Latency: {self.latency_summary()}")
                     break
                 
                 if command.lower() == 'get-logs':
@@ -157,11 +636,13 @@ class WinRMClient:
                 
                 if exit_code != 0:
                     print(f"[Exit Code: {exit_code}]")
+                print(f"[{self.latencies[-1]:.2f}s]")
                     
             except KeyboardInterrupt:
                 print("\n\nInterrupted. Type 'exit' to quit.")
             except EOFError:
                 print("\nEnding session...")
+                print(f"Latency: {self.latency_summary()}")
                 break
             except Exception as e:
                 print(f"Error: {str(e)}", file=sys.stderr)
@@ -177,11 +658,352 @@ class WinRMClient:
         stdout, stderr, exit_code = self.execute_command("hostname")
         
         if exit_code == 0:
-            print(f"✓ Connection successful! Remote host: {stdout.strip()}")
+            print(f"✓ Connection successful! Remote host: {stdout.strip()} "
+                  f"({self.latencies[-1]:.2f}s)")
             return True
         else:
             print(f"✗ Connection failed: {stderr}")
             return False
+    
+    IDENTIFY_REQUEST = (
+        '<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" '
+        'xmlns:wsmid="http://schemas.dmtf.org/wbem/wsman/identity/1/wsmanidentity.xsd">'
+        '<s:Header/><s:Body><wsmid:Identify/></s:Body></s:Envelope>'
+    )
+    
+    def _probe_tcp(self, timeout: float):
+        """Connect to the WinRM port."""
+        socket.create_connection((self.host, self.port), timeout=timeout).close()
+    
+    def _probe_identify(self, timeout: float):
+        """
+        Send an unauthenticated WS-Man Identify request.
+        
+        A 401 answer also counts: the WinRM service is listening, it just
+        does not answer Identify without credentials.
+        """
+        request = urllib.request.Request(
+            self.endpoint, data=self.IDENTIFY_REQUEST.encode(),
+            headers={'Content-Type': 'application/soap+xml;charset=UTF-8'}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                body = response.read().decode('utf-8', errors='replace')
+        except urllib.error.HTTPError as e:
+            if e.code == 401:
+                return
+            raise
+        if 'IdentifyResponse' not in body:
+            raise IOError(f"unexpected Identify response: {body[:200]!r}")
+    
+    def _probe_shell(self, timeout: float):
+        """Run a command in an authenticated shell."""
+        stdout, stderr, exit_code = self.execute_command("hostname")
+        if exit_code != 0:
+            raise IOError(stderr.strip() or f"hostname exited with {exit_code}")
+    
+    def wait_ready(self, deadline: float = 1800.0, max_delay: float = 30.0) -> dict:
+        """
+        Wait until the host accepts WinRM commands, e.g. while Windows is
+        still in OOBE or sysprep.
+        
+        The host is probed in three stages, each started only after the
+        previous one succeeded: a TCP connect to the WinRM port, an
+        unauthenticated WS-Man Identify and a command in an authenticated
+        shell. Failed probes are retried after an exponentially growing,
+        fully jittered delay of at most ``max_delay`` seconds.
+        
+        Args:
+            deadline: Seconds to wait in total before giving up
+            max_delay: Longest delay between two probes, in seconds
+        
+        Returns:
+            Dictionary with ``ready``, the number of probe ``attempts`` and
+            the seconds until each stage first succeeded (``tcp_seconds``,
+            ``winrm_seconds``, ``shell_seconds``; None if it never did)
+        """
+        stages = [
+            ('tcp', 'TCP port open', self._probe_tcp),
+            ('winrm', 'WS-Man Identify answered', self._probe_identify),
+            ('shell', 'Authenticated shell ready', self._probe_shell),
+        ]
+        result = {'ready': False, 'attempts': 0,
+                  'tcp_seconds': None, 'winrm_seconds': None, 'shell_seconds': None}
+        print(f"Waiting up to {deadline:g}s for WinRM on {self.host}:{self.port}...")
+        started = time.monotonic()
+        stage = attempt = 0
+        last_error = None
+        while not self.aborted.is_set():
+            key, label, probe = stages[stage]
+            remaining = deadline - (time.monotonic() - started)
+            result['attempts'] += 1
+            try:
+                probe(max(1.0, min(10.0, remaining)))
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                error = str(e) or type(e).__name__
+            else:
+                elapsed = time.monotonic() - started
+                result[f'{key}_seconds'] = round(elapsed, 3)
+                print(f"✓ {label} after {elapsed:.1f}s")
+                stage += 1
+                attempt = 0
+                if stage == len(stages):
+                    result['ready'] = True
+                    return result
+                continue
+            
+            if error != last_error:
+                print(f"  {key}: {error} (retrying)")
+                last_error = error
+            elapsed = time.monotonic() - started
+            if elapsed >= deadline:
+                print(f"✗ {self.host} not ready after {elapsed:.0f}s: {error}")
+                result['error'] = error
+                return result
+            # The last probe happens right at the deadline
+            self.aborted.wait(min(random.uniform(0, min(max_delay, 2 ** attempt)), deadline - elapsed))
+            attempt += 1
+        result['error'] = 'aborted'
+        return result
+
+
+_current_host: contextvars.ContextVar = contextvars.ContextVar("winrm_host", default=None)
+
+
+class HostOutput:
+    """
+    Stand-in for ``sys.stdout``/``sys.stderr`` while several hosts run at once.
+    
+    Text written in the context of a host is prefixed with the host's name,
+    one whole line at a time, and goes to ``hosts_stream`` (default:
+    ``stream``), so the output of concurrent hosts does not interleave
+    mid-line. Everything else passes through to ``stream`` unchanged. Text
+    of hosts that were given up on is dropped.
+    """
+    
+    def __init__(self, stream, width: int = 0, hosts_stream=None):
+        self.stream = stream
+        self.hosts_stream = hosts_stream or stream
+        self.width = width
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.abandoned = set()
+    
+    def write(self, text: str) -> int:
+        host = _current_host.get()
+        with self.lock:
+            if host is None:
+                return self.stream.write(text)
+            if host in self.abandoned:
+                return len(text)
+            *lines, self.pending[host] = (self.pending.get(host, '') + text).split('\n')
+            for line in lines:
+                self.hosts_stream.write(f"[{host:<{self.width}}] {line.rstrip()}\n")
+        return len(text)
+    
+    def finish(self, host: str, abandon: bool = False):
+        """Write what is left of a host's last line; drop its later output if ``abandon``."""
+        with self.lock:
+            rest = self.pending.pop(host, '')
+            if rest.strip():
+                self.hosts_stream.write(f"[{host:<{self.width}}] {rest.rstrip()}\n")
+            if abandon:
+                self.abandoned.add(host)
+    
+    def flush(self):
+        self.stream.flush()
+    
+    def isatty(self) -> bool:
+        return False
+    
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def parse_hosts(value: str, default_port: int) -> list:
+    """
+    Parse ``--hosts``: a file with one host per line, or a comma or space
+    separated list. Entries may carry a port (``host:5986``).
+    
+    Returns:
+        List of (host, port) tuples
+    """
+    if os.path.isfile(value):
+        with open(value) as f:
+            entries = [line.split('#', 1)[0] for line in f]
+    else:
+        entries = [value]
+    hosts = []
+    for entry in re.split(r'[\s,]+', ' '.join(entries)):
+        if not entry:
+            continue
+        host, _, port = entry.rpartition(':') if entry.count(':') == 1 else (entry, '', '')
+        hosts.append((host, int(port)) if port else (entry, default_port))
+    return hosts
+
+
+def run_on_host(client: WinRMClient, args) -> dict:
+    """
+    Wait for one host of a fan-out and/or run ``--command`` or
+    ``--get-logs`` on it. The client is closed afterwards.
+    
+    Returns:
+        Result record of the host for the aggregate JSON
+    """
+    started = time.monotonic()
+    result = {'host': client.host, 'port': client.port, 'status': 'ok', 'exit_code': 0}
+    try:
+        if args.wait_ready:
+            readiness = client.wait_ready(args.deadline)
+            result.update(readiness)
+            connected = readiness['ready']
+            if not connected:
+                result.update(status='not-ready', exit_code=None)
+        else:
+            connected = client.test_connection()
+            if not connected:
+                result.update(status='unreachable', exit_code=None)
+        if connected and args.get_logs:
+            logs = client.get_build_logs()
+            result['logs'] = logs
+            if len(logs) < len(client.BUILD_LOGS):
+                result.update(status='failed', exit_code=1)
+        elif connected and args.command:
+            stdout, stderr, exit_code = client.execute_command(args.command, args.shell)
+            if stdout:
+                print(stdout, end='')
+            if stderr:
+                print(stderr, file=sys.stderr, end='')
+            result.update(stdout=stdout, stderr=stderr, exit_code=exit_code)
+            if exit_code != 0:
+                result['status'] = 'failed'
+    except Exception as e:
+        print(f"✗ {e}")
+        result.update(status='error', exit_code=None, error=str(e))
+    finally:
+        client.close()
+    result['duration_seconds'] = round(time.monotonic() - started, 3)
+    return result
+
+
+def fan_out(hosts: list, args, timeout: float) -> list:
+    """
+    Run :func:`run_on_host` on many hosts at the same time.
+    
+    At most ``args.max_concurrent`` hosts run at once, each in its own
+    thread, with its output prefixed by the host's name. A host still busy
+    after ``timeout`` seconds is reported as timed out, its client is
+    aborted and its slot goes to the next host. Before returning, the
+    threads of aborted hosts are given ``args.request_timeout`` seconds to
+    end, and ``sys.stdout``/``sys.stderr`` are restored.
+    
+    Args:
+        hosts: List of (host, port) tuples
+        args: Parsed command line
+        timeout: Seconds each host may take
+    
+    Returns:
+        One result record per host, in the order of ``hosts``
+    """
+    labels = [host if port == args.port else f"{host}:{port}" for host, port in hosts]
+    stdout, stderr = sys.stdout, sys.stderr
+    width = max(len(label) for label in labels)
+    # With --json, stdout carries only the aggregate result
+    out = HostOutput(stdout, width, stderr if args.json else stdout)
+    err = HostOutput(stderr, width)
+    
+    done = queue.Queue()
+    clients = {}
+    threads = {}
+    
+    def worker(index: int):
+        _current_host.set(labels[index])
+        host, port = hosts[index]
+        try:
+            clients[index] = WinRMClient(host, args.user, args.password, port,
+                                         persistent=not args.no_persistent_shell,
+                                         timeout=args.request_timeout)
+            result = run_on_host(clients[index], args)
+        except BaseException as e:
+            result = {'host': host, 'port': port, 'status': 'error', 'exit_code': None, 'error': str(e)}
+        out.finish(labels[index])
+        err.finish(labels[index])
+        done.put((index, result))
+    
+    results = [None] * len(hosts)
+    running = {}
+    next_index = 0
+    sys.stdout, sys.stderr = out, err
+    try:
+        while next_index < len(hosts) or running:
+            while next_index < len(hosts) and len(running) < args.max_concurrent:
+                threads[next_index] = threading.Thread(target=worker, args=(next_index,),
+                                                       name=f"winrm-{labels[next_index]}", daemon=True)
+                threads[next_index].start()
+                running[next_index] = time.monotonic()
+                next_index += 1
+            try:
+                index, result = done.get(timeout=0.2)
+                # Results of hosts that already timed out are dropped
+                if running.pop(index, None) is not None:
+                    results[index] = result
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            for index, started in list(running.items()):
+                if now - started >= timeout:
+                    del running[index]
+                    if index in clients:
+                        clients[index].abort()
+                    out.finish(labels[index], abandon=True)
+                    err.finish(labels[index], abandon=True)
+                    print(f"[{labels[index]:<{width}}] ✗ timed out after {timeout:g}s",
+                          file=stderr, flush=True)
+                    results[index] = {'host': hosts[index][0], 'port': hosts[index][1],
+                                      'status': 'timeout', 'exit_code': None,
+                                      'duration_seconds': round(now - started, 3)}
+    finally:
+        # Also on Ctrl-C: stop the hosts still running, and wait for their
+        # last request so that nothing they print afterwards goes unprefixed
+        for index in running:
+            if index in clients:
+                clients[index].abort()
+        until = time.monotonic() + args.request_timeout
+        for thread in threads.values():
+            thread.join(max(0.0, until - time.monotonic()))
+        sys.stdout, sys.stderr = stdout, stderr
+    return results
+
+
+def print_summary(results: list, file=None):
+    """Print the per-host status and exit code table of a fan-out."""
+    file = file or sys.stdout
+    width = max(len(f"{r['host']}:{r['port']}") for r in results)
+    # Time to each --wait-ready stage
+    stages = ['tcp_seconds', 'winrm_seconds', 'shell_seconds'] if any('ready' in r for r in results) else []
+    print(f"\n{'='*60}", file=file)
+    print(f"{'host':<{width}}  {'status':<11}  {'exit':>4}  {'time':>8}"
+          + ''.join(f"  {stage.split('_')[0]:>8}" for stage in stages), file=file)
+    for r in results:
+        code = '-' if r['exit_code'] is None else r['exit_code']
+        waited = ''.join('         -' if r.get(stage) is None else f"  {r[stage]:>7.1f}s" for stage in stages)
+        print(f"{r['host'] + ':' + str(r['port']):<{width}}  {r['status']:<11}  {code:>4}  "
+              f"{r.get('duration_seconds', 0):>7.1f}s{waited}", file=file)
+    ok = sum(1 for r in results if r['status'] == 'ok')
+    print(f"{ok}/{len(results)} host(s) succeeded", file=file)
+
+
+def append_metrics(path: str, results: list):
+    """Append the ``--wait-ready`` times of every host to a JSON-lines file."""
+    when = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    with open(path, 'a') as f:
+        for r in results:
+            if 'ready' not in r:
+                continue
+            record = {'time': when, 'host': r['host'], 'port': r['port'], 'ready': r['ready'],
+                      'tcp_seconds': r['tcp_seconds'], 'winrm_seconds': r['winrm_seconds'],
+                      'shell_seconds': r['shell_seconds'], 'attempts': r['attempts']}
+            f.write(json.dumps(record) + '\n')
 
 
 def main():
@@ -200,10 +1022,46 @@ Examples:
   
   # Retrieve build logs
   python winrm-tool.py --host 192.168.1.95 --user Administrator --password packer --get-logs
+  
+  # Run a diagnostic on every build VM at once
+  python winrm-tool.py --hosts 192.168.1.95,192.168.1.96,192.168.1.97 \\
+      --user Administrator --password packer --command "Get-Service WinRM" --json
+  
+  # Retrieve build logs from the hosts listed in a file, four at a time
+  python winrm-tool.py --hosts build-vms.txt --get-logs --max-concurrent 4
+  
+  # Wait up to 20 minutes for Windows to finish OOBE, recording how long it took
+  python winrm-tool.py --hosts 192.168.1.95,192.168.1.96 --wait-ready --deadline 1200 \\
+      --metrics winrm-ready.jsonl
+  
+  # Follow the build logs until the build signals completion
+  python winrm-tool.py --host 192.168.1.95 --user Administrator --password packer \\
+      --follow --until 'Preparation complete'
+  
+  # Download a large or binary file (rerun to resume after a disconnect)
+  python winrm-tool.py --host 192.168.1.95 --user Administrator --password packer \\
+      --download 'C:\\Windows\\Logs\\CBS\\CBS.log' ./CBS.log --compress
         """
     )
     
-    parser.add_argument('--host', required=True, help='IP address or hostname of Windows VM')
+    parser.add_argument('--host', help='IP address or hostname of Windows VM')
+    parser.add_argument('--hosts', metavar='LIST|FILE',
+                       help='Run --command or --get-logs on many hosts at once: a comma separated '
+                            'list or a file with one host per line')
+    parser.add_argument('--max-concurrent', type=int, default=8, metavar='N',
+                       help='Hosts to run at the same time with --hosts (default: 8)')
+    parser.add_argument('--host-timeout', type=float, default=300.0, metavar='SECONDS',
+                       help='Give up on a host after this long with --hosts (default: 300)')
+    parser.add_argument('--request-timeout', type=float, default=30.0, metavar='SECONDS',
+                       help='Give up on a single WinRM request after this long (default: 30)')
+    parser.add_argument('--json', action='store_true',
+                       help='Print the aggregate result of --hosts or --wait-ready as JSON')
+    parser.add_argument('--wait-ready', action='store_true',
+                       help='Wait until WinRM accepts commands, then run the selected mode (if any)')
+    parser.add_argument('--deadline', type=float, default=1800.0, metavar='SECONDS',
+                       help='Give up waiting with --wait-ready after this long (default: 1800)')
+    parser.add_argument('--metrics', metavar='PATH',
+                       help='Append the --wait-ready times of each host to a JSON-lines file')
     parser.add_argument('--user', default='Administrator', help='Windows username (default: Administrator)')
     parser.add_argument('--password', default='packer', help='Windows password (default: packer)')
     parser.add_argument('--port', type=int, default=5985, help='WinRM port (default: 5985)')
@@ -211,31 +1069,107 @@ Examples:
     parser.add_argument('--get-logs', action='store_true', help='Retrieve build log files and exit')
     parser.add_argument('--shell', choices=['powershell', 'cmd'], default='powershell', 
                        help='Shell to use (default: powershell)')
+    parser.add_argument('--follow', action='store_true',
+                       help='Print new lines of the build logs as they are written')
+    parser.add_argument('--log', action='append', metavar='PATH',
+                       help='Remote log file to follow instead of the build logs (repeatable)')
+    parser.add_argument('--until', metavar='REGEX',
+                       help='Stop following after a line matching REGEX')
+    parser.add_argument('--interval', type=float, default=1.0, metavar='SECONDS',
+                       help='Shortest time between polls when following (default: 1)')
+    parser.add_argument('--gone-after', type=float, default=60.0, metavar='SECONDS',
+                       help='Stop following when the host has not answered for this long (default: 60)')
+    parser.add_argument('--download', nargs=2, metavar=('REMOTE', 'LOCAL'),
+                       help='Download a file in chunks, resuming a partial download, and exit')
+    parser.add_argument('--chunk-size', type=int, default=512, metavar='KIB',
+                       help='Download chunk size in KiB (default: 512)')
+    parser.add_argument('--compress', action='store_true',
+                       help='Gzip download chunks on the remote host (for text files such as logs)')
+    parser.add_argument('--no-persistent-shell', action='store_true',
+                       help='Open a new remote shell for every command instead of reusing one')
     
     args = parser.parse_args()
     
+    if bool(args.host) == bool(args.hosts):
+        parser.error('exactly one of --host and --hosts is required')
+    # pywinrm's operation timeout has to stay a whole second below it
+    if args.request_timeout < 2:
+        parser.error('--request-timeout must be at least 2 seconds')
+    
+    if args.hosts:
+        if not (args.command or args.get_logs or args.wait_ready):
+            parser.error('--hosts needs --command, --get-logs or --wait-ready')
+        if args.max_concurrent < 1:
+            parser.error('--max-concurrent must be at least 1')
+        try:
+            hosts = parse_hosts(args.hosts, args.port)
+        except (OSError, ValueError) as e:
+            parser.error(f'invalid --hosts: {e}')
+        if not hosts:
+            parser.error(f'no hosts in --hosts {args.hosts}')
+        
+        # Waiting does not eat into the time the command itself may take
+        timeout = args.deadline + args.host_timeout if args.wait_ready else args.host_timeout
+        results = fan_out(hosts, args, timeout)
+        if args.metrics:
+            append_metrics(args.metrics, results)
+        if args.json:
+            print_summary(results, file=sys.stderr)
+            print(json.dumps(results, indent=2))
+        else:
+            print_summary(results)
+        sys.exit(0 if all(r['status'] == 'ok' for r in results) else 1)
+    
     # Create client
-    client = WinRMClient(args.host, args.user, args.password, args.port)
-    
-    # Test connection
-    if not client.test_connection():
-        sys.exit(1)
-    
-    print()
-    
-    # Execute based on mode
-    if args.get_logs:
-        client.get_build_logs()
-    elif args.command:
-        stdout, stderr, exit_code = client.execute_command(args.command, args.shell)
-        if stdout:
-            print(stdout, end='')
-        if stderr:
-            print(stderr, file=sys.stderr, end='')
-        sys.exit(exit_code)
-    else:
-        # Interactive shell
-        client.interactive_shell()
+    client = WinRMClient(args.host, args.user, args.password, args.port,
+                         persistent=not args.no_persistent_shell, timeout=args.request_timeout)
+    
+    try:
+        if args.wait_ready:
+            # With --json, stdout carries only the result
+            with contextlib.redirect_stdout(sys.stderr if args.json else sys.stdout):
+                readiness = client.wait_ready(args.deadline)
+            record = dict(host=args.host, port=args.port, **readiness)
+            if args.metrics:
+                append_metrics(args.metrics, [record])
+            if args.json:
+                print(json.dumps(record, indent=2))
+            if not readiness['ready']:
+                sys.exit(1)
+            if not (args.download or args.follow or args.get_logs or args.command):
+                sys.exit(0)
+        # Test connection
+        elif not client.test_connection():
+            sys.exit(1)
+        
+        print()
+        
+        # Execute based on mode
+        if args.download:
+            ok = client.download_file(args.download[0], args.download[1],
+                                      chunk_size=args.chunk_size * 1024, compress=args.compress)
+            sys.exit(0 if ok else 1)
+        elif args.follow:
+            log_files = None
+            if args.log:
+                log_files = {path.replace('\\', '/').rsplit('/', 1)[-1]: path for path in args.log}
+            ok = client.follow_logs(log_files, until=args.until, interval=args.interval,
+                                    gone_after=args.gone_after)
+            sys.exit(0 if ok else 1)
+        elif args.get_logs:
+            client.get_build_logs()
+        elif args.command:
+            stdout, stderr, exit_code = client.execute_command(args.command, args.shell)
+            if stdout:
+                print(stdout, end='')
+            if stderr:
+                print(stderr, file=sys.stderr, end='')
+            sys.exit(exit_code)
+        else:
+            # Interactive shell
+            client.interactive_shell()
+    finally:
+        client.close()
 
 
 if __name__ == '__main__':